@@ -0,0 +1,30 @@
+"""Executing a module that compiles a template, with and without ahead-of-time compilation."""
+
+import builtins
+
+from htexpr import aot
+from htexpr.htexpr import compile_cache
+
+
+def _module(size):
+    rows = "".join(f"<tr><td>{i}</td><td>{{x}}</td></tr>" for i in range(size))
+    return f'import htexpr\nlayout = htexpr.compile("<table>{rows}</table>")\n'
+
+
+class ModuleStartup:
+    params = [10, 100, 1000]
+    param_names = ["rows"]
+
+    def setup(self, rows):
+        source = _module(rows)
+        self.plain = builtins.compile(source, "<plain>", "exec")
+        tree, _ = aot.transform(source)
+        self.compiled = builtins.compile(tree, "<aot>", "exec")
+
+    def time_compile_at_import(self, rows):
+        compile_cache.clear()
+        exec(self.plain, {})
+
+    def time_ahead_of_time(self, rows):
+        compile_cache.clear()
+        exec(self.compiled, {})
@@ -0,0 +1,64 @@
+"""Rendering a large table with each backend.
+
+The Dash backend builds components and serializes them the way Dash
+does, by calling ``to_plotly_json`` on each one; the JSON backend
+builds the serialized form directly. The HTML backend renders the table
+into an HTML string instead.
+"""
+
+import json
+import types
+
+from htexpr.htexpr import Htexpr
+
+from . import bench_hoist
+
+
+class Component(bench_hoist.Component):
+    def to_plotly_json(self):
+        props = {p: getattr(self, p) for p in self._prop_names if hasattr(self, p)}
+        props.update(
+            {
+                k: getattr(self, k)
+                for k in self.__dict__
+                if any(k.startswith(w) for w in self._valid_wildcard_attributes)
+            }
+        )
+        return {"props": props, "type": self._type, "namespace": self._namespace}
+
+
+html = types.ModuleType("html")
+html.Table = html.Tbody = html.Tr = html.Td = Component
+
+table = """
+<table>
+  <tbody>
+    [(<tr><td class="n">{i}</td><td>{i * i}</td><td>{str(i)[::-1]}</td></tr>)
+     for i in range(rows)]
+  </tbody>
+</table>
+"""
+
+
+def _default(value):
+    return value.to_plotly_json()
+
+
+class Table:
+    params = [[100, 10000]]
+    param_names = ["rows"]
+
+    def setup(self, rows):
+        self.templates = {
+            backend: Htexpr(table, backend=backend) for backend in ("dash", "json", "html")
+        }
+        self.bindings = {"html": html, "rows": rows}
+
+    def time_dash(self, rows):
+        json.dumps(self.templates["dash"].eval(self.bindings), default=_default)
+
+    def time_json(self, rows):
+        json.dumps(self.templates["json"].eval(self.bindings))
+
+    def time_html(self, rows):
+        self.templates["html"].eval(self.bindings)
@@ -0,0 +1,64 @@
+"""Children of elements with mixed static and comprehension content.
+
+Compares the single list display that htexpr generates for children
+with the chain of ``+`` concatenations it used to generate. The chain
+copies the accumulated list at every step, and for much wider content
+than here it is nested too deeply to compile at all.
+"""
+
+import ast
+
+from htexpr.htexpr import Htexpr, parse, simplify, to_ast
+
+
+def E(**kwargs):
+    return kwargs
+
+
+def _map_tag(tag):
+    return None, "E"
+
+
+def _template(width):
+    groups = "".join(
+        f"<tr><td>static {i}</td></tr>[ (<tr><td>{{j}}</td></tr>) for j in range(10) ]"
+        for i in range(width)
+    )
+    return f"<table>{groups}</table>"
+
+
+def _concatenated(body):
+    """Rewrite the children list display as the old chain of + operations."""
+    children = body.keywords[0].value
+    groups = []
+    for elt in children.elts:
+        if isinstance(elt, ast.Starred):
+            groups.append(elt.value)
+        elif groups and isinstance(groups[-1], ast.List):
+            groups[-1].elts.append(elt)
+        else:
+            groups.append(ast.List(elts=[elt], ctx=ast.Load()))
+    value = groups[0]
+    for group in groups[1:]:
+        value = ast.BinOp(left=value, op=ast.Add(), right=group)
+    body.keywords[0].value = value
+    return body
+
+
+class WideMixedContent:
+    params = [10, 100, 300]
+    param_names = ["width"]
+
+    def setup(self, width):
+        html = _template(width)
+        self.starred = Htexpr(html, map_tag=_map_tag).code
+        _, body = to_ast(simplify(parse(html)), map_tag=_map_tag)
+        expression = ast.fix_missing_locations(ast.Expression(body=_concatenated(body)))
+        self.concatenated = compile(expression, filename="<benchmark>", mode="eval")
+        self.bindings = {"E": E}
+
+    def time_starred(self, width):
+        eval(self.starred, self.bindings)
+
+    def time_concatenated(self, width):
+        eval(self.concatenated, self.bindings)
@@ -0,0 +1,32 @@
+"""Compiling a few hundred templates serially and with compile_many.
+
+The parallel compilation only pays off on a machine with several
+cores; on a single core it measures the overhead of the process pool.
+"""
+
+import htexpr
+
+from .bench_stages import baseline, template
+
+
+def _sources(count):
+    # templates of varying size, like the layouts and rows of an app
+    return [template(**{**baseline, "elements": 5 + i % 40, "code": 10 + i}) for i in range(count)]
+
+
+class CompileMany:
+    params = [[50, 300]]
+    param_names = ["templates"]
+    timeout = 120
+
+    def setup(self, templates):
+        self.sources = _sources(templates)
+
+    def time_serial(self, templates):
+        htexpr.compile_cache.clear()
+        for html in self.sources:
+            htexpr.compile(html, parser="scanner")
+
+    def time_compile_many(self, templates):
+        htexpr.compile_cache.clear()
+        htexpr.compile_many(self.sources, parser="scanner")
@@ -0,0 +1,42 @@
+"""Evaluating a layout with and without compile-time component lookup."""
+
+import types
+
+from htexpr.htexpr import Htexpr
+
+
+class Component:
+    def __init__(self, children=None, **props):
+        self.children = children
+        self.props = props
+
+
+html = types.ModuleType("html")
+html.Div = html.Span = html.Td = html.Tr = html.Table = Component
+
+
+def _layout(size):
+    rows = "".join(
+        f'<tr><td id="c{i}">{{x}}</td><td><span>{i}</span></td><td><div /></td></tr>'
+        for i in range(size // 5)
+    )
+    return f"<table>{rows}</table>"
+
+
+class Layout:
+    params = [1000]
+    param_names = ["elements"]
+
+    def setup(self, elements):
+        layout = _layout(elements)
+        modules = types.ModuleType("modules")
+        modules.html = html
+        self.attributes = Htexpr(layout)
+        self.resolved = Htexpr(layout, modules=modules)
+        self.bindings = {"html": html, "x": 1}
+
+    def time_attribute_lookup(self, elements):
+        self.attributes.eval(self.bindings)
+
+    def time_resolved(self, elements):
+        self.resolved.eval(self.bindings)
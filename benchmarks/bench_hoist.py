@@ -0,0 +1,77 @@
+"""Evaluating a table with a static header, with and without hoisting."""
+
+import types
+
+from htexpr.htexpr import Htexpr
+
+_props = ["children", "id", "className", "rowSpan", "colSpan", "style", "title", "key"]
+_props += [f"prop{i}" for i in range(22)]
+
+
+def _explicitize_args(function):
+    def wrapper(*args, **kwargs):
+        return function(*args, _explicit_args=list(kwargs), **kwargs)
+
+    return wrapper
+
+
+class Component:
+    """Stand-in for a generated Dash component.
+
+    Like the constructors of Dash components, this one lists the props
+    in new lists on each instance, and checks and sets each of the given
+    props as an attribute, formatting the prefix of a possible error
+    message for each.
+    """
+
+    @_explicitize_args
+    def __init__(self, children=None, **kwargs):
+        self._prop_names = list(_props)
+        self._type = "Component"
+        self._namespace = "benchmark"
+        self._valid_wildcard_attributes = ["data-", "aria-"]
+        self.available_properties = list(_props)
+        self.available_wildcard_properties = ["data-", "aria-"]
+        explicit = kwargs.pop("_explicit_args")
+        kwargs["children"] = children
+        for name in explicit + ["children"]:
+            wildcard = any([name.startswith(w) for w in self._valid_wildcard_attributes])
+            suffix = f' with the ID "{kwargs["id"]}"' if "id" in kwargs else ""
+            prefix = "The `{}.{}` component (version {}){}".format(
+                self._namespace, self._type, "1.0", suffix
+            )
+            if name not in self._prop_names and not wildcard:
+                raise TypeError(f"{prefix} received an unexpected keyword argument: `{name}`")
+            setattr(self, name, kwargs[name])
+
+
+html = types.ModuleType("html")
+html.Table = html.Thead = html.Tbody = html.Tr = html.Th = html.Td = Component
+
+
+def _table(columns):
+    header = "".join(f'<th rowspan="2">Column {i}</th>' for i in range(columns))
+    subheader = "".join(f'<th class="rt">({i})</th>' for i in range(columns))
+    cells = "".join(f"<td>{{i * {i}}}</td>" for i in range(columns))
+    return (
+        f"<table><thead><tr>{header}</tr><tr>{subheader}</tr></thead>"
+        f"<tbody>[(<tr>{cells}</tr>) for i in range(rows)]</tbody></table>"
+    )
+
+
+class StaticHeader:
+    params = ([5, 50], [1, 20])
+    param_names = ["columns", "rows"]
+
+    def setup(self, columns, rows):
+        table = _table(columns)
+        self.plain = Htexpr(table)
+        self.hoisted = Htexpr(table, hoist=True)
+        self.bindings = {"html": html, "rows": rows}
+        self.hoisted.eval(self.bindings)
+
+    def time_plain(self, columns, rows):
+        self.plain.eval(self.bindings)
+
+    def time_hoisted(self, columns, rows):
+        self.hoisted.eval(self.bindings)
@@ -0,0 +1,41 @@
+"""Startup cost of importing htexpr, measured with ``python -X importtime``.
+
+Each measurement runs a fresh interpreter, so the modules imported by
+htexpr itself are counted but the interpreter startup is not.
+"""
+
+import statistics
+import subprocess
+import sys
+
+#: Budget for the cumulative time of ``import htexpr``, in microseconds;
+#: the benchmark fails if the median exceeds it.
+BUDGET = 50_000
+
+
+def import_time(module):
+    """Return the cumulative import time of `module` in microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in reversed(result.stderr.splitlines()):
+        _, cumulative, name = line.split("|")
+        if name.strip() == module:
+            return int(cumulative)
+    raise ValueError(f"{module} not found in -X importtime output")
+
+
+class ImportTime:
+    params = ["htexpr", "htexpr.aot", "htexpr.grammar"]
+    param_names = ["module"]
+
+    def track_import_time(self, module):
+        median = statistics.median(import_time(module) for _ in range(5))
+        if module == "htexpr" and median > BUDGET:
+            raise AssertionError(f"import htexpr took {median} µs, budget is {BUDGET} µs")
+        return median
+
+    track_import_time.unit = "microseconds"
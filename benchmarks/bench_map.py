@@ -0,0 +1,34 @@
+"""Evaluating a row template for a batch of items.
+
+Compares calling ``run`` for each row, calling the function returned
+by ``as_function``, and ``map``, which evaluates the whole batch in one
+list comprehension.
+"""
+
+import htexpr
+
+from .bench_hoist import html
+
+ROW = "<tr><td>{i}</td><td>{chr(65 + i % 26)}</td><td>{i * 2}</td></tr>"
+
+
+class Map:
+    params = [["dash", "json", "html"]]
+    param_names = ["backend"]
+
+    def setup(self, backend):
+        self.template = htexpr.compile(ROW, backend=backend)
+        self.globals = {"html": html}
+        self.function = self.template.as_function("i", globals=self.globals)
+        self.items = range(2000)
+
+    def time_run(self, backend):
+        template = self.template
+        [template.run(i=i) for i in self.items]
+
+    def time_as_function(self, backend):
+        function = self.function
+        [function(i) for i in self.items]
+
+    def time_map(self, backend):
+        self.template.map(self.items, globals=self.globals)
@@ -0,0 +1,34 @@
+"""Evaluating a table template again with the same bindings.
+
+Compares evaluating the template with returning its memoized result,
+either as it is or as a copy.
+"""
+
+import types
+
+from htexpr.htexpr import Htexpr
+
+from .bench_hoist import Component
+
+TABLE = """
+<table>
+  [(<tr><td>{name}</td><td>{round(value, 2)}</td></tr>) for name, value in rows]
+</table>"""
+
+html = types.ModuleType("html")
+html.Table = html.Tr = html.Td = Component
+
+
+class Memoize:
+    params = [["none", "copy", "shared"]]
+    param_names = ["memo"]
+
+    def setup(self, memo):
+        self.template = Htexpr(TABLE)
+        if memo != "none":
+            self.template = self.template.memoize(copy=memo == "copy")
+        self.bindings = {"html": html, "rows": [(f"row {i}", i / 3) for i in range(200)]}
+        self.template.eval(self.bindings)
+
+    def time_eval(self, memo):
+        self.template.eval(self.bindings)
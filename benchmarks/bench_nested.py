@@ -0,0 +1,19 @@
+"""Simplifying templates with many elements nested in Python code.
+
+Each ``{(<b>...</b>)}`` region contains one nested element. The
+simplification should take time linear in the number of regions; it
+used to sort all the nested elements seen so far for every region.
+"""
+
+from htexpr.htexpr import parse, simplify
+
+
+class NestedSplices:
+    params = [1000, 2000, 4000, 8000]
+    param_names = ["regions"]
+
+    def setup(self, regions):
+        self.tree = parse("<div>" + "<p>{(<b>{i}</b>)}</p>" * regions + "</div>")
+
+    def time_simplify(self, regions):
+        simplify(self.tree)
@@ -0,0 +1,62 @@
+"""Patching a rendered table after one cell has changed.
+
+Compares the size of the whole table in JSON with the size of the
+operations that turn the previous table into the new one, and times
+computing them, for rows matched by key and by position, and for rows
+whose keys are injected by ``compile(..., keys=True)``.
+"""
+
+import json
+
+from htexpr import patch
+from htexpr.htexpr import Htexpr
+
+TABLE = """
+<table>
+  <tr><th>name</th><th>value</th></tr>
+  [(<tr key={name}><td>{name}</td><td>{value}</td></tr>) for name, value in rows]
+</table>"""
+
+
+class Patch:
+    params = [[100, 5000], ["key", "position"]]
+    param_names = ["rows", "match"]
+
+    def setup(self, rows, match):
+        template = Htexpr(TABLE, backend="json")
+        data = [(f"row {i}", i) for i in range(rows)]
+        self.old = template.eval({"rows": data})
+        # a changed cell and an inserted row
+        data[rows // 2] = ("row changed", -1)
+        data.insert(1, ("row new", 0))
+        self.new = template.eval({"rows": data})
+
+    def time_diff(self, rows, match):
+        patch.diff(self.old, self.new, match)
+
+    def track_tree_bytes(self, rows, match):
+        return len(json.dumps(self.new))
+
+    def track_patch_bytes(self, rows, match):
+        return len(json.dumps(patch.diff(self.old, self.new, match)))
+
+    track_tree_bytes.unit = "bytes"
+    track_patch_bytes.unit = "bytes"
+
+
+class InjectedKeys:
+    params = [[False, True]]
+    param_names = ["keys"]
+
+    def setup(self, keys):
+        source = TABLE.replace(" key={name}", "")
+        template = Htexpr(source, backend="json", keys=keys)
+        data = [f"row {i}" for i in range(1000)]
+        self.old = template.eval({"rows": [(name, 0) for name in data]})
+        # a row inserted at the top
+        self.new = template.eval({"rows": [(name, 0) for name in ["row new"] + data]})
+
+    def track_patch_bytes(self, keys):
+        return len(json.dumps(patch.diff(self.old, self.new)))
+
+    track_patch_bytes.unit = "bytes"
@@ -0,0 +1,34 @@
+"""Evaluating a row template many times serially and with render_many.
+
+Like compile_many, the process pool only pays off on a machine with
+several cores; on a single core it measures the overhead of sending
+the bindings and results between processes.
+"""
+
+import unicodedata
+
+import htexpr
+
+ROW = '<tr><td>{i}</td><td>{chr(i)}</td><td>{unicodedata.name(chr(i), "?")}</td></tr>'
+
+
+class RenderMany:
+    params = [[1000, 50000], ["json", "html"]]
+    param_names = ["rows", "backend"]
+    timeout = 120
+
+    def setup(self, rows, backend):
+        self.template = htexpr.compile(ROW, backend=backend)
+        self.bindings = [{"i": 0x1F600 + i % 0x400} for i in range(rows)]
+        self.globals = {"unicodedata": unicodedata}
+
+    def time_loop(self, rows, backend):
+        template = self.template
+        for item in self.bindings:
+            template.eval({**self.globals, **item})
+
+    def time_serial(self, rows, backend):
+        self.template.render_many(self.bindings, workers=1, globals=self.globals)
+
+    def time_render_many(self, rows, backend):
+        self.template.render_many(self.bindings, globals=self.globals)
@@ -0,0 +1,134 @@
+"""Each stage of compiling and evaluating generated templates.
+
+The templates scale along five axes, one at a time from a small
+baseline: the number of elements, their nesting depth, the number of
+attributes per element, the number of items generated by a list
+comprehension, and the size of an embedded Python expression. The
+stages are timed separately, and the ``track_peak_*`` benchmarks
+report the peak memory allocated by each stage, as measured by
+:mod:`tracemalloc`.
+"""
+
+import ast
+import builtins
+import tracemalloc
+
+from htexpr.htexpr import Htexpr, parse, simplify, to_ast, wrap_ast
+from htexpr.scanner import scan
+
+baseline = dict(elements=10, depth=1, attributes=1, width=10, code=10)
+
+shapes = {
+    "baseline": {},
+    "elements=1000": {"elements": 1000},
+    "depth=30": {"depth": 30},
+    "attributes=50": {"attributes": 50},
+    "width=1000": {"width": 1000},
+    "code=2000": {"code": 2000},
+}
+
+
+def template(elements, depth, attributes, width, code):
+    """Generate a template.
+
+    Args:
+        elements: number of leaf elements
+        depth: nesting depth of each leaf element
+        attributes: number of attributes of each leaf element, half of
+          them literals and half Python expressions
+        width: number of items generated by a list comprehension
+        code: number of items in a tuple display in a Python expression
+    """
+    attrs = "".join(f" a{i}={{x}}" if i % 2 else f' a{i}="v{i}"' for i in range(attributes))
+    leaf = f"<span{attrs}>leaf</span>"
+    for _ in range(depth - 1):
+        leaf = f"<div>{leaf}</div>"
+    expression = f"len(({', '.join(map(str, range(code)))},))"
+    return (
+        f"<div>{leaf * elements}<p>{{{expression}}}</p>"
+        f"<ul>[(<li>{{j}}</li>) for j in range(width)]</ul></div>"
+    )
+
+
+def E(children=None, **props):
+    return children, props
+
+
+class _Components:
+    def __getattr__(self, name):
+        return E
+
+
+def _compile(body):
+    tree = ast.fix_missing_locations(wrap_ast(body))
+    return builtins.compile(tree, filename="<benchmark>", mode="eval")
+
+
+class _Stages:
+    params = list(shapes)
+    param_names = ["shape"]
+
+    def setup(self, shape):
+        options = {**baseline, **shapes[shape]}
+        self.html = template(**options)
+        self.parsed = parse(self.html)
+        self.simplified = simplify(self.parsed)
+        self.body = to_ast(self.simplified)
+        self.code = _compile(self.body)
+        self.template = Htexpr(self.html)
+        self.bindings = {"html": _Components(), "x": 1, "width": options["width"]}
+
+
+class Stages(_Stages):
+    def time_parse(self, shape):
+        parse(self.html)
+
+    def time_simplify(self, shape):
+        simplify(self.parsed)
+
+    def time_scan(self, shape):
+        scan(self.html)
+
+    def time_to_ast(self, shape):
+        to_ast(self.simplified)
+
+    def time_wrap_and_compile(self, shape):
+        _compile(self.body)
+
+    def time_eval(self, shape):
+        self.template.eval(self.bindings)
+
+    def time_run(self, shape):
+        self.template.run(**self.bindings)
+
+
+def _peak(function, *args):
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class PeakMemory(_Stages):
+    def track_peak_parse(self, shape):
+        return _peak(parse, self.html)
+
+    def track_peak_simplify(self, shape):
+        return _peak(simplify, self.parsed)
+
+    def track_peak_to_ast(self, shape):
+        return _peak(to_ast, self.simplified)
+
+    def track_peak_wrap_and_compile(self, shape):
+        return _peak(_compile, self.body)
+
+    def track_peak_eval(self, shape):
+        return _peak(self.template.eval, self.bindings)
+
+    track_peak_parse.unit = "bytes"
+    track_peak_simplify.unit = "bytes"
+    track_peak_to_ast.unit = "bytes"
+    track_peak_wrap_and_compile.unit = "bytes"
+    track_peak_eval.unit = "bytes"
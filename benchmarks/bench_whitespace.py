@@ -0,0 +1,47 @@
+"""The size of an indented layout with whitespace preserved or collapsed."""
+
+import json
+
+from htexpr.htexpr import Htexpr
+
+
+class _Components:
+    def __getattr__(self, name):
+        return lambda children=None, **props: {
+            "type": name,
+            "props": {**props, "children": children},
+        }
+
+
+def _layout(sections):
+    section = """
+      <section>
+        <h2>Section {i}</h2>
+        <p>
+          Some text that is indented
+          like the rest of the template,
+          with {i} in the middle   of it.
+        </p>
+        <ul>
+          [(<li>{j} and {j + 1}</li>) for j in range(3)]
+        </ul>
+      </section>
+    """
+    return f"<div>[({section}) for i in range(sections)]</div>"
+
+
+class IndentedLayout:
+    params = [["preserve", "collapse"]]
+    param_names = ["whitespace"]
+
+    def setup(self, whitespace):
+        self.template = Htexpr(_layout(100), whitespace=whitespace)
+        self.bindings = {"html": _Components(), "sections": 100}
+
+    def time_eval(self, whitespace):
+        self.template.eval(self.bindings)
+
+    def track_json_bytes(self, whitespace):
+        return len(json.dumps(self.template.eval(self.bindings)))
+
+    track_json_bytes.unit = "bytes"
@@ -43,13 +43,13 @@ row1 = compile("""
   <td rowspan="2">{ unicodedata.category(chr(i)) }</td>
   <td rowspan="2">{ unicodedata.bidirectional(chr(i)) }</td>
 </tr>
-""")
+""").as_function("i")
 
 row2 = compile("""
 <tr>
   <td class="rt fw">U+{ f'{i:04x}' }</td>
 </tr>
-""")
+""").as_function("i")
 
 def parseint(x):
     try:
@@ -66,7 +66,7 @@ def update_table(from_, to, step):
     to = parseint(to)
     step = max(1, parseint(step))
     return [row
-            for pair in [(row1.run(), row2.run()) for i in range(from_, to+1, step)]
+            for pair in [(row1(i), row2(i)) for i in range(from_, to+1, step)]
             for row in pair]
 
 @app.callback(
@@ -1,2 +1,4 @@
-from .htexpr import compile, Htexpr
+__version__ = "0.1.2"
+
+from .htexpr import compile, compile_cache, compile_many, shutdown, warm, Htexpr
 from .exceptions import HtexprError
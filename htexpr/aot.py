@@ -0,0 +1,273 @@
+"""Ahead-of-time compilation of templates.
+
+Modules that compile templates at import time, e.g. with
+``app.layout = htexpr.compile("...").run()``, spend their startup time
+parsing templates. This module rewrites calls to :func:`htexpr.compile`
+whose template is a string literal, replacing them with a call to
+:func:`load` on the code compiled in advance. The compiled template is
+stored in the module's cached ``.pyc`` file, so importing the module
+does not parse anything.
+
+The calls are only rewritten if all of the keyword arguments are
+literals too, since options such as ``map_tag=mappings.dcc`` are only
+known at run time. Other calls are left unchanged.
+
+There are two ways to use this:
+
+- The build step ``python -m htexpr.aot DIRECTORY_OR_FILE...`` writes
+  the ``.pyc`` files of the given sources, like :mod:`compileall`.
+  Python uses them as long as the sources are not modified, so no
+  import hook is needed at run time.
+
+- :func:`install` adds an import hook that rewrites the given modules
+  whenever Python compiles them from source. It does not recompile
+  modules whose ``.pyc`` files are already up to date.
+"""
+
+import ast
+import importlib.machinery
+import importlib.util
+import marshal
+import os
+import sys
+
+from . import __version__, cache
+from .exceptions import HtexprError
+
+# argparse and tempfile are imported in the build step only, since
+# modules compiled ahead of time import this module at startup.
+
+_LOAD = "htexpr.aot"
+
+
+def transform(source, filename="<unknown>"):
+    """Rewrite the literal :func:`htexpr.compile` calls in Python `source`.
+
+    Returns:
+        tuple: the rewritten :class:`ast.Module` and the number of
+        calls that were rewritten
+    """
+    tree = ast.parse(source, filename)
+    modules, functions = _aliases(tree)
+    if not (modules or functions):
+        return tree, 0
+    rewriter = _Rewriter(modules, functions)
+    tree = ast.fix_missing_locations(rewriter.visit(tree))
+    return tree, rewriter.count
+
+
+def _aliases(tree):
+    """Find the names under which htexpr and htexpr.compile are imported."""
+    modules, functions = set(), set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.name == "htexpr":
+                    modules.add(alias.asname or "htexpr")
+        elif isinstance(node, ast.ImportFrom) and node.module == "htexpr" and not node.level:
+            for alias in node.names:
+                if alias.name == "compile":
+                    functions.add(alias.asname or "compile")
+    return modules, functions
+
+
+class _Rewriter(ast.NodeTransformer):
+    def __init__(self, modules, functions):
+        self.modules = modules
+        self.functions = functions
+        self.count = 0
+
+    def _is_compile(self, func):
+        if isinstance(func, ast.Name):
+            return func.id in self.functions
+        return (
+            isinstance(func, ast.Attribute)
+            and func.attr == "compile"
+            and isinstance(func.value, ast.Name)
+            and func.value.id in self.modules
+        )
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if not (
+            self._is_compile(node.func)
+            and len(node.args) == 1
+            and isinstance(node.args[0], ast.Constant)
+            and isinstance(node.args[0].value, str)
+            and all(keyword.arg is not None for keyword in node.keywords)
+        ):
+            return node
+        html = node.args[0].value
+        try:
+            options = {keyword.arg: ast.literal_eval(keyword.value) for keyword in node.keywords}
+            payload = dumps(html, **options)
+        except (ValueError, TypeError, SyntaxError, HtexprError):
+            # not literal, or an invalid template: leave the error to run time
+            return node
+        self.count += 1
+        load = ast.Attribute(
+            value=ast.Call(
+                func=ast.Name(id="__import__", ctx=ast.Load()),
+                args=[ast.Constant(value=_LOAD)],
+                keywords=[
+                    ast.keyword(
+                        arg="fromlist",
+                        value=ast.Tuple(elts=[ast.Constant(value="load")], ctx=ast.Load()),
+                    )
+                ],
+            ),
+            attr="load",
+            ctx=ast.Load(),
+        )
+        call = ast.Call(
+            func=load,
+            args=[ast.Constant(value=payload), node.args[0]],
+            keywords=node.keywords,
+        )
+        return ast.copy_location(call, node)
+
+
+def dumps(html, **options):
+    """Compile `html` and return the result as bytes for :func:`load`."""
+    from .htexpr import Htexpr
+
+    if options.get("modules") is not None:
+        raise TypeError("templates with modules cannot be compiled ahead of time")
+    template = Htexpr(html, **options)
+    payload = {"code": template.code, "names": template.names, "components": ()}
+    return marshal.dumps((cache._FORMAT, __version__, payload))
+
+
+def load(data, html, **options):
+    """Return the :class:`~htexpr.Htexpr` compiled ahead of time into `data`.
+
+    The template is also added to :data:`htexpr.compile_cache`. If
+    `data` was written by a different version of htexpr, `html` is
+    compiled again with :func:`htexpr.compile`.
+    """
+    from .htexpr import Htexpr, _key, _sizeof, compile, compile_cache
+
+    try:
+        fmt, version, payload = marshal.loads(data)
+    except (ValueError, EOFError, TypeError):
+        fmt = version = None
+    if fmt != cache._FORMAT or version != __version__:
+        return compile(html, **options)
+    template = Htexpr._from_payload(html, payload, **options)
+    key = _key(html, options)
+    if key is not None:
+        compile_cache.put(key, template, _sizeof(template))
+    return template
+
+
+def compile_file(path, optimize=-1):
+    """Write the ``.pyc`` file of the source file `path` with templates compiled.
+
+    Returns:
+        int: the number of templates compiled ahead of time
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    tree, count = transform(importlib.util.decode_source(data), path)
+    code = compile(tree, path, "exec", dont_inherit=True, optimize=optimize)
+    stat = os.stat(path)
+    header = importlib.util.MAGIC_NUMBER + b"".join(
+        (n & 0xFFFFFFFF).to_bytes(4, "little") for n in (0, int(stat.st_mtime), stat.st_size)
+    )
+    if optimize == -1:
+        target = importlib.util.cache_from_source(path)
+    else:
+        target = importlib.util.cache_from_source(path, optimization=optimize or "")
+    import tempfile
+
+    directory = os.path.dirname(target)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            marshal.dump(code, f)
+        os.replace(tmp, target)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return count
+
+
+class Loader(importlib.machinery.SourceFileLoader):
+    """Source file loader that compiles literal templates ahead of time."""
+
+    def source_to_code(self, data, path, *, _optimize=-1):
+        source = importlib.util.decode_source(data)
+        if "htexpr" not in source:
+            return super().source_to_code(data, path, _optimize=_optimize)
+        tree, _ = transform(source, path)
+        return compile(tree, path, "exec", dont_inherit=True, optimize=_optimize)
+
+
+class Finder:
+    """Meta path finder that uses :class:`Loader` for the given packages."""
+
+    def __init__(self, prefixes):
+        self.prefixes = tuple(prefixes)
+
+    def find_spec(self, fullname, path=None, target=None):
+        if not any(fullname == p or fullname.startswith(p + ".") for p in self.prefixes):
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path, target)
+        if spec is not None and type(spec.loader) is importlib.machinery.SourceFileLoader:
+            spec.loader = Loader(spec.loader.name, spec.loader.path)
+        return spec
+
+
+def install(*prefixes):
+    """Compile templates ahead of time in the modules and packages named by `prefixes`.
+
+    Returns:
+        Finder: the finder added to :data:`sys.meta_path`
+    """
+    finder = Finder(prefixes)
+    sys.meta_path.insert(0, finder)
+    return finder
+
+
+def uninstall():
+    """Remove the finders added by :func:`install`."""
+    sys.meta_path[:] = [finder for finder in sys.meta_path if not isinstance(finder, Finder)]
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="python -m htexpr.aot",
+        description="Write .pyc files with htexpr templates compiled ahead of time.",
+    )
+    parser.add_argument("paths", nargs="+", help="source files or directories")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not list the files")
+    args = parser.parse_args(argv)
+    status = 0
+    for path in args.paths:
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(root, name)
+                for root, dirs, names in os.walk(path)
+                for name in names
+                if name.endswith(".py")
+            )
+        else:
+            files = [path]
+        for name in files:
+            try:
+                count = compile_file(name)
+            except (OSError, SyntaxError, UnicodeDecodeError) as e:
+                print(f"{name}: {e}", file=sys.stderr)
+                status = 1
+                continue
+            if count and not args.quiet:
+                print(f"{name}: {count} template{'s' if count != 1 else ''}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,341 @@
+"""Caching of compiled templates.
+
+Compiling a template parses it, converts it into a Python syntax tree
+and compiles that into a code object. :func:`htexpr.compile` keeps the
+results in an :class:`LRUCache`, :data:`htexpr.compile_cache`, whose
+limits can be configured and whose statistics show whether templates
+get recompiled.
+
+Processes that compile the same templates over and over, such as
+restarted web server workers, can also store the results on disk by
+passing ``cache_dir`` to :func:`htexpr.compile`.
+
+The cache files are named by a key that covers the template source,
+the contents of the tag and attribute mappings, the htexpr version and
+the Python bytecode magic number. Since tag mappings that are functions
+can also depend on values outside the key, such as a module-level
+registry, the tags of the template are looked up again when an entry is
+loaded, and an entry whose tags map differently is recompiled, so stale
+entries are never used.
+"""
+
+import importlib.util
+import marshal
+import mmap
+import os
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict, namedtuple
+
+from . import __version__
+from .mappings import TagIndex
+
+# Bump this when the layout of the cached payload changes.
+_FORMAT = 4
+
+_SUFFIX = ".htc"
+
+
+def fingerprint(value):
+    """Return a string that identifies `value` across processes.
+
+    Mappings are fingerprinted by their contents, curried or partially
+    applied functions by the function and the arguments, and plain
+    functions by their qualified name and code. Other objects fall
+    back to their ``repr``. A value that contains itself, such as a
+    recursive closure, refers back to its enclosing fingerprint.
+    """
+    return _fingerprint(value, [])
+
+
+def _fingerprint(value, enclosing):
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        return repr(value)
+    if value is _unassigned:
+        return "unassigned"
+    if isinstance(value, types.ModuleType):
+        return f"module({value.__name__})"
+    if isinstance(value, (type, types.BuiltinFunctionType)):
+        return f"{type(value).__name__}({value.__module__}.{value.__qualname__})"
+    for depth, outer in enumerate(reversed(enclosing)):
+        if outer is value:
+            return f"back({depth})"
+    enclosing.append(value)
+    try:
+        return _fingerprint_contents(value, enclosing)
+    finally:
+        enclosing.pop()
+
+
+def _fingerprint_contents(value, enclosing):
+    if isinstance(value, TagIndex):
+        return f"TagIndex({_fingerprint(value.mappings, enclosing)})"
+    if isinstance(value, (tuple, list)):
+        return f"({','.join(_fingerprint(item, enclosing) for item in value)})"
+    if isinstance(value, (set, frozenset)):
+        return f"{{{','.join(sorted(_fingerprint(item, enclosing) for item in value))}}}"
+    if hasattr(value, "keys") and hasattr(value, "__getitem__"):
+        items = sorted(
+            f"{_fingerprint(k, enclosing)}:{_fingerprint(value[k], enclosing)}"
+            for k in value.keys()
+        )
+        return f"{{{','.join(items)}}}"
+    if all(hasattr(value, attr) for attr in ("func", "args", "keywords")):
+        # functools.partial and toolz.curry
+        return "partial({},{},{})".format(
+            _fingerprint(value.func, enclosing),
+            _fingerprint(value.args, enclosing),
+            _fingerprint(value.keywords or {}, enclosing),
+        )
+    if isinstance(value, types.FunctionType):
+        import hashlib
+
+        closure = tuple(map(_cell_contents, value.__closure__ or ()))
+        return "function({}.{},{},{},{})".format(
+            value.__module__,
+            value.__qualname__,
+            hashlib.sha256(marshal.dumps(value.__code__)).hexdigest(),
+            _fingerprint(value.__defaults__, enclosing),
+            _fingerprint(closure, enclosing),
+        )
+    return repr(value)
+
+
+# stands for a closure variable that has not been assigned yet
+_unassigned = object()
+
+
+def _cell_contents(cell):
+    try:
+        return cell.cell_contents
+    except ValueError:
+        return _unassigned
+
+
+def key(html, **options):
+    """Return the cache key of a template and its compilation options."""
+    # hashlib and tempfile are only imported when the disk cache is used
+    import hashlib
+
+    digest = hashlib.sha256()
+    for part in (
+        str(_FORMAT),
+        __version__,
+        importlib.util.MAGIC_NUMBER.hex(),
+        fingerprint(sorted(options.items())),
+        html,
+    ):
+        digest.update(part.encode("utf-8", "surrogatepass"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _path(directory, key):
+    return os.path.join(directory, key + _SUFFIX)
+
+
+def load(directory, key):
+    """Return the payload stored under `key`, or None if there is none.
+
+    The file is memory-mapped and unmarshalled directly from the
+    mapping. Unreadable or corrupt files count as missing.
+    """
+    try:
+        with open(_path(directory, key), "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return marshal.loads(data)
+    except (OSError, ValueError, EOFError, TypeError):
+        return None
+
+
+def store(directory, key, payload):
+    """Store the marshallable `payload` under `key`.
+
+    The file is written under a temporary name and renamed into place,
+    so concurrent readers never see a partial file. Failures to write,
+    including payloads that cannot be marshalled, are ignored, since the
+    cache is only an optimization.
+    """
+    import tempfile
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                marshal.dump(payload, f)
+            os.replace(tmp, _path(directory, key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    except (OSError, ValueError):
+        pass
+
+
+def normalize(value, typed=False):
+    """Return a hashable stand-in for `value` that is equal for equal contents.
+
+    Mappings, lists and sets are converted recursively; other values
+    are returned as is if they are hashable, or with `typed`, paired
+    with their type, so that e.g. ``1`` and ``1.0`` differ. Raises
+    :class:`TypeError` for other unhashable values.
+    """
+    if hasattr(value, "keys") and hasattr(value, "__getitem__"):
+        return (
+            "mapping",
+            frozenset((normalize(k, typed), normalize(value[k], typed)) for k in value.keys()),
+        )
+    if isinstance(value, (tuple, list)):
+        items = tuple(normalize(item, typed) for item in value)
+        return items if isinstance(value, tuple) else ("list", items)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(normalize(item, typed) for item in value)
+    hash(value)
+    return (type(value), value) if typed else value
+
+
+# objects whose size is not counted beyond the object itself
+_shared = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+
+def sizeof(value):
+    """Estimate the memory used by `value` and the objects it contains.
+
+    Lists, tuples and dictionaries are followed to their items, and
+    other objects to their ``__dict__``; classes, modules and functions
+    are counted without their contents. Objects reachable in several
+    ways are counted once.
+    """
+    total = 0
+    seen = set()
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        kind = type(item)
+        if kind is list or kind is tuple:
+            stack.extend(item)
+        elif kind is dict:
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif hasattr(item, "__dict__") and not isinstance(item, _shared):
+            stack.append(item.__dict__)
+    return total
+
+
+CacheInfo = namedtuple(
+    "CacheInfo", ["hits", "misses", "evictions", "maxsize", "currsize", "maxbytes", "currbytes"]
+)
+
+
+class LRUCache:
+    """A thread-safe least-recently-used cache.
+
+    Args:
+        maxsize: maximum number of entries, or None for no limit
+        maxbytes: maximum total size of the entries as reported to
+          :meth:`put`, or None for no limit
+        ttl: the number of seconds after which an entry expires, or
+          None if entries do not expire
+
+    The least recently used entries are evicted when either limit is
+    exceeded. An entry larger than `maxbytes` is not stored at all.
+    Expired entries are evicted when they are looked up, which counts
+    as a miss.
+    """
+
+    def __init__(self, maxsize=128, maxbytes=None, ttl=None):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._maxsize = maxsize
+        self._maxbytes = maxbytes
+        self._ttl = ttl
+        self._bytes = 0
+        self._hits = self._misses = self._evictions = 0
+
+    def get(self, key, default=None):
+        """Return the value stored under `key` and mark it as recently used."""
+        with self._lock:
+            try:
+                value, nbytes, expires = self._entries[key]
+            except KeyError:
+                self._misses += 1
+                return default
+            if expires is not None and time.monotonic() >= expires:
+                del self._entries[key]
+                self._bytes -= nbytes
+                self._evictions += 1
+                self._misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def put(self, key, value, nbytes=0):
+        """Store `value`, whose size is `nbytes`, under `key`."""
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            if self._maxbytes is not None and nbytes > self._maxbytes:
+                return
+            expires = None if self._ttl is None else time.monotonic() + self._ttl
+            self._entries[key] = value, nbytes, expires
+            self._bytes += nbytes
+            self._evict()
+
+    def _evict(self):
+        while self._entries and (
+            (self._maxsize is not None and len(self._entries) > self._maxsize)
+            or (self._maxbytes is not None and self._bytes > self._maxbytes)
+        ):
+            _, (_, nbytes, _) = self._entries.popitem(last=False)
+            self._bytes -= nbytes
+            self._evictions += 1
+
+    def configure(self, *, maxsize=..., maxbytes=..., ttl=...):
+        """Change the limits, evicting entries if they are now exceeded.
+
+        Limits that are not given are left unchanged; None means no limit.
+        A new `ttl` applies to the entries stored after the change.
+        """
+        with self._lock:
+            if maxsize is not ...:
+                self._maxsize = maxsize
+            if maxbytes is not ...:
+                self._maxbytes = maxbytes
+            if ttl is not ...:
+                self._ttl = ttl
+            self._evict()
+
+    def clear(self):
+        """Remove all entries and reset the statistics."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._hits = self._misses = self._evictions = 0
+
+    def info(self):
+        """Return the statistics and limits as a :class:`CacheInfo`."""
+        with self._lock:
+            return CacheInfo(
+                self._hits,
+                self._misses,
+                self._evictions,
+                self._maxsize,
+                len(self._entries),
+                self._maxbytes,
+                self._bytes,
+            )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and (entry[2] is None or time.monotonic() < entry[2])
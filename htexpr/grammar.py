@@ -0,0 +1,228 @@
+"""The parsimonious grammar of htexpr templates.
+
+This module is imported on the first template parsed with the default
+``parser="parsimonious"``, so that importing :mod:`htexpr` does not
+import parsimonious or build the grammar.
+"""
+
+from parsimonious.grammar import Grammar, NodeVisitor
+from parsimonious import exceptions as pe
+from parsimonious.exceptions import UndefinedLabel, VisitationError
+
+from .exceptions import HtexprError
+
+
+_grammar = Grammar(
+    r"""
+    document            = _ element _
+    _                   = ~'[ \t\n]*'
+    element             = elt_empty / elt_nonempty
+    elt_nonempty        = tag_open content tag_close
+    tag_open            = langle tag_name attributes rangle _
+    tag_close           = _ lclose tag_name rangle
+    elt_empty           = langle tag_name attributes rclose
+    langle              = ~r"\s*<\s*"
+    rangle              = ~r"\s*>\s*"
+    lclose              = ~r"\s*</\s*"
+    rclose              = ~r"\s*/>\s*"
+    attributes          = attr*
+    attr                = _ attr_name _ '=' _ attr_value
+    tag_name            = ~"[a-z][a-z0-9._-]*"i
+    attr_name           = ~"[a-z][a-z0-9._-]*"i
+    attr_value          = attr_value_literal / attr_value_pydict / attr_value_python / attr_value_pylist
+    attr_value_literal  = ~'"[^"]*"|\'[^\']*\''
+    attr_value_pydict   = lbrace python_expr_nocolon ':' python_expr rbrace
+    attr_value_python   = lbrace python_expr rbrace
+    attr_value_pylist   = lbracket python_expr rbracket
+    content             = content1*
+    content1            = content_python / content_pylist / element / text
+    content_python      = lbrace python_expr rbrace
+    content_pylist      = lbracket python_expr rbracket
+    lbrace              = ~r"{\s*"
+    rbrace              = ~r"\s*}"
+    lbracket            = ~r"[\[]\s*"
+    rbracket            = ~r"\s*]"
+    text                = ~r'[^<{\[]+'
+    python_expr         = (double3_str / single3_str / double_str / single_str / nested / parens / braces / brackets / other)*
+    python_expr_nocolon = (double3_str / single3_str / double_str / single_str / nested / parens / braces / brackets / nocolon)*
+    double3_str         = '"\""' ~r'([^"]|"[^"]|""[^"])*' '"\""'
+    single3_str         = "'''"  ~r"([^']|'[^']|''[^'])*" "'''"
+    double_str          = '"' ~r'([^"\\]|\\.)*' '"'
+    single_str          = "'" ~r"([^'\\]|\\.)*" "'"
+    nested              = ~r"\(\s*" element ")"
+    parens              = "(" python_expr ")"
+    braces              = "{" python_expr "}"
+    brackets            = "[" python_expr "]"
+    other               = ~'[^][(){}"\']+'
+    nocolon             = ~'[^][(){}"\':]+'
+    """
+)
+
+
+def parse(html):
+    try:
+        return _grammar.parse(html)
+    except pe.ParseError as e:
+        raise HtexprError(e)
+
+
+class SimplifyVisitor(NodeVisitor):
+    __slots__ = ("nested", "claimed")
+    visit_element = visit_content1 = NodeVisitor.lift_child
+    unwrapped_exceptions = (HtexprError,)
+
+    def __init__(self):
+        self.nested = []
+        self.claimed = {}
+
+    def visit(self, node):
+        """Visit the parse tree bottom-up like :meth:`NodeVisitor.visit`, without recursion."""
+        stack = [(node, [])]
+        while True:
+            node, children = stack[-1]
+            if len(children) < len(node.children):
+                stack.append((node.children[len(children)], []))
+                continue
+            stack.pop()
+            method = getattr(self, "visit_" + node.expr_name, self.generic_visit)
+            try:
+                value = method(node, children)
+            except (VisitationError, UndefinedLabel, *self.unwrapped_exceptions):
+                raise
+            except Exception as exc:
+                raise VisitationError(exc, type(exc), node) from exc
+            if not stack:
+                return value
+            stack[-1][1].append(value)
+
+    def generic_visit(self, node, children):
+        return node
+
+    def visit_document(self, node, children):
+        _, elt, _ = children
+        return elt
+
+    def visit__(self, node, children):
+        return None
+
+    def visit_elt_empty(self, node, children):
+        _, tag, attrs, _ = children
+        return {"element": {"tag": tag, "attrs": attrs}, "content": None, "start": node.start}
+
+    def visit_elt_nonempty(self, node, children):
+        (tag_open, attrs), content, tag_close = children
+        if tag_open != tag_close:
+            raise HtexprError(f"<{tag_open}> closed by </{tag_close}>")
+        if content and isinstance(content[-1], tuple) and content[-1][0] == "literal":
+            stripped = content[-1][1].rstrip()
+            if stripped:
+                content[-1] = ("literal", stripped)
+            else:
+                del content[-1]
+        return {
+            "element": {"tag": tag_open, "attrs": attrs},
+            "content": content,
+            "start": node.start,
+        }
+
+    def visit_tag_open(self, node, children):
+        (
+            _,
+            tag_name,
+            attrs,
+            _,
+            _,
+        ) = children
+        return tag_name, attrs
+
+    def visit_tag_close(self, node, children):
+        _, _, tag_name, _ = children
+        return tag_name
+
+    def visit_tag_name(self, node, children):
+        return node.text
+
+    visit_attr_name = visit_tag_name
+
+    def visit_attributes(self, node, children):
+        return children
+
+    def visit_attr(self, node, children):
+        _, name, _, _, _, value = children
+        return name, value
+
+    def visit_attr_value(self, node, children):
+        return children[0]
+
+    def visit_attr_value_literal(self, node, children):
+        return "literal", node.text[1:-1]
+
+    def visit_attr_value_pydict(self, node, children):
+        _, python1, _, python2, _ = children
+        return "python", [(f"{{{python1.text}:{python2.text}}}", None)]
+
+    def visit_attr_value_python(self, node, children):
+        _, python, _ = children
+        return "python", [(python.text, None)]
+
+    def visit_attr_value_pylist(self, node, children):
+        _, python, _ = children
+        return "pylist", [(python.text, None)]
+
+    def visit_content(self, node, children):
+        return children
+
+    def get_nested(self, node):
+        """Return the nested elements directly within `node`, in order.
+
+        The visit is post-order, so the elements within `node` are at
+        the end of `self.nested`, each one after the elements nested
+        within it. They are claimed from there once, in time linear in
+        their number, and remembered by the extent of `node`.
+        """
+        key = node.start, node.end
+        claimed = self.claimed.get(key)
+        if claimed is None:
+            claimed = []
+            nested = self.nested
+            minimum = node.end
+            while nested and nested[-1][0] >= node.start:
+                start, end, element = nested.pop()
+                if end <= minimum:
+                    claimed.append((start, end, element))
+                    minimum = start
+            claimed.reverse()
+            self.claimed[key] = claimed
+        return claimed
+
+    def get_interposed(self, node):
+        point = node.start
+        for start, end, element in self.get_nested(node):
+            if start > point:
+                yield node.full_text[point:start], None
+            yield node.full_text[start:end], element
+            point = end
+        if point < node.end:
+            yield node.full_text[point : node.end], None
+
+    def visit_content_python(self, node, children):
+        _, python, _ = children
+        return "python", list(self.get_interposed(python))
+
+    def visit_content_pylist(self, node, children):
+        _, python, _ = children
+        return "pylist", list(self.get_interposed(python))
+
+    def visit_text(self, node, children):
+        return "literal", node.text
+
+    def visit_nested(self, node, children):
+        _, element, _ = children
+        self.nested.append((node.start, node.end, element))
+
+    visit_double3_str = visit_single3_str = visit_double_str = visit_single_str = visit__
+    visit_parens = visit_braces = visit_brackets = visit_other = visit__
+
+
+def simplify(tree):
+    return SimplifyVisitor().visit(tree)
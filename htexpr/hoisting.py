@@ -0,0 +1,146 @@
+"""Building the static parts of templates once.
+
+An element whose attributes and children are all literals, and whose
+child elements are static too, evaluates to the same components every
+time. A template compiled with ``compile(html, hoist=True)`` builds
+each maximal static subtree only on its first evaluation and keeps the
+result in the :class:`Constants` of the template. Later evaluations
+return a copy made by :func:`clone`, which is much cheaper than calling
+the component constructors again, and callers that modify the returned
+components do not affect the kept original.
+
+The compiled code passes the components used by the subtree along with
+a function that builds it, so if the bindings of a later evaluation
+contain different components, for example another ``html`` module,
+the subtree is built again.
+"""
+
+import copy
+
+#: The name to which the :class:`Constants` are bound in compiled code.
+name = "__htexpr_static"
+
+_immutable = frozenset({str, bytes, int, float, complex, bool, type(None), type(...)})
+
+# whether instances of each class can be copied by copying their __dict__
+_plain = {}
+
+
+def _is_plain(kind):
+    return (
+        kind.__new__ is object.__new__
+        and kind.__dictoffset__ != 0
+        and kind.__reduce_ex__ is object.__reduce_ex__
+        and kind.__reduce__ is object.__reduce__
+        and not hasattr(kind, "__copy__")
+        and not any("__slots__" in vars(base) for base in kind.__mro__)
+    )
+
+
+def clone(value):
+    """Copy a tree of components, sharing only immutable values.
+
+    Lists and dictionaries are copied, and so are other objects that
+    have a ``__dict__``, after which the values of their attributes are
+    cloned in turn. Instances of plain classes, such as Dash components,
+    are copied without calling their constructor; other objects are
+    copied with :func:`copy.copy`. Objects without a ``__dict__``, such
+    as tuples, are shared. The value should not contain cycles.
+    """
+    return _replay(_plan(value), value)
+
+
+_COPY, _PLAIN, _OTHER = "copy", "plain", "other"
+
+
+def _plan(value):
+    """Return the steps that :func:`_replay` takes to clone `value`.
+
+    Each step ``(slot, key, action)`` copies the item `key` of a
+    container copied by an earlier step, and the copy, or its
+    ``__dict__``, becomes the container of the next slot. Immutable
+    values get no steps, so replaying does not visit them at all. The
+    tree is traversed with an explicit stack, so its depth is not
+    limited by the recursion limit.
+    """
+    steps = []
+    stack = [([value], 0)]
+    while stack:
+        container, slot = stack.pop()
+        for key, item in enumerate(container) if type(container) is list else container.items():
+            kind = type(item)
+            if kind in _immutable:
+                continue
+            if kind is list or kind is dict:
+                inner, action = item, _COPY
+            else:
+                plain = _plain.get(kind)
+                if plain is None:
+                    plain = _plain[kind] = _is_plain(kind)
+                if plain:
+                    inner, action = item.__dict__, _PLAIN
+                elif hasattr(item, "__dict__") and not isinstance(item, type):
+                    new = copy.copy(item)
+                    state = getattr(new, "__dict__", None)
+                    if new is item or state is None or state is item.__dict__:
+                        continue
+                    inner, action = item.__dict__, _OTHER
+                else:
+                    continue
+            steps.append((slot, key, action))
+            stack.append((inner, len(steps)))
+    return steps
+
+
+def _replay(steps, value):
+    slots = [[value]]
+    for slot, key, action in steps:
+        container = slots[slot]
+        item = container[key]
+        if action is _COPY:
+            new = inner = item.copy()
+        elif action is _PLAIN:
+            inner = item.__dict__.copy()
+            new = object.__new__(type(item))
+            new.__dict__ = inner
+        else:
+            new = copy.copy(item)
+            inner = new.__dict__
+        container[key] = new
+        slots.append(inner)
+    return slots[0][0]
+
+
+class Constants:
+    """The static subtrees of a template, built on first use.
+
+    Attributes:
+        values: dictionary from the index of each subtree to a tuple of
+          the components it was built with, the built value and the
+          steps of cloning it
+    """
+
+    __slots__ = ("values",)
+
+    def __init__(self):
+        self.values = {}
+
+    def __call__(self, index, components, build):
+        """Return a copy of subtree `index`, building it with `build` if needed.
+
+        Args:
+            index: the number of the subtree in the template
+            components: tuple of the components that the subtree calls
+            build: function of no arguments that builds the subtree
+
+        The subtree is built again if `components` differ from those it
+        was built with.
+        """
+        entry = self.values.get(index)
+        if entry is None or entry[0] != components:
+            value = build()
+            entry = self.values[index] = components, value, _plan(value)
+        return _replay(entry[2], entry[1])
+
+    def clear(self):
+        self.values.clear()
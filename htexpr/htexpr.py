@@ -1,23 +1,33 @@
 "Parse HTML with embedded Python expressions into Python code objects"
 
-from parsimonious.grammar import Grammar, NodeVisitor
-from parsimonious import exceptions as pe
 import ast
-from toolz import pipe, partial, first
-from functools import reduce, lru_cache
+import atexit
+import copy
 import itertools as it
 import builtins
+import importlib
+import keyword
+import marshal
+import os
+import re
 import textwrap
 import sys
+import threading
+import types
+from collections import namedtuple
+from collections.abc import Mapping
 
 from .exceptions import HtexprError
-from . import mappings
+from . import cache, hoisting, mappings, profiling, timing
 
 
-@lru_cache
-def compile(html, *, map_tag=None, map_attribute=None):
+def compile(html, **options):
     """Compile the html string into an Htexpr object.
 
+    The results are memoized in :data:`compile_cache`, so compiling the
+    same template with the same options again returns the same object.
+    Mappings passed as options are compared by their contents.
+
     Args:
 
         map_tag: tuple of callables or mappings that return for tag
@@ -34,28 +44,367 @@ def compile(html, *, map_tag=None, map_attribute=None):
           attributes to camel case, such as ``rowspan`` to
           ``rowSpan``.
 
+        cache_dir: optional directory for caching the compiled code
+          across processes (see :mod:`htexpr.cache`); the directory is
+          created if it does not exist.
+
+        parser: ``"parsimonious"`` (the default) parses the template
+          with the grammar in :mod:`htexpr.grammar`, ``"scanner"`` with
+          the faster hand-written parser in :mod:`htexpr.scanner`. Both
+          accept the same templates.
+
+        whitespace: ``"preserve"`` (the default) keeps the literal text
+          of the template as it is, apart from the whitespace around
+          tags, and ``"collapse"`` collapses each run of whitespace
+          into a single space and drops text that is only whitespace,
+          except within ``pre`` and ``textarea`` elements; see
+          :func:`collapse_whitespace`.
+
+        keys: if true, the elements generated by list comprehensions in
+          ``[...]`` regions get a ``key`` prop, so that React can match
+          them when items are inserted, removed or reordered. The key is
+          the value of the comprehension target, or, if `keys` is the
+          name of an attribute, such as ``"id"``, the value of that
+          attribute of the element when it has one; see
+          :func:`inject_keys`. Elements with a ``key`` attribute are
+          left alone.
+
+        backend: ``"dash"`` (the default) compiles each element into a
+          call of its component, and ``"json"`` into the dictionary
+          ``{"type": ..., "namespace": ..., "props": {...}}`` that
+          Dash would serialize the component into; see
+          :data:`htexpr.mappings.namespaces`. ``"html"`` compiles the
+          template into an HTML string; see :mod:`htexpr.markup`.
+
+        params: tuple of parameter names; if given, the template
+          compiles into a function of these parameters, so evaluating
+          it returns the function (see :meth:`Htexpr.as_function`).
+
+        batch: ``"map"`` or ``"starmap"`` to compile the template with
+          `params` into a function of an iterable instead, which
+          evaluates the template for each item in a single list
+          comprehension and returns the list. ``"map"`` binds each item
+          to the only parameter and ``"starmap"`` unpacks the items into
+          the parameters; see :meth:`Htexpr.map`.
+
+        profile: if true, each element and each ``{...}`` or ``[...]``
+          region is timed when the template is evaluated; see
+          :mod:`htexpr.profiling` and :attr:`Htexpr.profile`.
+
+        hoist: if true, the elements whose attributes and children are
+          all literals are built on the first evaluation only, and later
+          evaluations return copies of them; see :mod:`htexpr.hoisting`.
+
+        modules: a mapping or object (such as the :mod:`dash` package)
+          from which the module names returned by `map_tag` can be
+          looked up; if given, each component is looked up once at
+          compile time and bound into the code, instead of looking up
+          e.g. ``html.Div`` from the bindings on every evaluation.
+
     Returns:
         Htexpr: the compiled code
 
     """
-    return Htexpr(html, map_tag=map_tag, map_attribute=map_attribute)
+    key = _key(html, options)
+    if key is None:
+        return Htexpr(html, **options)
+    template = compile_cache.get(key)
+    if template is None:
+        template = Htexpr(html, **options)
+        compile_cache.put(key, template, _sizeof(template))
+    return template
+
+
+#: The :class:`~htexpr.cache.LRUCache` used by :func:`compile`.
+compile_cache = cache.LRUCache(maxsize=128)
+
+# for compatibility with functools.lru_cache, which compile used to be wrapped in;
+# compile_cache.info() has the full statistics
+_CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+def _cache_info():
+    info = compile_cache.info()
+    return _CacheInfo(info.hits, info.misses, info.maxsize, info.currsize)
+
+
+compile.cache_info = _cache_info
+compile.cache_clear = compile_cache.clear
+
+
+def _key(html, options):
+    """Return the key of :data:`compile_cache`, or None if the options cannot be normalized."""
+    try:
+        return html, cache.normalize({k: v for k, v in options.items() if v is not None})
+    except TypeError:
+        return None
+
+
+def warm(sources, **options):
+    """Compile each of the `sources` into :data:`compile_cache`.
+
+    Returns:
+        list: the compiled templates
+    """
+    return [compile(html, **options) for html in sources]
+
+
+# compile_many compiles fewer templates than this in the calling process
+_PARALLEL = 8
+
+
+def compile_many(sources, workers=None, **options):
+    """Compile each of the `sources` like :func:`compile`, in a pool of processes.
+
+    The templates that are not in :data:`compile_cache` are parsed and
+    compiled in up to `workers` processes, which default to the number
+    of CPUs, and the code objects are sent back marshalled and added to
+    the cache. Fewer than eight templates, options that cannot be
+    pickled, or a single worker, compile in the calling process instead.
+
+    Args:
+        sources: iterable of template sources
+        workers: maximum number of processes
+        options: options of :func:`compile`, the same for all templates
+
+    Returns:
+        list: the compiled templates, in the order of `sources`
+
+    Raises:
+        HtexprError: if any template fails to compile, after trying all
+          of them; the message names the first failing index, and the
+          ``errors`` attribute maps the index of each failing template
+          to its exception
+    """
+    sources = list(sources)
+    templates = [None] * len(sources)
+    keys = [_key(html, options) for html in sources]
+    pending = {}
+    for i, (html, key) in enumerate(zip(sources, keys)):
+        template = None if key is None else compile_cache.get(key)
+        if template is not None:
+            templates[i] = template
+        else:
+            pending.setdefault(html, []).append(i)
+    modules = options.get("modules")
+    arguments = {**_option_defaults, **options}
+    del arguments["modules"]
+    arguments["params"] = _params(options.get("params"))
+    arguments["resolve"] = modules is not None
+    results = _payloads(list(pending), arguments, workers)
+    errors = {}
+    for (html, indices), result in zip(pending.items(), results):
+        if not isinstance(result, BaseException):
+            try:
+                template = Htexpr._from_payload(html, marshal.loads(result), **options)
+            except Exception as e:
+                result = e
+        if isinstance(result, BaseException):
+            errors.update((i, result) for i in indices)
+            continue
+        key = keys[indices[0]]
+        if key is not None:
+            compile_cache.put(key, template, _sizeof(template))
+        for i in indices:
+            templates[i] = template
+    if errors:
+        first = min(errors)
+        others = f" (and {len(errors) - 1} more)" if len(errors) > 1 else ""
+        error = HtexprError(f"cannot compile template {first}{others}: {errors[first]}")
+        error.errors = dict(sorted(errors.items()))
+        raise error from errors[first]
+    return templates
+
+
+def _compile_payloads(sources, arguments):
+    """Return the marshalled payload, or the exception raised, for each source."""
+    results = []
+    for html in sources:
+        try:
+            results.append(marshal.dumps(_payload(html, **arguments)))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def _payloads(sources, arguments, workers):
+    """Like :func:`_compile_payloads`, but in a pool of `workers` processes.
+
+    The sources are sent to the processes in chunks, a few per process,
+    so that the processes stay busy without a round trip per template.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(sources))
+    if workers <= 1 or len(sources) < _PARALLEL:
+        return _compile_payloads(sources, arguments)
+    import pickle
+
+    try:
+        pickle.dumps(arguments)
+    except Exception:
+        return _compile_payloads(sources, arguments)
+    from concurrent.futures import ProcessPoolExecutor
+
+    size = -(-len(sources) // (4 * workers))
+    chunks = [sources[i : i + size] for i in range(0, len(sources), size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_compile_payloads, chunk, arguments) for chunk in chunks]
+        results = []
+        for chunk, future in zip(chunks, futures):
+            error = future.exception()
+            results.extend([error] * len(chunk) if error is not None else future.result())
+        return results
+
+
+def _sizeof(template):
+    """Estimate the memory used by a compiled template."""
+    return sys.getsizeof(template.html) + len(marshal.dumps(template.code))
+
+
+_option_defaults = dict(
+    map_tag=None,
+    map_attribute=None,
+    cache_dir=None,
+    parser="parsimonious",
+    whitespace="preserve",
+    keys=None,
+    backend="dash",
+    batch=None,
+    modules=None,
+    profile=False,
+    hoist=False,
+)
 
 
 class Htexpr:
-    """A code object that can be evaluated to effect a sequence of function calls."""
+    """A code object that can be evaluated to effect a sequence of function calls.
+
+    Attributes:
+        code: the compiled code object
+        names: sorted tuple of the free variables of the template, i.e.,
+          the names it expects to find in the bindings or builtins
+        profile: the :class:`~htexpr.profiling.Profile` of a template
+          compiled with ``profile=True``, otherwise None
+        constants: the :class:`~htexpr.hoisting.Constants` of a template
+          compiled with ``hoist=True``, otherwise None
+        memo: the :class:`~htexpr.cache.LRUCache` of the results of a
+          template memoized with :meth:`memoize`, otherwise None
+    """
 
-    __slots__ = ("code",)
+    __slots__ = (
+        "code",
+        "components",
+        "constants",
+        "html",
+        "memo",
+        "names",
+        "options",
+        "params",
+        "profile",
+        "_clone",
+        "_function",
+    )
 
-    def __init__(self, html, *, map_tag=None, map_attribute=None):
-        self.code = pipe(
+    def __init__(
+        self,
+        html,
+        *,
+        map_tag=None,
+        map_attribute=None,
+        cache_dir=None,
+        parser="parsimonious",
+        whitespace="preserve",
+        keys=None,
+        backend="dash",
+        params=None,
+        batch=None,
+        modules=None,
+        profile=False,
+        hoist=False,
+    ):
+        self.html = html
+        self.options = dict(
+            map_tag=map_tag,
+            map_attribute=map_attribute,
+            cache_dir=cache_dir,
+            parser=parser,
+            whitespace=whitespace,
+            keys=keys,
+            backend=backend,
+            batch=batch,
+            modules=modules,
+            profile=profile,
+            hoist=hoist,
+        )
+        self.params = params = _params(params)
+        payload = _payload(
             html,
-            parse,
-            simplify,
-            partial(to_ast, map_tag=map_tag, map_attribute=map_attribute),
-            wrap_ast,
-            ast.fix_missing_locations,
-            partial(builtins.compile, filename="<unknown>", mode="eval"),
+            map_tag=map_tag,
+            map_attribute=map_attribute,
+            cache_dir=cache_dir,
+            parser=parser,
+            whitespace=whitespace,
+            keys=keys,
+            backend=backend,
+            params=params,
+            batch=batch,
+            resolve=modules is not None,
+            profile=profile,
+            hoist=hoist,
+        )
+        self._bind(payload)
+
+    @classmethod
+    def _from_payload(cls, html, payload, **options):
+        """Create an Htexpr from a payload compiled earlier with the same options."""
+        self = cls.__new__(cls)
+        self.html = html
+        params = options.pop("params", None)
+        self.params = None if params is None else tuple(params)
+        self.options = {**_option_defaults, **options}
+        self._bind(payload)
+        return self
+
+    def _bind(self, payload):
+        modules, profile, hoist = (self.options[k] for k in ("modules", "profile", "hoist"))
+        rendered = self.options["backend"] == "html"
+        self.code = payload["code"]
+        self.names = payload["names"]
+        self.components = None
+        self.profile = profiling.profile(self.html) if profile else None
+        self.constants = hoisting.Constants() if hoist else None
+        self.memo = None
+        self._clone = False
+        self._function = None
+        if modules is not None or profile or hoist or rendered:
+            closure = {}
+            if modules is not None:
+                self.components = closure = {
+                    name: _component(modules, module, function)
+                    for (module, function, name) in payload["components"]
+                }
+            if profile:
+                closure = {**closure, **self.profile.bindings()}
+            if hoist:
+                closure = {**closure, hoisting.name: self.constants}
+            if rendered:
+                from . import markup
+
+                closure = {**closure, **markup.bindings}
+            factory = eval(self.code, {"__builtins__": builtins})
+            self._function = factory(**closure)
+
+    def _evaluate(self, namespace):
+        if self._function is None:
+            return eval(self.code, namespace)
+        # like eval, make the builtins available, which FunctionType
+        # only does on Python 3.10 and later
+        namespace.setdefault("__builtins__", builtins)
+        function = types.FunctionType(
+            self._function.__code__, namespace, None, None, self._function.__closure__
         )
+        return function if self.params is not None else function()
 
     def eval(self, bindings={}):
         """Evaluate the code object with the given bindings.
@@ -71,7 +420,9 @@ class Htexpr:
                 "<div>[(<span>{i}</span>) for i in range(10) if i not in removed]</div>"
             ).eval({**globals(), "removed": {1, 2, 3}})
         """
-        return eval(self.code, bindings)
+        if self.memo is not None:
+            return self._memoized(bindings)
+        return self._evaluate(bindings)
 
     def run(self, **bindings):
         """Evaluate the code object with the given bindings added to globals and locals.
@@ -80,6 +431,10 @@ class Htexpr:
         intended "for internal and specialized purposes only". A cleaner
         method that avoids this kind of magic is :meth:`eval`.
 
+        Only the free variables of the template (see :attr:`names`)
+        are looked up, and if any of them is not defined, a
+        :class:`NameError` is raised before evaluating anything.
+
         Example::
 
             from dash import html as html
@@ -88,238 +443,810 @@ class Htexpr:
             ).run(removed={1, 2, 3})
         """
         frame = sys._getframe(1)
-        return eval(self.code, {**frame.f_globals, **frame.f_locals, **bindings})
-
-
-_grammar = Grammar(
-    r"""
-    document            = _ element _
-    _                   = ~'[ \t\n]*'
-    element             = elt_empty / elt_nonempty
-    elt_nonempty        = tag_open content tag_close
-    tag_open            = langle tag_name attributes rangle _
-    tag_close           = _ lclose tag_name rangle
-    elt_empty           = langle tag_name attributes rclose
-    langle              = ~r"\s*<\s*"
-    rangle              = ~r"\s*>\s*"
-    lclose              = ~r"\s*</\s*"
-    rclose              = ~r"\s*/>\s*"
-    attributes          = attr*
-    attr                = _ attr_name _ '=' _ attr_value
-    tag_name            = ~"[a-z][a-z0-9._-]*"i
-    attr_name           = ~"[a-z][a-z0-9._-]*"i
-    attr_value          = attr_value_literal / attr_value_pydict / attr_value_python / attr_value_pylist
-    attr_value_literal  = ~'"[^"]*"|\'[^\']*\''
-    attr_value_pydict   = lbrace python_expr_nocolon ':' python_expr rbrace
-    attr_value_python   = lbrace python_expr rbrace
-    attr_value_pylist   = lbracket python_expr rbracket
-    content             = content1*
-    content1            = content_python / content_pylist / element / text
-    content_python      = lbrace python_expr rbrace
-    content_pylist      = lbracket python_expr rbracket
-    lbrace              = ~r"{\s*"
-    rbrace              = ~r"\s*}"
-    lbracket            = ~r"[\[]\s*"
-    rbracket            = ~r"\s*]"
-    text                = ~r'[^<{\[]+'
-    python_expr         = (double3_str / single3_str / double_str / single_str / nested / parens / braces / brackets / other)*
-    python_expr_nocolon = (double3_str / single3_str / double_str / single_str / nested / parens / braces / brackets / nocolon)*
-    double3_str         = '"\""' ~r'([^"]|"[^"]|""[^"])*' '"\""'
-    single3_str         = "'''"  ~r"([^']|'[^']|''[^'])*" "'''"
-    double_str          = '"' ~r'([^"\\]|\\.)*' '"'
-    single_str          = "'" ~r"([^'\\]|\\.)*" "'"
-    nested              = ~r"\(\s*" element ")"
-    parens              = "(" python_expr ")"
-    braces              = "{" python_expr "}"
-    brackets            = "[" python_expr "]"
-    other               = ~'[^][(){}"\']+'
-    nocolon             = ~'[^][(){}"\':]+'
+        namespace = _resolve(self.names, bindings, frame.f_locals, frame.f_globals)
+        if self.memo is not None:
+            return self._memoized(namespace)
+        return self._evaluate(namespace)
+
+    def memoize(self, maxsize=128, maxbytes=None, ttl=None, copy=True):
+        """Keep the results of :meth:`eval` and :meth:`run` for the values of the names.
+
+        The results are kept in :attr:`memo`, an
+        :class:`~htexpr.cache.LRUCache` with the given limits, by the
+        values of the free variables of the template (see :attr:`names`).
+        The values are compared by their types and contents, as in
+        :func:`~htexpr.cache.normalize`, so they should not change
+        after the call in ways that equality does not see. Values that
+        cannot be normalized, such as arrays, disable the cache for
+        that call. The size of each result is estimated by
+        :func:`~htexpr.cache.sizeof`.
+
+        The template itself is not changed, since templates returned by
+        :func:`compile` are shared by all its callers with the same
+        source and options; a memoized copy is returned instead, which
+        shares the compiled code but has its own :attr:`memo`.
+
+        Args:
+            maxsize: maximum number of results, or None for no limit
+            maxbytes: maximum estimated total size of the results, or
+              None for no limit
+            ttl: the number of seconds for which a result is used, or
+              None for no limit
+            copy: if true, each call returns a copy of the result, made
+              by :func:`hoisting.clone <htexpr.hoisting.clone>`, so
+              callers cannot change the kept results
+
+        Returns:
+            Htexpr: the memoized copy of the template
+
+        Example::
+
+            table = htexpr.compile(template).memoize(maxsize=32, ttl=60)
+        """
+        if self.params is not None:
+            raise HtexprError("templates with params cannot be memoized")
+        memoized = Htexpr.__new__(Htexpr)
+        for name in Htexpr.__slots__:
+            setattr(memoized, name, getattr(self, name))
+        memoized.memo = cache.LRUCache(maxsize=maxsize, maxbytes=maxbytes, ttl=ttl)
+        memoized._clone = copy
+        return memoized
+
+    def _memoized(self, namespace):
+        try:
+            key = cache.normalize(
+                tuple(namespace.get(name, _unbound) for name in self.names), typed=True
+            )
+        except TypeError:
+            return self._evaluate(namespace)
+        entry = self.memo.get(key)
+        if entry is None:
+            value = self._evaluate(namespace)
+            entry = value, hoisting._plan(value) if self._clone else None
+            self.memo.put(key, entry, cache.sizeof(value))
+        value, steps = entry
+        return value if steps is None else hoisting._replay(steps, value)
+
+    def as_function(self, *params, globals=None):
+        """Return a plain function of `params` that evaluates the template.
+
+        The parameters are local variables of the function, and other
+        names are looked up in `globals`, which defaults to the
+        caller's module globals. The globals are captured once, like
+        for a function defined in the calling module, so calling the
+        function does not build any dictionaries. Local variables of
+        the caller are not visible to the function.
+
+        If `params` are not given, the parameters of a template compiled
+        with ``params`` are used. Otherwise the template is compiled again
+        with the given parameters; this is memoized like :func:`compile`.
+
+        Example::
+
+            from dash import html
+            row = htexpr.compile("<tr><td>{i}</td><td>{i**2}</td></tr>").as_function("i")
+            rows = [row(i) for i in range(1000)]
+        """
+        if globals is None:
+            globals = sys._getframe(1).f_globals
+        template = self
+        if params != self.params and (params or self.params is None):
+            template = compile(self.html, **self.options, params=params)
+        return template._evaluate(globals)
+
+    def map(self, iterable, name="i", globals=None):
+        """Evaluate the template for each item of `iterable`, bound to `name`.
+
+        Like in :meth:`as_function`, the other names are looked up in
+        `globals`, which defaults to the module globals of the caller.
+        The template is compiled with ``batch="map"``, so the whole
+        batch is evaluated in a single list comprehension, without
+        building a namespace or calling a function for each item.
+
+        Returns:
+            list: the result of each evaluation
+
+        Example::
+
+            row = htexpr.compile("<tr><td>{i}</td><td>{i**2}</td></tr>")
+            rows = row.map(range(1000))
+        """
+        if globals is None:
+            globals = sys._getframe(1).f_globals
+        options = {**self.options, "batch": "map"}
+        return compile(self.html, **options, params=(name,))._evaluate(globals)(iterable)
+
+    def starmap(self, iterable, names, globals=None):
+        """Like :meth:`map`, but unpack each item of `iterable` into `names`.
+
+        Example::
+
+            row = htexpr.compile("<tr><td>{name}</td><td>{round(price, 2)}</td></tr>")
+            rows = row.starmap(prices.items(), ("name", "price"))
+        """
+        if globals is None:
+            globals = sys._getframe(1).f_globals
+        options = {**self.options, "batch": "starmap"}
+        return compile(self.html, **options, params=tuple(names))._evaluate(globals)(iterable)
+
+    def render_many(self, bindings, workers=None, chunksize=None, threshold=1000, globals=None):
+        """Evaluate the template for each of `bindings`, in a pool of processes.
+
+        Each item of `bindings` is a mapping of names, such as ``{"i":
+        1}``, that is added to `globals`, which defaults to the caller's
+        module globals; for a template compiled with ``params``, it maps
+        the parameters to their arguments. Like in :meth:`as_function`,
+        local variables of the caller are not visible.
+
+        The items are split into chunks of `chunksize` and evaluated in
+        up to `workers` processes, which default to the number of CPUs.
+        The processes compile the template from its source, and modules
+        among the globals and options are sent as their names and
+        imported in the processes. The results are sent back pickled, so
+        templates compiled with ``backend="json"`` or ``backend="html"``
+        transfer fastest. With fewer than `threshold` items, a single
+        worker, or globals or bindings that cannot be pickled, the
+        template is evaluated in the calling process. The processes are
+        kept for later calls until :func:`htexpr.shutdown`.
+
+        Returns:
+            list: the result of each evaluation, in the order of `bindings`
+
+        Example::
+
+            row = htexpr.compile("<tr><td>{i}</td><td>{chr(i)}</td></tr>")
+            rows = row.render_many({"i": i} for i in range(128000, 129000))
+        """
+        if globals is None:
+            globals = sys._getframe(1).f_globals
+        bindings = list(bindings)
+        namespace = {name: globals[name] for name in self.names if name in globals}
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers > 1 and bindings and len(bindings) >= threshold:
+            results = _render_parallel(self, namespace, bindings, workers, chunksize)
+            if results is not None:
+                return results
+        return _render(self, namespace, bindings)
+
+
+def _render(template, namespace, bindings):
+    """Evaluate `template` with each of `bindings` added to `namespace`.
+
+    The bindings become the parameters of a function compiled from the
+    template, so that evaluating it does not merge dictionaries.
     """
-)
+    namespace = {"__builtins__": builtins, **namespace}
+    if template.params is not None:
+        function = template._evaluate(namespace)
+        return [function(**item) for item in bindings]
+    functions = {}
+    results = []
+    for item in bindings:
+        names = tuple(item)
+        function = functions.get(names)
+        if function is None:
+            function = functions[names] = compile(
+                template.html, **template.options, params=names
+            )._evaluate(namespace)
+        results.append(function(**item))
+    return results
+
+
+# a module passed to a worker process by name
+_Module = namedtuple("_Module", ["name"])
+
+
+def _references(mapping):
+    """Replace the importable modules among the values of `mapping` by their names."""
+    return {
+        key: (
+            _Module(value.__name__)
+            if isinstance(value, types.ModuleType) and sys.modules.get(value.__name__) is value
+            else value
+        )
+        for key, value in mapping.items()
+    }
 
 
-def parse(html):
-    try:
-        return _grammar.parse(html)
-    except pe.ParseError as e:
-        raise HtexprError(e)
+def _dereference(mapping):
+    return {
+        key: importlib.import_module(value.name) if isinstance(value, _Module) else value
+        for key, value in mapping.items()
+    }
 
 
-class SimplifyVisitor(NodeVisitor):
-    __slots__ = ("nested",)
-    visit_element = visit_content1 = NodeVisitor.lift_child
-    unwrapped_exceptions = (HtexprError,)
+def _render_chunk(html, options, params, namespace, chunk):
+    """Compile and evaluate a template in a worker process on a pickled chunk of bindings."""
+    import pickle
 
-    def __init__(self):
-        self.nested = []
+    template = compile(html, **_dereference(options), params=params)
+    return _render(template, _dereference(namespace), pickle.loads(chunk))
 
-    def generic_visit(self, node, children):
-        return node
 
-    def visit_document(self, node, children):
-        _, elt, _ = children
-        return elt
+def _render_parallel(template, namespace, bindings, workers, chunksize):
+    """Evaluate the template in a process pool, or return None if the values cannot be pickled.
+
+    Each chunk of bindings is pickled before it is submitted, so that
+    an unpicklable binding anywhere cancels the chunks already submitted
+    instead of failing in the pool.
+    """
+    import pickle
+    from concurrent.futures.process import BrokenProcessPool
 
-    def visit__(self, node, children):
+    options = _references(template.options)
+    namespace = _references(namespace)
+    try:
+        pickle.dumps((options, namespace))
+    except Exception:
         return None
+    if chunksize is None:
+        chunksize = -(-len(bindings) // (4 * workers))
+    executor = _executor(workers)
+    futures = []
+    try:
+        for i in range(0, len(bindings), chunksize):
+            try:
+                chunk = pickle.dumps(bindings[i : i + chunksize])
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                return None
+            futures.append(
+                executor.submit(
+                    _render_chunk, template.html, options, template.params, namespace, chunk
+                )
+            )
+        return [value for future in futures for value in future.result()]
+    except BrokenProcessPool:
+        with _executors_lock:
+            if _executors.get((os.getpid(), workers)) is executor:
+                del _executors[os.getpid(), workers]
+        executor.shutdown(wait=False)
+        raise
 
-    def visit_elt_empty(self, node, children):
-        _, tag, attrs, _ = children
-        return {"element": {"tag": tag, "attrs": attrs}, "content": None, "start": node.start}
-
-    def visit_elt_nonempty(self, node, children):
-        (tag_open, attrs), content, tag_close = children
-        if tag_open != tag_close:
-            raise HtexprError(f"<{tag_open}> closed by </{tag_close}>")
-        if content and isinstance(content[-1], tuple) and content[-1][0] == "literal":
-            stripped = content[-1][1].rstrip()
-            if stripped:
-                content[-1] = ("literal", stripped)
-            else:
-                del content[-1]
-        return {
-            "element": {"tag": tag_open, "attrs": attrs},
-            "content": content,
-            "start": node.start,
-        }
 
-    def visit_tag_open(self, node, children):
-        _, tag_name, attrs, _, _, = children
-        return tag_name, attrs
+# the process pools of render_many by process and number of workers
+_executors = {}
+_executors_lock = threading.Lock()
 
-    def visit_tag_close(self, node, children):
-        _, _, tag_name, _ = children
-        return tag_name
 
-    def visit_tag_name(self, node, children):
-        return node.text
+def _executor(workers):
+    from concurrent.futures import ProcessPoolExecutor
 
-    visit_attr_name = visit_tag_name
+    key = os.getpid(), workers
+    with _executors_lock:
+        executor = _executors.get(key)
+        if executor is None:
+            executor = _executors[key] = ProcessPoolExecutor(max_workers=workers)
+    return executor
+
+
+def shutdown(wait=True):
+    """Shut down the worker processes that :meth:`Htexpr.render_many` keeps.
+
+    The processes are started on first use and kept for later calls;
+    they are shut down when the interpreter exits, or earlier with this
+    function, after which the next call starts new ones. Pools
+    inherited from a parent process are forgotten without being shut
+    down, since they belong to the parent.
+
+    Args:
+        wait: whether to wait for the processes to exit
+    """
+    with _executors_lock:
+        executors = list(_executors.items())
+        _executors.clear()
+    for (pid, _), executor in executors:
+        if pid == os.getpid():
+            executor.shutdown(wait=wait)
+
+
+atexit.register(shutdown)
+
+
+# stands for the names of a memoized template that are not bound
+_unbound = object()
+
+
+def _params(params):
+    """Check the parameter names and return them as a tuple, or None."""
+    if params is None:
+        return None
+    params = tuple(params)
+    for param in params:
+        if not (isinstance(param, str) and param.isidentifier()) or keyword.iskeyword(param):
+            raise HtexprError(f"invalid parameter name: {param!r}")
+    return params
+
+
+def _payload(
+    html,
+    *,
+    map_tag,
+    map_attribute,
+    cache_dir,
+    parser,
+    whitespace,
+    keys,
+    backend,
+    params,
+    batch,
+    resolve,
+    profile,
+    hoist,
+):
+    """Compile `html` into the payload bound by :meth:`Htexpr._bind`.
+
+    The payload is a marshallable dictionary of the code object, its
+    free names and the names of the components to resolve, so it can be
+    cached on disk or compiled in another process.
+    """
+    try:
+        front = _parsers[parser]
+    except KeyError:
+        raise HtexprError(f"unknown parser: {parser}") from None
+    try:
+        front += _whitespace[whitespace]
+    except KeyError:
+        raise HtexprError(f"unknown whitespace mode: {whitespace}") from None
+    if keys:
+        if backend == "html":
+            raise HtexprError("keys cannot be injected with the html backend")
+        attribute = keys if isinstance(keys, str) else None
+        front += (("keys", lambda tree: inject_keys(tree, attribute)),)
+    if backend not in _backends:
+        raise HtexprError(f"unknown backend: {backend}")
+    if resolve and backend != "dash":
+        raise HtexprError(f"modules cannot be resolved with the {backend} backend")
+    if batch is not None:
+        if batch not in ("map", "starmap"):
+            raise HtexprError(f"unknown batch mode: {batch}")
+        if params is None or (batch == "map" and len(params) != 1):
+            raise HtexprError(
+                f"batch={batch!r} needs {'one parameter' if batch == 'map' else 'params'}"
+            )
+    if map_tag is None:
+        map_tag = mappings.default
+    if map_attribute is None:
+        map_attribute = mappings.default_attributes
+    stage = timing.stage_runner()
+    payload = None
+    if cache_dir is not None:
+        key = cache.key(
+            html,
+            map_tag=map_tag,
+            map_attribute=map_attribute,
+            params=params,
+            batch=batch,
+            resolve=resolve,
+            profile=bool(profile),
+            hoist=bool(hoist),
+            whitespace=whitespace,
+            keys=keys,
+            backend=backend,
+        )
+        payload = stage("load", html, cache.load, cache_dir, key)
+        if not (
+            isinstance(payload, dict)
+            and isinstance(payload.get("code"), types.CodeType)
+            and _still_resolved(payload.get("tags"), map_tag)
+        ):
+            payload = None
+    if payload is None:
+        map_tag = mappings.index(map_tag)
+        if cache_dir is not None:
+            map_tag, tags = _recording(map_tag)
+        components = {} if resolve else None
+        tree = html
+        for name, function in front:
+            tree = stage(name, html, function, tree)
+        body = stage(
+            "to_ast",
+            html,
+            to_ast,
+            tree,
+            map_tag,
+            map_attribute,
+            components,
+            profile,
+            hoist,
+            backend,
+        )
+        tree = stage(
+            "wrap_ast", html, wrap_ast, body, params, components, profile, hoist, backend, batch
+        )
+        tree = stage("fix_missing_locations", html, fix_missing_locations, tree)
+        payload = {
+            "code": stage("compile", html, _compile, tree),
+            "names": stage("free_names", html, free_names, tree),
+            "components": tuple((*pair, name) for pair, name in (components or {}).items()),
+        }
+        if cache_dir is not None:
+            payload["tags"] = tuple(tags.items())
+            cache.store(cache_dir, key, payload)
+    return payload
 
-    def visit_attributes(self, node, children):
-        return children
 
-    def visit_attr(self, node, children):
-        _, name, _, _, _, value = children
-        return name, value
+def _recording(map_tag):
+    """Return a tag mapping that records the lookups of `map_tag`, and the record.
 
-    def visit_attr_value(self, node, children):
-        return children[0]
+    The lookups are stored with the compiled code on disk, since tag
+    mappings that are functions can read values that the cache key does
+    not cover, such as a module-level registry.
+    """
+    if not isinstance(map_tag, tuple):
+        map_tag = (map_tag,)
+    tags = {}
 
-    def visit_attr_value_literal(self, node, children):
-        return "literal", node.text[1:-1]
+    def lookup(tag):
+        value = tags[tag] = mappings._find(tag, map_tag)
+        return value
 
-    def visit_attr_value_pydict(self, node, children):
-        _, python1, _, python2, _ = children
-        return "python", [(f"{{{python1.text}:{python2.text}}}", None)]
+    return lookup, tags
 
-    def visit_attr_value_python(self, node, children):
-        _, python, _ = children
-        return "python", [(python.text, None)]
 
-    def visit_attr_value_pylist(self, node, children):
-        _, python, _ = children
-        return "pylist", [(python.text, None)]
+def _still_resolved(tags, map_tag):
+    """Return whether `map_tag` still maps the (tag, value) pairs of `tags` as recorded."""
+    if not isinstance(tags, tuple):
+        return False
+    map_tag = mappings.index(map_tag)
+    if not isinstance(map_tag, tuple):
+        map_tag = (map_tag,)
+    return all(mappings._find(tag, map_tag) == value for tag, value in tags)
 
-    def visit_content(self, node, children):
-        return children
 
-    def get_nested(self, node):
-        minimum = node.start
-        for (start, end, element) in sorted(self.nested):
-            if start < minimum:
-                continue
-            if start >= node.end:
+def _component(modules, module, function):
+    """Look up the component for (module, function) in the modules namespace."""
+    try:
+        if module is not None:
+            modules = modules[module] if isinstance(modules, Mapping) else getattr(modules, module)
+        if isinstance(modules, Mapping):
+            return modules[function]
+        return getattr(modules, function)
+    except (KeyError, AttributeError):
+        raise HtexprError(
+            f"cannot resolve component {function if module is None else f'{module}.{function}'}"
+        ) from None
+
+
+def _resolve(names, *scopes):
+    """Look up names in the scopes, the last of which is a globals dict."""
+    namespace = {}
+    missing = []
+    builtin = scopes[-1].get("__builtins__", builtins)
+    if isinstance(builtin, types.ModuleType):
+        builtin = builtin.__dict__
+    for name in names:
+        for scope in scopes:
+            if name in scope:
+                namespace[name] = scope[name]
                 break
-            yield start, end, element
-            minimum = end
+        else:
+            if name not in builtin:
+                missing.append(name)
+    if missing:
+        raise NameError(f"name{'s' * (len(missing) > 1)} not defined: {', '.join(missing)}")
+    namespace["__builtins__"] = builtin
+    return namespace
+
+
+# The parsers and their dependencies are imported on first use.
+_lazy = frozenset({"_grammar", "parse", "simplify", "SimplifyVisitor"})
+
+
+def __getattr__(name):
+    if name in _lazy:
+        from . import grammar
+
+        return getattr(grammar, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _parse(html):
+    from .grammar import parse
+
+    return parse(html)
 
-    def get_interposed(self, node):
-        point = node.start
-        for (start, end, element) in self.get_nested(node):
-            if start > point:
-                yield node.full_text[point:start], None
-            yield node.full_text[start:end], element
-            point = end
-        if point < node.end:
-            yield node.full_text[point : node.end], None
 
-    def visit_content_python(self, node, children):
-        _, python, _ = children
-        return "python", list(self.get_interposed(python))
+def _simplify(tree):
+    from .grammar import simplify
 
-    def visit_content_pylist(self, node, children):
-        _, python, _ = children
-        return "pylist", list(self.get_interposed(python))
+    return simplify(tree)
 
-    def visit_text(self, node, children):
-        return "literal", node.text
 
-    def visit_nested(self, node, children):
-        _, element, _ = children
-        self.nested.append((node.start, node.end, element))
+def _scan(html):
+    from .scanner import scan
 
-    visit_double3_str = visit_single3_str = visit_double_str = visit_single_str = visit__
-    visit_parens = visit_braces = visit_brackets = visit_other = visit__
+    return scan(html)
 
 
-def simplify(tree):
-    return SimplifyVisitor().visit(tree)
+# the stages of each parser, from the template to the simplified tree
+_parsers = {
+    "parsimonious": (("parse", _parse), ("simplify", _simplify)),
+    "scanner": (("scan", _scan),),
+}
 
 
-def to_ast(tree, map_tag=None, map_attribute=None):
+_spaces = re.compile(r"[ \t\n\r\f]+")
+
+# elements whose text is rendered as is
+_preformatted = frozenset({"pre", "textarea"})
+
+
+def collapse_whitespace(tree):
+    """Collapse the whitespace in the literal text of the simplified tree.
+
+    Each run of whitespace becomes a single space, as it would when the
+    HTML is rendered, and text that is only whitespace is dropped. The
+    text within ``pre`` and ``textarea`` elements, including elements
+    nested in Python code within them, is left as it is. The tree is
+    modified in place and returned.
+    """
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, tuple):
+            # a python or pylist region: only its nested elements matter
+            stack.extend(subtree for (_, subtree) in node[1] if subtree is not None)
+            continue
+        if node["element"]["tag"].lower() in _preformatted or not node["content"]:
+            continue
+        content = []
+        for child in node["content"]:
+            if isinstance(child, tuple) and child[0] == "literal":
+                text = _spaces.sub(" ", child[1])
+                if text != " ":
+                    content.append(("literal", text))
+            else:
+                content.append(child)
+                stack.append(child)
+        node["content"] = content
+    return tree
+
+
+# the stages of each whitespace mode after parsing
+_whitespace = {
+    "preserve": (),
+    "collapse": (("whitespace", collapse_whitespace),),
+}
+
+
+def inject_keys(tree, attribute=None):
+    """Add a ``key`` attribute to the elements generated by list comprehensions.
+
+    In each ``[...]`` region of the simplified tree, the elements that
+    are the items of a list comprehension or generator expression, also
+    as either branch of a conditional expression, get the attribute
+    ``key={str(target)}``, where `target` is the target of the
+    comprehension, or the targets of all its ``for`` clauses. With
+    `attribute`, the value of that attribute is used instead, if the
+    element has it. Elements that already have a ``key`` are left
+    alone. The tree is modified in place and returned.
+    """
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, tuple):
+            if node[0] == "pylist":
+                _inject_keys(node[1], attribute)
+            stack.extend(subtree for (_, subtree) in node[1] if subtree is not None)
+            continue
+        stack.extend(value for (_, value) in node["element"]["attrs"] if _is_code(value))
+        stack.extend(
+            child for child in node["content"] or () if _is_code(child) or isinstance(child, dict)
+        )
+    return tree
+
+
+def _inject_keys(body, attribute):
+    """Add keys to the elements generated by comprehensions in the code of a pylist region."""
+    code = "".join(
+        text if subtree is None else f"__htexpr_{i}" for i, (text, subtree) in enumerate(body)
+    )
+    source = f"[{code}]"
+    try:
+        parsed = ast.parse(source, mode="eval")
+    except SyntaxError:
+        # reported when the region is compiled
+        return
+    for node in ast.walk(parsed):
+        if not isinstance(node, (ast.ListComp, ast.GeneratorExp)):
+            continue
+        targets = [ast.get_source_segment(source, g.target) for g in node.generators]
+        target = targets[0] if len(targets) == 1 else ", ".join(f"({t})" for t in targets)
+        items = [node.elt]
+        while items:
+            item = items.pop()
+            if isinstance(item, ast.IfExp):
+                items += item.body, item.orelse
+            elif isinstance(item, ast.Name) and item.id.startswith("__htexpr_"):
+                element = body[int(item.id[len("__htexpr_") :])][1]["element"]
+                attrs = dict(element["attrs"])
+                if "key" in attrs:
+                    continue
+                key = ("python", [(f"str(({target}))", None)])
+                value = attrs.get(attribute)
+                if value is not None and value[0] == "literal":
+                    key = value
+                elif value is not None and value[0] == "python" and len(value[1]) == 1:
+                    key = ("python", [(f"str(({value[1][0][0]}))", None)])
+                element["attrs"] = [*element["attrs"], ("key", key)]
+
+
+def to_ast(
+    tree,
+    map_tag=None,
+    map_attribute=None,
+    components=None,
+    profile=False,
+    hoist=False,
+    backend="dash",
+):
+    """Convert the simplified tree into a pair (kind, Python syntax tree).
+
+    The tree is traversed with an explicit stack of frames ``(tree,
+    subtrees, component, results)``, so its depth is not limited by the
+    recursion limit.
+
+    With `hoist`, the maximal static subtrees are wrapped in calls to
+    the :class:`~htexpr.hoisting.Constants` of the template. Whether an
+    element is static is known when its frame is popped, but whether it
+    is maximal only when its parent's is, so the parent does the wrapping.
+
+    The `backend` selects the code generated for each element.
+    """
     if map_tag is None:
         map_tag = mappings.default
     if map_attribute is None:
         map_attribute = mappings.default_attributes
-    recur = partial(to_ast, map_tag=map_tag, map_attribute=map_attribute)
+    if backend == "html":
+        # attributes are written as in HTML, so they are mapped the other way
+        map_attribute = {value: key for key, value in map_attribute.items()}
+    static = set() if hoist else None
+    count = it.count()
+    stack = [_frame(tree, map_tag)]
+    while True:
+        tree, subtrees, component, results = stack[-1]
+        if len(results) < len(subtrees):
+            stack.append(_frame(subtrees[len(results)], map_tag))
+            continue
+        stack.pop()
+        if static is not None:
+            if component is not None and all(_is_static(s, static) for s in subtrees):
+                static.add(id(tree))
+            else:
+                results = [
+                    _hoist(next(count), result) if id(subtree) in static else result
+                    for subtree, result in zip(subtrees, results)
+                ]
+        if component is None:
+            result = _code_to_ast(tree, results)
+        else:
+            result = _element_to_ast(
+                tree, component, results, map_attribute, components, profile, backend
+            )
+        if not stack:
+            if static is not None and id(tree) in static:
+                result = _hoist(next(count), result)
+            return result
+        stack[-1][3].append(result)
+
+
+def _frame(tree, map_tag):
     if isinstance(tree, tuple):
         kind, body = tree
         if kind == "literal":
-            return "scalar", ast.Str(s=body, col_offset=0, lineno=1)
+            return tree, (), None, []
         elif kind in ("python", "pylist"):
-            splice = {
-                f"__htexpr_{i}": recur(subtree)[1]
-                for i, (text, subtree) in enumerate(body)
-                if subtree is not None
-            }
-            code = pipe(
-                (
-                    text if subtree is None else f"__htexpr_{i}"
-                    for i, (text, subtree) in enumerate(body)
-                ),
-                "".join,
-                str.splitlines,
-                partial(it.dropwhile, lambda line: not line.strip()),
-                "\n".join,
-                textwrap.dedent,
-            )
-            parsed = ast.parse(f"[{code}]" if kind == "pylist" else code, mode="eval").body
-            modified = SpliceSubtrees(splice).visit(parsed)
-            return ("list" if kind == "pylist" else "scalar", modified)
+            return tree, [subtree for (_, subtree) in body if subtree is not None], None, []
         else:
             raise HtexprError(f"unknown kind of value tuple: {kind}")
     elif isinstance(tree, dict) and "element" in tree:
-        tag = tree["element"]["tag"]
-        module, function = mappings._lookup(tag, map_tag)
-        return (
-            "scalar",
-            _function_call(
-                module,
-                function,
-                [
-                    (map_attribute.get(key, key), recur(value)[1])
-                    for (key, value) in tree["element"]["attrs"]
-                ],
-                [recur(node) for node in tree["content"] or []],
-            ),
-        )
+        component = mappings._lookup(tree["element"]["tag"], map_tag)
+        subtrees = [value for (_, value) in tree["element"]["attrs"]] + (tree["content"] or [])
+        return tree, subtrees, component, []
     else:
         raise HtexprError(f"tree not in expected format: {type(tree)}")
 
 
-def _function_call(module, function, attributes, children):
-    if module is None:
+def _code_to_ast(tree, results):
+    kind, body = tree
+    if kind == "literal":
+        return "scalar", ast.Str(s=body, col_offset=0, lineno=1)
+    nested = iter(results)
+    splice = {
+        f"__htexpr_{i}": next(nested)[1]
+        for i, (text, subtree) in enumerate(body)
+        if subtree is not None
+    }
+    code = "".join(
+        text if subtree is None else f"__htexpr_{i}" for i, (text, subtree) in enumerate(body)
+    )
+    code = textwrap.dedent(
+        "\n".join(it.dropwhile(lambda line: not line.strip(), code.splitlines()))
+    )
+    parsed = ast.parse(f"[{code}]" if kind == "pylist" else code, mode="eval").body
+    modified = SpliceSubtrees(splice).visit(parsed)
+    return ("list" if kind == "pylist" else "scalar", modified)
+
+
+def _element_to_ast(tree, component, results, map_attribute, components, profile, backend):
+    module, function = component
+    attrs = tree["element"]["attrs"]
+    attributes = [(key, item) for ((key, _), item) in zip(attrs, results)]
+    children = results[len(attrs) :]
+    if profile:
+        start = tree["start"]
+        attributes = [
+            (key, _probe((start, key), item) if _is_code(value) else item)
+            for (key, item), (_, value) in zip(attributes, attrs)
+        ]
+        children = [
+            _probe((start, i), item) if _is_code(node) else item
+            for i, (item, node) in enumerate(zip(children, tree["content"] or []))
+        ]
+    result = (
+        "scalar",
+        _backends[backend](
+            module,
+            function,
+            [(map_attribute.get(key, key), item[1]) for (key, item) in attributes],
+            children,
+            components,
+        ),
+    )
+    return _probe(tree["start"], result) if profile else result
+
+
+def _is_code(tree):
+    return isinstance(tree, tuple) and tree[0] != "literal"
+
+
+def _is_static(tree, static):
+    return tree[0] == "literal" if isinstance(tree, tuple) else id(tree) in static
+
+
+def _hoist(index, item):
+    """Wrap the code of the static subtree `item` in a call to :mod:`hoisting <htexpr.hoisting>`.
+
+    The call passes the components of the subtree, so that it can be
+    built again if they change, and a function that builds the subtree.
+    """
+    kind, value = item
+    functions = {}
+    for node in ast.walk(value):
+        if isinstance(node, ast.Call) and not (
+            isinstance(node.func, ast.Name) and node.func.id in profiling.probes
+        ):
+            functions.setdefault(ast.dump(node.func), node.func)
+    return kind, ast.Call(
+        func=ast.Name(id=hoisting.name, ctx=ast.Load()),
+        args=[
+            ast.Constant(value=index),
+            ast.Tuple(elts=[copy.deepcopy(f) for f in functions.values()], ctx=ast.Load()),
+            ast.Lambda(args=_arguments(()), body=value),
+        ],
+        keywords=[],
+    )
+
+
+def _probe(key, item):
+    """Wrap the code of `item` in the probes of :mod:`htexpr.profiling`."""
+    kind, value = item
+    enter, exit = (ast.Name(id=name, ctx=ast.Load()) for name in profiling.probes)
+    return kind, ast.Call(
+        func=exit,
+        args=[ast.Constant(value=key), ast.Call(func=enter, args=[], keywords=[]), value],
+        keywords=[],
+    )
+
+
+def _function_call(module, function, attributes, children, components=None):
+    if components is not None:
+        name = components.setdefault((module, function), f"__htexpr_c{len(components)}")
+        f = ast.Name(id=name, ctx=ast.Load(), col_offset=0, lineno=1)
+    elif module is None:
         f = ast.Name(id=function, ctx=ast.Load(), col_offset=0, lineno=1)
     else:
         f = ast.Attribute(
@@ -328,7 +1255,9 @@ def _function_call(module, function, attributes, children):
             attr=function,
         )
     if children:
-        kw_children = [ast.keyword(arg="children", value=_flatten(children), col_offset=0, lineno=1)]
+        kw_children = [
+            ast.keyword(arg="children", value=_flatten(children), col_offset=0, lineno=1)
+        ]
     else:
         kw_children = []
 
@@ -344,6 +1273,82 @@ def _function_call(module, function, attributes, children):
     )
 
 
+def _json_object(module, function, attributes, children, components=None):
+    """Build the JSON form of the component, like ``Component.to_plotly_json``."""
+    props = attributes
+    if children:
+        props = [("children", _flatten(children))] + props
+    return ast.Dict(
+        keys=[ast.Constant(value=key) for key in ("type", "namespace", "props")],
+        values=[
+            ast.Constant(value=function),
+            ast.Constant(value=mappings.namespaces.get(module, module)),
+            ast.Dict(
+                keys=[ast.Constant(value=key) for key, _ in props], values=[v for _, v in props]
+            ),
+        ],
+    )
+
+
+# the largest f-string of a child element that gets inlined into its parent
+_INLINE = 64
+
+
+def _html_string(module, function, attributes, children, components=None):
+    """Build an f-string of the HTML of the element.
+
+    Literal text and attribute values are escaped here, and the
+    f-strings of small child elements are inlined, so the element is
+    built as a single string.
+    """
+    from . import markup
+
+    markup_, render, attribute = (ast.Name(id=name, ctx=ast.Load()) for name in markup.helpers)
+    tag = markup.tag(function)
+    parts = [f"<{tag}"]
+    for name, value in attributes:
+        if isinstance(value, ast.Constant) and isinstance(value.value, str):
+            parts.append(f' {name}="{markup.escape(value.value)}"')
+        else:
+            parts.append(
+                ast.Call(func=attribute, args=[ast.Constant(value=name), value], keywords=[])
+            )
+    parts.append(">")
+    if tag in markup.void:
+        if children:
+            raise HtexprError(f"void element <{tag}> cannot have children")
+    else:
+        for kind, item in children:
+            if kind == "scalar" and isinstance(item, ast.Constant) and isinstance(item.value, str):
+                parts.append(markup.escape(item.value))
+            elif (
+                kind == "scalar"
+                and isinstance(item, ast.Call)
+                and isinstance(item.func, ast.Name)
+                and item.func.id == markup_.id
+                and len(item.args[0].values) <= _INLINE
+            ):
+                # a Constant holds a string, a FormattedValue an expression
+                parts.extend(value.value for value in item.args[0].values)
+            else:
+                parts.append(ast.Call(func=render, args=[item], keywords=[]))
+        parts.append(f"</{tag}>")
+    values = []
+    for part in parts:
+        if isinstance(part, str):
+            if values and isinstance(values[-1], ast.Constant):
+                values[-1] = ast.Constant(value=values[-1].value + part)
+            else:
+                values.append(ast.Constant(value=part))
+        else:
+            values.append(ast.FormattedValue(value=part, conversion=-1, format_spec=None))
+    return ast.Call(func=markup_, args=[ast.JoinedStr(values=values)], keywords=[])
+
+
+# the code generators for elements, by backend
+_backends = {"dash": _function_call, "json": _json_object, "html": _html_string}
+
+
 # Use cases:
 #
 # <ul>[ Li() ... ]</ul>
@@ -352,39 +1357,144 @@ def _function_call(module, function, attributes, children):
 # <table><tr><th>header</th></tr>
 #   [ Tr(...) ]
 # <tr><td>footer</td></tr></table>
-# => Table(children=[Tr(Th('header'))]+[Tr(...),...]+[Tr(Td('footer'))])
+# => Table(children=[Tr(Th('header')), *[Tr(...),...], Tr(Td('footer'))])
 #
 # <div>{ code() } constant { code() } constant ...</div>
 # => Div(children=[code(), constant, code(), constant, ...])
+#
+# All children go into a single list display, so no intermediate lists
+# get concatenated; list displays like [1, 2, 3] are spliced in as is.
 
 
 def _flatten(items):
-    if not items:
-        return _into_list([])
-    groups = [(kind, [item for (_, item) in group]) for kind, group in it.groupby(items, first)]
-    groups = [
-        _into_list(values) if kind == "scalar" else _into_flat(values) for (kind, values) in groups
-    ]
-    while len(groups) > 1:
-        value0, value1, *_ = groups
-        groups[:2] = [_join_lists(value0, value1)]
-    return groups[0]
+    if len(items) == 1 and items[0][0] == "list":
+        return items[0][1]
+    elts = []
+    for kind, item in items:
+        if kind == "scalar":
+            elts.append(item)
+        elif isinstance(item, ast.List):
+            elts.extend(item.elts)
+        else:
+            elts.append(ast.Starred(value=item, ctx=ast.Load(), col_offset=0, lineno=1))
+    return _into_list(elts)
 
 
 def _into_list(elts):
     return ast.List(elts=elts, col_offset=0, lineno=1, ctx=ast.Load())
 
 
-def _into_flat(lists):
-    return reduce(_join_lists, lists)
+def wrap_ast(
+    body, params=None, components=None, profile=False, hoist=False, backend="dash", batch=None
+):
+    """Wrap the expression into an ast.Expression.
+
+    With `params`, the expression becomes a lambda of those parameters.
+    With `batch` (``"map"`` or ``"starmap"``) as well, it becomes a
+    lambda of an iterable that returns a list comprehension of the
+    expression over the iterable, with `params` as the target.
+    With `components`, a dictionary from (module, function) pairs to
+    names, it becomes a lambda of those names that returns a lambda of
+    `params` (or of no parameters), so the components can be bound to
+    closure cells. With `profile`, the outer lambda also takes the
+    names of the :mod:`profiling <htexpr.profiling>` probes, and with
+    `hoist`, the name of the :mod:`hoisting <htexpr.hoisting>` constants.
+    The ``"html"`` `backend` adds the names of the :mod:`markup
+    <htexpr.markup>` helpers.
+    """
+    body = body[1]
+    if batch is not None:
+        names = [ast.Name(id=param, ctx=ast.Store()) for param in params]
+        target = names[0] if batch == "map" else ast.Tuple(elts=names, ctx=ast.Store())
+        items = ast.Name(id=_items, ctx=ast.Load())
+        body = ast.ListComp(
+            elt=body,
+            generators=[ast.comprehension(target=target, iter=items, ifs=[], is_async=0)],
+        )
+        params = (_items,)
+    rendered = backend == "html"
+    if components is not None or profile or hoist or rendered:
+        closure = sorted((components or {}).values())
+        if profile:
+            closure += profiling.probes
+        if hoist:
+            closure.append(hoisting.name)
+        if rendered:
+            from . import markup
+
+            closure += markup.helpers
+        body = ast.Lambda(args=_arguments(params or ()), body=body)
+        body = ast.Lambda(args=_arguments(closure), body=body)
+    elif params is not None:
+        body = ast.Lambda(args=_arguments(params), body=body)
+    return ast.Expression(body=body, lineno=1)
+
+
+# the parameter of templates compiled with batch
+_items = "__htexpr_items"
+
+
+def _arguments(names):
+    return ast.arguments(
+        posonlyargs=[],
+        args=[ast.arg(arg=name, annotation=None) for name in names],
+        vararg=None,
+        kwonlyargs=[],
+        kw_defaults=[],
+        kwarg=None,
+        defaults=[],
+    )
+
 
+_comprehensions = (ast.ListComp, ast.SetComp, ast.GeneratorExp, ast.DictComp)
 
-def _join_lists(left, right):
-    return ast.BinOp(op=ast.Add(), left=left, right=right, lineno=1)
 
+def free_names(tree):
+    """Return the sorted names that `tree` loads without binding them.
 
-def wrap_ast(body):
-    return ast.Expression(body=body[1], lineno=1)
+    Comprehension targets and lambda parameters are bound in their own
+    scopes, except that the first iterable of a comprehension is
+    evaluated in the enclosing scope. Names assigned with ``:=`` count
+    as bound.
+    """
+    free = set()
+    assigned = set()
+    stack = [(tree, frozenset())]
+    while stack:
+        node, bound = stack.pop()
+        if isinstance(node, ast.Name):
+            if node.id not in bound:
+                free.add(node.id)
+        elif isinstance(node, ast.NamedExpr):
+            assigned.add(node.target.id)
+            stack.append((node.value, bound))
+        elif isinstance(node, ast.Lambda):
+            args = node.args
+            stack.extend((default, bound) for default in args.defaults)
+            stack.extend((default, bound) for default in args.kw_defaults if default is not None)
+            params = args.posonlyargs + args.args + args.kwonlyargs
+            params += [arg for arg in (args.vararg, args.kwarg) if arg is not None]
+            stack.append((node.body, bound | {arg.arg for arg in params}))
+        elif isinstance(node, _comprehensions):
+            first, *rest = node.generators
+            stack.append((first.iter, bound))
+            inner = bound | {
+                name.id
+                for generator in node.generators
+                for name in ast.walk(generator.target)
+                if isinstance(name, ast.Name)
+            }
+            stack.extend((child, inner) for child in first.ifs)
+            for generator in rest:
+                stack.append((generator.iter, inner))
+                stack.extend((child, inner) for child in generator.ifs)
+            if isinstance(node, ast.DictComp):
+                stack.extend([(node.key, inner), (node.value, inner)])
+            else:
+                stack.append((node.elt, inner))
+        else:
+            stack.extend((child, bound) for child in ast.iter_child_nodes(node))
+    return tuple(sorted(free - assigned))
 
 
 class SpliceSubtrees(ast.NodeTransformer):
@@ -393,8 +1503,122 @@ class SpliceSubtrees(ast.NodeTransformer):
     def __init__(self, subtrees):
         self.subtrees = subtrees
 
+    def visit(self, node):
+        """Replace the names in `subtrees`, using an explicit stack instead of recursion."""
+        node = self._replace(node)
+        stack = [node]
+        while stack:
+            parent = stack.pop()
+            for field, value in ast.iter_fields(parent):
+                if isinstance(value, list):
+                    for i, item in enumerate(value):
+                        if isinstance(item, ast.AST):
+                            value[i] = replaced = self._replace(item)
+                            if replaced is item:
+                                stack.append(item)
+                elif isinstance(value, ast.AST):
+                    replaced = self._replace(value)
+                    if replaced is value:
+                        stack.append(value)
+                    else:
+                        setattr(parent, field, replaced)
+        return node
+
+    def _replace(self, node):
+        if isinstance(node, ast.Name):
+            return self.visit_Name(node)
+        return node
+
     def visit_Name(self, node):
         replacement = self.subtrees.get(node.id)
         if replacement is None:
             return node
         return ast.copy_location(replacement, node)
+
+
+def _compile(tree):
+    try:
+        return builtins.compile(tree, filename="<unknown>", mode="eval")
+    except RecursionError:
+        return _compile_deep(tree)
+
+
+# serializes the changes of _compile_deep to the recursion limit and stack size
+_deep_lock = threading.Lock()
+
+
+def _compile_deep(tree):
+    """Compile a syntax tree that is too deep for the recursion limit.
+
+    CPython's compiler recurses through the syntax tree, so the
+    recursion limit is raised for the duration, and the compiler runs
+    in a thread with a stack large enough for the depth of the tree.
+    The limits are global to the process, so only one thread at a time
+    changes them. On Python 3.12 and later the compiler has a fixed
+    limit of its own, and deep trees still raise :class:`RecursionError`.
+    """
+    depth = 0
+    stack = [(tree, 1)]
+    while stack:
+        node, level = stack.pop()
+        depth = max(depth, level)
+        stack.extend((child, level + 1) for child in ast.iter_child_nodes(node))
+    result = []
+
+    def target():
+        try:
+            result.append(builtins.compile(tree, filename="<unknown>", mode="eval"))
+        except BaseException as e:
+            result.append(e)
+
+    with _deep_lock:
+        limit = sys.getrecursionlimit()
+        size = threading.stack_size()
+        sys.setrecursionlimit(limit + depth)
+        try:
+            threading.stack_size(-(-((1 << 20) + 1024 * depth) // 4096) * 4096)
+            try:
+                thread = threading.Thread(target=target)
+                thread.start()
+            finally:
+                threading.stack_size(size)
+            thread.join()
+        finally:
+            sys.setrecursionlimit(limit)
+    if isinstance(result[0], BaseException):
+        raise result[0]
+    return result[0]
+
+
+def fix_missing_locations(node):
+    """Like :func:`ast.fix_missing_locations`, but with an explicit stack instead of recursion."""
+    stack = [(node, 1, 0, 1, 0)]
+    root = node
+    while stack:
+        node, lineno, col_offset, end_lineno, end_col_offset = stack.pop()
+        attributes = node._attributes
+        if "lineno" in attributes:
+            if not hasattr(node, "lineno"):
+                node.lineno = lineno
+            else:
+                lineno = node.lineno
+        if "end_lineno" in attributes:
+            if getattr(node, "end_lineno", None) is None:
+                node.end_lineno = end_lineno
+            else:
+                end_lineno = node.end_lineno
+        if "col_offset" in attributes:
+            if not hasattr(node, "col_offset"):
+                node.col_offset = col_offset
+            else:
+                col_offset = node.col_offset
+        if "end_col_offset" in attributes:
+            if getattr(node, "end_col_offset", None) is None:
+                node.end_col_offset = end_col_offset
+            else:
+                end_col_offset = node.end_col_offset
+        stack.extend(
+            (child, lineno, col_offset, end_lineno, end_col_offset)
+            for child in ast.iter_child_nodes(node)
+        )
+    return root
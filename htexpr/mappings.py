@@ -22,22 +22,21 @@ functions with those, e.g.::
 :data:`default_attributes` is the default value for the
 ``map_attribute`` argument of :func:`compile`
 
-"""
-
-from .exceptions import HtexprError
-from toolz import curry
+:data:`namespaces` gives the namespaces of the component modules for
+the JSON backend.
 
+:class:`TagIndex` turns a tuple of mappings into a lookup table, which
+is faster when compiling many tags. :func:`htexpr.compile` indexes
+the tuples it is given automatically.
 
-@curry
-def html(module, tag):
-    """Mapping for html tags.
+"""
 
-    Maps tags to title case, so you can type html tags as ``<audio>``
-    or ``<AuDiO>`` or whichever way.
+from .exceptions import HtexprError
+from functools import lru_cache, partial, update_wrapper
+import importlib
 
-    """
-    title = tag.title()
-    if title in {
+_html_tags = frozenset(
+    {
         "A",
         "Abbr",
         "Acronym",
@@ -169,17 +168,11 @@ def html(module, tag):
         "Video",
         "Wbr",
         "Xmp",
-    }:
-        if title in {"Map", "Object"}:
-            title = f"{title}El"
-        return module, title
-
+    }
+)
 
-@curry
-def dcc(module, tag):
-    """Mapping for dash core components."""
-
-    if tag in {
+_dcc_tags = frozenset(
+    {
         "Checklist",
         "ConfirmDialog",
         "ConfirmDialogProvider",
@@ -203,27 +196,11 @@ def dcc(module, tag):
         "Tabs",
         "Textarea",
         "Upload",
-    }:
-        return module, tag
-
-
-@curry
-def datatable(module, tag):
-    """Mapping for DataTable."""
-    if tag == "DataTable":
-        return module, tag
-
-
-@curry
-def dbc(module, tag):
-    """Mapping for dash bootstrap components.
-
-    The default assumes that :mod:`dash_bootstrap_components` is
-    imported as ``dbc``, which can be changed by setting `module`.
-
-    """
+    }
+)
 
-    if tag in {
+_dbc_tags = frozenset(
+    {
         "Alert",
         "Badge",
         "Button",
@@ -291,7 +268,101 @@ def dbc(module, tag):
         "Textarea",
         "Toast",
         "Tooltip",
-    }:
+    }
+)
+
+
+class _Curry(partial):
+    """Partial application that waits for the arguments without defaults.
+
+    Like :func:`toolz.curry`, calling it before every parameter without
+    a default has an argument returns a new partial application, and
+    partial applications of the same function to the same arguments are
+    equal. Parameters can be given by keyword, and the positional
+    arguments fill the others in order, so ``html(module="html")("div")``
+    is ``html("html", "div")``.
+    """
+
+    def __call__(self, *args, **keywords):
+        args = self.args + args
+        keywords = {**self.keywords, **keywords}
+        func = self.func
+        code = func.__code__
+        names = code.co_varnames[: code.co_argcount]
+        required = names[: len(names) - len(func.__defaults__ or ())]
+        free = [name for name in names if name not in keywords]
+        filled = set(free[: len(args)])
+        kwonly = code.co_varnames[code.co_argcount : code.co_argcount + code.co_kwonlyargcount]
+        if any(name not in keywords and name not in filled for name in required) or any(
+            name not in keywords and name not in (func.__kwdefaults__ or {}) for name in kwonly
+        ):
+            return _Curry(func, *args, **keywords)
+        if len(free) < len(names) and len(args) <= len(free):
+            return func(**dict(zip(free, args)), **keywords)
+        return func(*args, **keywords)
+
+    def __eq__(self, other):
+        if not isinstance(other, _Curry):
+            return NotImplemented
+        return (self.func, self.args, self.keywords) == (other.func, other.args, other.keywords)
+
+    def __hash__(self):
+        return hash((self.func, self.args, frozenset(self.keywords.items())))
+
+    def __reduce__(self):
+        # the function is only reachable through the curried module attribute
+        return _curried, (self.func.__module__, self.func.__qualname__, self.args, self.keywords)
+
+
+def _curried(module, name, args, keywords):
+    return _Curry(getattr(importlib.import_module(module), name).func, *args, **keywords)
+
+
+def curry(function):
+    """Decorate `function` to allow applying it partially."""
+    return update_wrapper(_Curry(function), function)
+
+
+@curry
+def html(module, tag):
+    """Mapping for html tags.
+
+    Maps tags to title case, so you can type html tags as ``<audio>``
+    or ``<AuDiO>`` or whichever way.
+
+    """
+    title = tag.title()
+    if title in _html_tags:
+        if title in {"Map", "Object"}:
+            title = f"{title}El"
+        return module, title
+
+
+@curry
+def dcc(module, tag):
+    """Mapping for dash core components."""
+
+    if tag in _dcc_tags:
+        return module, tag
+
+
+@curry
+def datatable(module, tag):
+    """Mapping for DataTable."""
+    if tag == "DataTable":
+        return module, tag
+
+
+@curry
+def dbc(module, tag):
+    """Mapping for dash bootstrap components.
+
+    The default assumes that :mod:`dash_bootstrap_components` is
+    imported as ``dbc``, which can be changed by setting `module`.
+
+    """
+
+    if tag in _dbc_tags:
         return module, tag
 
 
@@ -299,6 +370,18 @@ default = (html("html"), dcc("dcc"), datatable("dash_table"))
 dbc_and_default = (dbc("dbc"), html("html"), dcc("dcc"), datatable("dash_table"))
 
 
+#: The namespaces of the Dash component modules by the module names
+#: used in the tag mappings, for compiling with ``backend="json"``.
+#: Modules not listed here are their own namespace, which is right for
+#: the old package names such as ``dash_html_components``.
+namespaces = {
+    "html": "dash_html_components",
+    "dcc": "dash_core_components",
+    "dash_table": "dash_table",
+    "dbc": "dash_bootstrap_components",
+}
+
+
 default_attributes = {
     "class": "className",
     "accesskey": "accessKey",
@@ -312,9 +395,87 @@ default_attributes = {
 }
 
 
-def _lookup(tag, mappings):
-    if not isinstance(mappings, tuple):
-        mappings = (mappings,)
+class TagIndex:
+    """Precomputed lookup table for a tuple of mappings.
+
+    Calling a ``TagIndex`` on a tag gives the same result as the first
+    of the `mappings` that knows the tag, so it can be used as the
+    ``map_tag`` argument of :func:`htexpr.compile` in place of the
+    tuple. The tags known to the mappings in this module, in all the
+    usual spellings, and the keys of dictionaries in the tuple are
+    resolved when the index is built; other tags are resolved on first
+    use and remembered, including tags that no mapping knows. The
+    mappings are therefore assumed not to change afterwards.
+
+    Example::
+
+        index = mappings.TagIndex(mappings.dbc_and_default)
+        assert index("Nav") == ("dbc", "Nav")
+        assert index("nav") == ("html", "Nav")
+
+    """
+
+    __slots__ = ("mappings", "_index")
+
+    def __init__(self, mappings):
+        if not isinstance(mappings, tuple):
+            mappings = (mappings,)
+        self.mappings = mappings
+        self._index = {}
+        for m in mappings:
+            if hasattr(m, "keys"):
+                tags = m.keys()
+            elif getattr(m, "func", None) is html.func:
+                tags = {spelling for tag in _html_tags for spelling in _spellings(tag)}
+            else:
+                tags = _domains.get(getattr(m, "func", None), ())
+            for tag in tags:
+                if tag not in self._index:
+                    self._index[tag] = _find(tag, mappings)
+
+    def __call__(self, tag):
+        try:
+            return self._index[tag]
+        except KeyError:
+            value = self._index[tag] = _find(tag, self.mappings)
+            return value
+
+    def __repr__(self):
+        return f"TagIndex({self.mappings!r})"
+
+
+def _spellings(tag):
+    return tag, tag.lower(), tag.upper()
+
+
+_domains = {dcc.func: _dcc_tags, datatable.func: {"DataTable"}, dbc.func: _dbc_tags}
+
+
+@lru_cache(maxsize=32)
+def _indexed(mappings):
+    return TagIndex(mappings)
+
+
+def index(mappings):
+    """Return a :class:`TagIndex` for `mappings` if they are built in.
+
+    Tuples of the mappings in this module, such as :data:`default`, are
+    indexed, and the indexes are memoized, so indexing e.g.
+    :data:`default` again returns the same object. Other mappings, such
+    as dictionaries and user-defined functions that may learn new tags
+    later, are returned as is, and so is a ``TagIndex``.
+    """
+    if isinstance(mappings, tuple) and mappings and all(map(_builtin, mappings)):
+        return _indexed(mappings)
+    return mappings
+
+
+def _builtin(mapping):
+    func = getattr(mapping, "func", None)
+    return isinstance(mapping, _Curry) and (func is html.func or func in _domains)
+
+
+def _find(tag, mappings):
     for m in mappings:
         if callable(m):
             value = m(tag)
@@ -322,4 +483,13 @@ def _lookup(tag, mappings):
             value = m.get(tag)
         if value is not None:
             return value
-    raise HtexprError(f"don't know a mapping for {tag}")
+    return None
+
+
+def _lookup(tag, mappings):
+    if not isinstance(mappings, tuple):
+        mappings = (mappings,)
+    value = _find(tag, mappings)
+    if value is None:
+        raise HtexprError(f"don't know a mapping for {tag}")
+    return value
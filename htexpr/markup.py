@@ -0,0 +1,123 @@
+"""Rendering templates into HTML strings.
+
+A template compiled with ``compile(html, backend="html")`` evaluates
+into a :class:`Markup` string instead of Dash components, for uses such
+as emails, exports and pre-rendered pages::
+
+    page = htexpr.compile(template, backend="html")
+    send(page.run())
+
+Each element compiles into a single f-string, with the literal text and
+attributes escaped at compile time and its static child elements
+inlined, so building the markup does not create intermediate lists or
+strings for them. Values from Python code are rendered by
+:func:`render` and :func:`attribute`. Attribute names are translated
+back into HTML through the reverse of the ``map_attribute`` mapping, so
+``className`` becomes ``class``, and tag names are those of the
+components in lower case, so the tag mapping decides which tags are
+valid.
+"""
+
+import html
+import re
+
+#: The names to which the rendering functions are bound in compiled code.
+helpers = ("__htexpr_markup", "__htexpr_render", "__htexpr_attribute")
+
+#: Elements that have no closing tag and cannot have children.
+void = frozenset(
+    {
+        "area",
+        "base",
+        "br",
+        "col",
+        "embed",
+        "hr",
+        "img",
+        "input",
+        "link",
+        "meta",
+        "param",
+        "source",
+        "track",
+        "wbr",
+    }
+)
+
+# Dash components that are named differently from their tag
+_renamed = {"MapEl": "map", "ObjectEl": "object"}
+
+_uppercase = re.compile(r"[A-Z]")
+
+
+class Markup(str):
+    """A string of HTML that is not escaped again when rendered.
+
+    Like the classes of the same name in MarkupSafe and Jinja, it has an
+    ``__html__`` method, and objects with one are rendered as they are.
+    """
+
+    __slots__ = ()
+
+    def __html__(self):
+        return self
+
+    def __repr__(self):
+        return f"Markup({str.__repr__(self)})"
+
+
+def escape(text):
+    """Escape `text` for use in HTML text or a quoted attribute value."""
+    return html.escape(text, quote=True)
+
+
+def tag(function):
+    """Return the HTML tag of the component named `function`."""
+    return _renamed.get(function, function.lower())
+
+
+def render(value):
+    """Render the value of a ``{...}`` or ``[...]`` region as HTML.
+
+    Strings are escaped unless they have an ``__html__`` method, lists
+    and tuples are rendered item by item, and None and booleans render
+    as nothing, like in Dash.
+    """
+    if isinstance(value, str):
+        return value if hasattr(value, "__html__") else html.escape(value, quote=True)
+    if value is None or isinstance(value, bool):
+        return ""
+    if isinstance(value, (list, tuple)):
+        return "".join(map(render, value))
+    if hasattr(value, "__html__"):
+        return value.__html__()
+    return html.escape(str(value), quote=True)
+
+
+def style(value):
+    """Convert a Dash style dictionary into CSS declarations."""
+    return "; ".join(
+        f"{_uppercase.sub(lambda m: '-' + m.group().lower(), key)}: {item}"
+        for key, item in value.items()
+    )
+
+
+def attribute(name, value):
+    """Render the attribute `name` with the value of a ``{...}`` region.
+
+    None and False omit the attribute, True gives an attribute without
+    a value, and a dictionary for ``style`` becomes CSS declarations.
+    """
+    if value is None or value is False:
+        return ""
+    if value is True:
+        return f" {name}"
+    if name == "style" and isinstance(value, dict):
+        value = style(value)
+    elif hasattr(value, "__html__"):
+        return f' {name}="{value.__html__()}"'
+    return f' {name}="{html.escape(str(value), quote=True)}"'
+
+
+#: The rendering functions by the names in :data:`helpers`.
+bindings = dict(zip(helpers, (Markup, render, attribute)))
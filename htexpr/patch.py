@@ -0,0 +1,268 @@
+"""Updating rendered trees with Dash patches.
+
+A callback that renders a large template again when only a few values
+have changed would send the whole tree to the browser. :func:`diff`
+compares the previous tree with the new one and returns the
+:class:`Operation` instances that turn one into the other, and
+:func:`patch` converts them into a ``dash.Patch`` (Dash 2.9 or newer)
+that only carries the changed props and children::
+
+    from htexpr.patch import Patcher
+
+    patcher = Patcher(htexpr.compile(template))
+
+    @app.callback(Output("table", "children"), Input("filter", "value"))
+    def update(value):
+        return patcher.eval(session_id(), {**globals(), "value": value})
+
+The trees can consist of Dash components or of the dictionaries of the
+``json`` backend. Lists of children are matched by the ``key`` prop of
+the elements if their keys are distinct, so that inserting or removing
+a row does not change every row after it, and otherwise by position.
+Elements of different types, and values that are not elements or
+lists, are replaced as a whole.
+"""
+
+import bisect
+from collections import namedtuple
+
+from . import cache
+from .exceptions import HtexprError
+
+Operation = namedtuple("Operation", ["action", "path", "value"])
+Operation.__doc__ = """A change to a tree.
+
+Attributes:
+    action: ``"assign"`` to set the item at `path` to `value`,
+      ``"delete"`` to delete it, or ``"insert"`` to insert `value` into
+      a list at the index that ends `path`
+    path: tuple of the keys and indices from the root to the item, as
+      in the JSON form of the tree, e.g. ``(2, "props", "children")``
+    value: the new value, or None for ``"delete"``
+"""
+
+
+def _node(value):
+    """Return the type, namespace and props of an element, or None for other values."""
+    if type(value) is dict:
+        if len(value) == 3 and "props" in value and "type" in value and "namespace" in value:
+            return value["type"], value["namespace"], value["props"]
+        return None
+    to_json = getattr(value, "to_plotly_json", None)
+    if to_json is None:
+        return None
+    value = to_json()
+    return value["type"], value["namespace"], value["props"]
+
+
+# stands for the missing key of the nth child without one
+_unkeyed = object()
+
+
+def _keys(children, match):
+    """Return the `match` prop of each child, or None unless they are all distinct.
+
+    Children without the prop, such as static elements and text around
+    a list comprehension, are matched by their order among themselves.
+    """
+    keys = []
+    unkeyed = 0
+    for child in children:
+        node = _node(child)
+        if node is not None and match in node[2]:
+            keys.append(node[2][match])
+        else:
+            keys.append((_unkeyed, unkeyed))
+            unkeyed += 1
+    try:
+        return keys if len(set(keys)) == len(keys) else None
+    except TypeError:
+        return None
+
+
+def _increasing(sequence):
+    """Return the set of values in a longest increasing subsequence of `sequence`."""
+    tails = []
+    indices = []
+    previous = [None] * len(sequence)
+    for i, value in enumerate(sequence):
+        j = bisect.bisect_left(tails, value)
+        if j == len(tails):
+            tails.append(value)
+            indices.append(i)
+        else:
+            tails[j] = value
+            indices[j] = i
+        previous[i] = indices[j - 1] if j else None
+    result = set()
+    i = indices[-1] if indices else None
+    while i is not None:
+        result.add(sequence[i])
+        i = previous[i]
+    return result
+
+
+# the types whose equality is compared before diffing them, which is
+# quick for subtrees of the json backend
+_containers = (dict, list)
+
+
+def diff(old, new, match="key"):
+    """Return the operations that turn the tree `old` into `new`.
+
+    Args:
+        old: the previously rendered tree
+        new: the newly rendered tree
+        match: the prop by which lists of children are matched, or
+          ``"position"`` to match them by position only
+
+    Returns:
+        list: the :class:`Operation` instances, to be applied in order;
+          if the root itself changes, a single assignment with an empty
+          path
+    """
+    operations = []
+    stack = [(old, new, ())]
+    while stack:
+        old, new, path = stack.pop()
+        if old is new or (type(old) in _containers and type(old) is type(new) and old == new):
+            continue
+        before, after = _node(old), _node(new)
+        if before is not None and after is not None:
+            if before[:2] != after[:2]:
+                operations.append(Operation("assign", path, new))
+                continue
+            before, after = before[2], after[2]
+            for name in before:
+                if name not in after:
+                    operations.append(Operation("delete", path + ("props", name), None))
+            for name, value in after.items():
+                if name in before:
+                    stack.append((before[name], value, path + ("props", name)))
+                else:
+                    operations.append(Operation("assign", path + ("props", name), value))
+        elif before is None and after is None and isinstance(old, (list, tuple)):
+            if isinstance(new, (list, tuple)):
+                _diff_children(old, new, path, match, operations, stack)
+            else:
+                operations.append(Operation("assign", path, new))
+        elif before is not None or after is not None or type(old) is not type(new) or old != new:
+            operations.append(Operation("assign", path, new))
+    return operations
+
+
+def _diff_children(old, new, path, match, operations, stack):
+    """Add the operations that insert and delete children, and stack the matching pairs.
+
+    The matching pairs are compared after the insertions and deletions,
+    so their paths have the indices of the new list.
+    """
+    keys = None if match == "position" else _keys(old, match)
+    new_keys = None if keys is None else _keys(new, match)
+    if new_keys is None:
+        common = min(len(old), len(new))
+        if not common and old:
+            operations.append(Operation("assign", path, new))
+            return
+        for i in range(len(old) - 1, common - 1, -1):
+            operations.append(Operation("delete", path + (i,), None))
+        for i in range(common, len(new)):
+            operations.append(Operation("insert", path + (i,), new[i]))
+        for i in range(common - 1, -1, -1):
+            stack.append((old[i], new[i], path + (i,)))
+        return
+    index = {key: i for i, key in enumerate(keys)}
+    kept = _increasing([index[key] for key in new_keys if key in index])
+    if not kept and old:
+        operations.append(Operation("assign", path, new))
+        return
+    for i in range(len(old) - 1, -1, -1):
+        if i not in kept:
+            operations.append(Operation("delete", path + (i,), None))
+    pairs = []
+    for j, key in enumerate(new_keys):
+        i = index.get(key)
+        if i in kept:
+            pairs.append((old[i], new[j], path + (j,)))
+        else:
+            operations.append(Operation("insert", path + (j,), new[j]))
+    stack.extend(reversed(pairs))
+
+
+def apply(operations, target):
+    """Apply `operations` to `target` in order, and return it.
+
+    The target can be a tree of lists and dictionaries, such as the
+    JSON form of the old tree, or a ``dash.Patch``.
+
+    Raises:
+        HtexprError: if an operation replaces the root
+    """
+    for action, path, value in operations:
+        if not path:
+            raise HtexprError("cannot patch the root of the tree")
+        parent = target
+        for key in path[:-1]:
+            parent = parent[key]
+        if action == "assign":
+            parent[path[-1]] = value
+        elif action == "delete":
+            del parent[path[-1]]
+        else:
+            parent.insert(path[-1], value)
+    return target
+
+
+def patch(old, new, match="key"):
+    """Return a ``dash.Patch`` that turns `old` into `new`, or `new` itself.
+
+    `new` is returned as it is if the root of the tree changes, such as
+    when an element is replaced by one of another type, so the result
+    can always be returned from a callback. If nothing changes, the
+    patch is empty.
+    """
+    operations = diff(old, new, match)
+    if operations and not operations[0].path:
+        return new
+    from dash import Patch
+
+    return apply(operations, Patch())
+
+
+class Patcher:
+    """Evaluate a template and return patches against the tree last rendered for a session.
+
+    Args:
+        template: the :class:`~htexpr.Htexpr` to evaluate
+        maxsize: the maximum number of sessions whose trees are kept;
+          the least recently used are forgotten
+        match: the prop by which lists of children are matched, see
+          :func:`diff`
+
+    Attributes:
+        trees: the :class:`~htexpr.cache.LRUCache` of the last tree of
+          each session
+    """
+
+    __slots__ = ("template", "match", "trees")
+
+    def __init__(self, template, maxsize=128, match="key"):
+        self.template = template
+        self.match = match
+        self.trees = cache.LRUCache(maxsize=maxsize)
+
+    def eval(self, session, bindings={}):
+        """Evaluate the template with `bindings`, and return what :meth:`update` returns."""
+        return self.update(session, self.template.eval(bindings))
+
+    def update(self, session, tree):
+        """Keep `tree` as the last tree of `session`, and return a patch to it.
+
+        The first tree of a session, or of a session that has been
+        forgotten, is returned as it is.
+        """
+        old = self.trees.get(session)
+        self.trees.put(session, tree)
+        if old is None:
+            return tree
+        return patch(old, tree, self.match)
@@ -0,0 +1,110 @@
+"""Profiling the evaluation of templates.
+
+A template compiled with ``compile(html, profile=True)`` times each
+element and each ``{...}`` or ``[...]`` region when it is evaluated.
+The times are accumulated in the :class:`Profile` of the template
+source, so templates compiled from the same source with different
+parameters share their profile::
+
+    layout = htexpr.compile(template, profile=True)
+    layout.run()
+    print(layout.profile.report())
+
+Elements are identified by the offset where they start in the template
+source, like the ``"start"`` field of the simplified tree, and regions
+by a pair of the start of the element they belong to and either the
+name of the attribute or the index of the child. The times are
+cumulative: the time of an element includes the time of its children.
+"""
+
+import time
+from collections import namedtuple
+
+#: The names to which the probes are bound in profiled code.
+probes = ("__htexpr_enter", "__htexpr_exit")
+
+Entry = namedtuple("Entry", ["key", "line", "column", "calls", "seconds", "text"])
+Entry.__doc__ = """The accumulated cost of an element or a region.
+
+Attributes:
+    key: the start of the element, or a pair of the start and the
+      attribute name or child index of a region
+    line: the line of the element in the template source
+    column: the column of the element in the template source
+    calls: the number of evaluations
+    seconds: the cumulative wall time
+    text: the beginning of the element in the template source
+"""
+
+
+class Profile:
+    """Cumulative time and number of evaluations per element and region.
+
+    Attributes:
+        html: the template source
+        stats: dictionary from keys to lists ``[calls, seconds]``
+    """
+
+    __slots__ = ("html", "stats")
+
+    def __init__(self, html):
+        self.html = html
+        self.stats = {}
+
+    def exit(self, key, start, value):
+        """Record an evaluation of `key` that began at `start`, and return `value`."""
+        seconds = time.perf_counter() - start
+        entry = self.stats.get(key)
+        if entry is None:
+            self.stats[key] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+        return value
+
+    def bindings(self):
+        """Return the probes to bind into profiled code."""
+        return dict(zip(probes, (time.perf_counter, self.exit)))
+
+    def clear(self):
+        self.stats.clear()
+
+    def entries(self):
+        """Return the :class:`Entry` of each key, the most time-consuming first."""
+        html = self.html
+        result = []
+        for key, (calls, seconds) in self.stats.items():
+            start = key[0] if isinstance(key, tuple) else key
+            start = html.find("<", start)
+            line = html.count("\n", 0, start) + 1
+            column = start - html.rfind("\n", 0, start)
+            text = html[start : start + 40].split("\n", 1)[0]
+            result.append(Entry(key, line, column, calls, seconds, text))
+        result.sort(key=lambda entry: -entry.seconds)
+        return result
+
+    def report(self, limit=20):
+        """Return a table of the `limit` most time-consuming elements and regions."""
+        lines = [f"{'seconds':>10} {'calls':>8}  {'line:col':<10} {'region':<13} source"]
+        for entry in self.entries()[:limit]:
+            region = ""
+            if isinstance(entry.key, tuple):
+                part = entry.key[1]
+                region = f"children[{part}]" if isinstance(part, int) else f"{part}="
+            lines.append(
+                f"{entry.seconds:10.6f} {entry.calls:8d}  "
+                f"{f'{entry.line}:{entry.column}':<10} {region:<13} {entry.text}"
+            )
+        return "\n".join(lines)
+
+
+#: The profiles of the templates compiled with ``profile=True``, by source.
+profiles = {}
+
+
+def profile(html):
+    """Return the :class:`Profile` of the template source `html`, creating it if needed."""
+    try:
+        return profiles[html]
+    except KeyError:
+        return profiles.setdefault(html, Profile(html))
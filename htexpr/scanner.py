@@ -0,0 +1,324 @@
+"""Hand-written parser for htexpr templates.
+
+:func:`scan` recognizes the same language as the grammar in
+:mod:`htexpr.grammar` and returns the same simplified tree as
+``simplify(parse(html))``, but it builds the tree directly in a single
+left-to-right pass instead of first building a parse tree node for
+every match. Select it with ``compile(html, parser="scanner")``.
+
+The scanner follows the ordered choices of the grammar, so any
+backtracking the grammar does is mirrored here; the only places where
+more than one alternative gets tried are parenthesized Python code that
+might be a nested element, and dictionary-valued attributes.
+"""
+
+import re
+
+from .exceptions import HtexprError
+
+_ws = re.compile(r"[ \t\n]*")
+_langle = re.compile(r"\s*<\s*")
+_rangle = re.compile(r"\s*>\s*")
+_lclose = re.compile(r"\s*</\s*")
+_rclose = re.compile(r"\s*/>\s*")
+_name = re.compile(r"[a-z][a-z0-9._-]*", re.I)
+_attr_literal = re.compile(r"\"[^\"]*\"|'[^']*'")
+_lbrace = re.compile(r"{\s*")
+_rbrace = re.compile(r"\s*}")
+_lbracket = re.compile(r"[\[]\s*")
+_rbracket = re.compile(r"\s*]")
+_lparen = re.compile(r"\(\s*")
+_text = re.compile(r"[^<{\[]+")
+_double3 = re.compile(r'([^"]|"[^"]|""[^"])*')
+_single3 = re.compile(r"([^']|'[^']|''[^'])*")
+_double = re.compile(r'([^"\\]|\\.)*')
+_single = re.compile(r"([^'\\]|\\.)*")
+_other = re.compile(r"[^][(){}\"']+")
+_nocolon = re.compile(r"[^][(){}\"':]+")
+
+_closers = {"(": ")", "{": "}", "[": "]"}
+
+# states of _Scanner.element
+_OPEN, _CONTENT, _TEXT = "open", "content", "text"
+
+
+def scan(html):
+    """Parse `html` into the tree returned by :func:`htexpr.grammar.simplify`."""
+    return _Scanner(html).document()
+
+
+class _Scanner:
+    """Parser mirroring the grammar rules.
+
+    Each rule method takes a position and returns the position after
+    the match, or -1 if the rule does not match. Nested elements are
+    matched with an explicit stack rather than by recursion, so the
+    depth of the template is not limited by the recursion limit.
+    Mismatched closing tags are not an error for the grammar, only for
+    the simplification, so they are logged and only reported if the
+    element survives into the final tree; failing rules drop the log
+    entries they added.
+    """
+
+    __slots__ = ("text", "furthest", "mismatches", "value")
+
+    def __init__(self, text):
+        self.text = text
+        self.furthest = 0
+        self.mismatches = []
+        self.value = None
+
+    def fail(self, pos):
+        if pos > self.furthest:
+            self.furthest = pos
+        return -1
+
+    def document(self):
+        text = self.text
+        pos = self.element(_ws.match(text, 0).end())
+        if pos >= 0:
+            pos = _ws.match(text, pos).end()
+            if pos == len(text):
+                if self.mismatches:
+                    raise HtexprError(self.mismatches[0])
+                return self.value
+            self.fail(pos)
+        pos = self.furthest
+        line = text.count("\n", 0, pos) + 1
+        column = pos - text.rfind("\n", 0, pos)
+        raise HtexprError(
+            f"cannot parse template at {text[pos:pos + 20]!r} (line {line}, column {column})"
+        )
+
+    def element(self, start):
+        """Match an element, keeping the elements it contains on an explicit stack.
+
+        Each open element has a frame ``(start, tag, attrs, content,
+        mark)``. The loop either tries to open a child element at
+        `pos`, continues the content of the innermost open element, or,
+        after a child has failed to match, tries text at `pos` instead.
+        Only elements nested in Python code are matched recursively.
+        """
+        text = self.text
+        frames = []
+        pos = start
+        state = _OPEN
+        while True:
+            if state is _OPEN:
+                mark = len(self.mismatches)
+                m = _langle.match(text, pos)
+                if m is not None:
+                    m = _name.match(text, m.end())
+                if m is None:
+                    self.fail(pos)
+                    state = _TEXT
+                else:
+                    tag = m.group()
+                    attrs, end = self.attributes(m.end())
+                    m = _rclose.match(text, end)
+                    if m is not None:
+                        element = {
+                            "element": {"tag": tag, "attrs": attrs},
+                            "content": None,
+                            "start": pos,
+                        }
+                        if not frames:
+                            self.value = element
+                            return m.end()
+                        frames[-1][3].append(element)
+                        pos = m.end()
+                        state = _CONTENT
+                    else:
+                        m = _rangle.match(text, end)
+                        if m is None:
+                            del self.mismatches[mark:]
+                            self.fail(end)
+                            state = _TEXT
+                        else:
+                            frames.append((pos, tag, attrs, [], mark))
+                            pos = _ws.match(text, m.end()).end()
+                            state = _CONTENT
+                if state is _TEXT and not frames:
+                    return -1
+                continue
+            content = frames[-1][3]
+            if state is _CONTENT:
+                char = text[pos : pos + 1]
+                if char == "{" or char == "[":
+                    kind, opener, closer = (
+                        ("python", _lbrace, _rbrace)
+                        if char == "{"
+                        else ("pylist", _lbracket, _rbracket)
+                    )
+                    mark = len(self.mismatches)
+                    begin = opener.match(text, pos).end()
+                    nested = []
+                    end = self.python(begin, nested)
+                    m = closer.match(text, end)
+                    if m is not None:
+                        content.append((kind, _interpose(text, begin, end, nested)))
+                        pos = m.end()
+                        continue
+                    del self.mismatches[mark:]
+                    self.fail(end)
+                else:
+                    state = _OPEN
+                    continue
+            else:
+                m = _text.match(text, pos)
+                if m is not None:
+                    content.append(("literal", m.group()))
+                    pos = m.end()
+                    state = _CONTENT
+                    continue
+            # the content ends at pos: match the closing tag
+            begin, tag, attrs, content, mark = frames.pop()
+            m = close = _lclose.match(text, _ws.match(text, pos).end())
+            if m is not None:
+                close = _name.match(text, m.end())
+                if close is not None:
+                    m = _rangle.match(text, close.end())
+            if m is None or close is None:
+                del self.mismatches[mark:]
+                self.fail(pos)
+                if not frames:
+                    return -1
+                # the parent content continues with text where the element began
+                pos = begin
+                state = _TEXT
+                continue
+            if close.group() != tag:
+                self.mismatches.append(f"<{tag}> closed by </{close.group()}>")
+            if content and isinstance(content[-1], tuple) and content[-1][0] == "literal":
+                stripped = content[-1][1].rstrip()
+                if stripped:
+                    content[-1] = ("literal", stripped)
+                else:
+                    del content[-1]
+            element = {"element": {"tag": tag, "attrs": attrs}, "content": content, "start": begin}
+            if not frames:
+                self.value = element
+                return m.end()
+            frames[-1][3].append(element)
+            pos = m.end()
+            state = _CONTENT
+
+    def attributes(self, pos):
+        text = self.text
+        attrs = []
+        while True:
+            m = _name.match(text, _ws.match(text, pos).end())
+            if m is None:
+                return attrs, pos
+            name = m.group()
+            p = _ws.match(text, m.end()).end()
+            if not text.startswith("=", p):
+                return attrs, pos
+            p = self.attr_value(_ws.match(text, p + 1).end())
+            if p < 0:
+                return attrs, pos
+            attrs.append((name, self.value))
+            pos = p
+
+    def attr_value(self, pos):
+        text = self.text
+        m = _attr_literal.match(text, pos)
+        if m is not None:
+            self.value = "literal", m.group()[1:-1]
+            return m.end()
+        mark = len(self.mismatches)
+        m = _lbrace.match(text, pos)
+        if m is not None:
+            start = m.end()
+            colon = self.python(start, [], _nocolon)
+            if text.startswith(":", colon):
+                end = self.python(colon + 1, [])
+                m = _rbrace.match(text, end)
+                if m is not None:
+                    self.value = "python", [
+                        (f"{{{text[start:colon]}:{text[colon + 1:end]}}}", None)
+                    ]
+                    return m.end()
+            del self.mismatches[mark:]
+            end = self.python(start, [])
+            m = _rbrace.match(text, end)
+            if m is not None:
+                self.value = "python", [(text[start:end], None)]
+                return m.end()
+            del self.mismatches[mark:]
+            return self.fail(end)
+        m = _lbracket.match(text, pos)
+        if m is not None:
+            end = self.python(m.end(), [])
+            m2 = _rbracket.match(text, end)
+            if m2 is not None:
+                self.value = "pylist", [(text[m.end() : end], None)]
+                return m2.end()
+            del self.mismatches[mark:]
+            return self.fail(end)
+        return self.fail(pos)
+
+    def python(self, pos, nested, other=_other):
+        """Match python_expr (or python_expr_nocolon) and collect nested elements."""
+        text = self.text
+        while True:
+            char = text[pos : pos + 1]
+            if char == '"':
+                end = self.string(pos, '"', _double3, _double)
+            elif char == "'":
+                end = self.string(pos, "'", _single3, _single)
+            elif char == "(":
+                end = self.nested(pos, nested)
+                if end < 0:
+                    end = self.group(pos, nested)
+            elif char == "{" or char == "[":
+                end = self.group(pos, nested)
+            else:
+                m = other.match(text, pos)
+                end = -1 if m is None else m.end()
+            if end < 0:
+                return pos
+            pos = end
+
+    def string(self, pos, quote, triple, single):
+        text = self.text
+        if text.startswith(quote * 3, pos):
+            end = triple.match(text, pos + 3).end()
+            if text.startswith(quote * 3, end):
+                return end + 3
+        end = single.match(text, pos + 1).end()
+        if text.startswith(quote, end):
+            return end + 1
+        return self.fail(end)
+
+    def nested(self, pos, nested):
+        mark = len(self.mismatches)
+        end = self.element(_lparen.match(self.text, pos).end())
+        if end >= 0 and self.text.startswith(")", end):
+            nested.append((pos, end + 1, self.value))
+            return end + 1
+        del self.mismatches[mark:]
+        return -1 if end < 0 else self.fail(end)
+
+    def group(self, pos, nested):
+        mark, count = len(self.mismatches), len(nested)
+        end = self.python(pos + 1, nested)
+        if self.text.startswith(_closers[self.text[pos]], end):
+            return end + 1
+        del self.mismatches[mark:]
+        del nested[count:]
+        return self.fail(end)
+
+
+def _interpose(text, start, end, nested):
+    """Split text[start:end] into Python code and nested elements."""
+    result = []
+    point = start
+    for nested_start, nested_end, element in nested:
+        if nested_start > point:
+            result.append((text[point:nested_start], None))
+        result.append((text[nested_start:nested_end], element))
+        point = nested_end
+    if point < end:
+        result.append((text[point:end], None))
+    return result
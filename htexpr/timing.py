@@ -0,0 +1,89 @@
+"""Timing the stages of compiling templates.
+
+Compiling a template runs it through a pipeline of stages: parsing
+(``parse`` and ``simplify``, or ``scan``), ``to_ast``, ``wrap_ast``,
+``fix_missing_locations``, ``compile`` and ``free_names``, preceded by
+``load`` if a disk cache is used. While a listener is registered with
+:func:`listen` or :func:`record`, each stage reports a :class:`Record`::
+
+    with htexpr.timing.record() as records:
+        htexpr.compile(template)
+    print(htexpr.timing.totals(records, "stage"))
+
+Only templates that actually get compiled are reported, not those
+found in :data:`htexpr.compile_cache`. The listeners are global, so
+templates compiled by other threads are reported too. When no listener
+is registered, the stages are not timed at all.
+"""
+
+import sys
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+Record = namedtuple("Record", ["html", "stage", "seconds", "blocks"])
+Record.__doc__ = """The cost of one stage of compiling a template.
+
+Attributes:
+    html: the template source
+    stage: the name of the stage
+    seconds: the wall time taken by the stage
+    blocks: the change in the number of memory blocks allocated by the
+      interpreter (see :func:`sys.getallocatedblocks`)
+"""
+
+_listeners = []
+
+
+@contextmanager
+def listen(callback):
+    """Call `callback` with a :class:`Record` after each stage within the block."""
+    _listeners.append(callback)
+    try:
+        yield callback
+    finally:
+        _listeners.remove(callback)
+
+
+@contextmanager
+def record():
+    """Collect the :class:`Record` of each stage within the block into a list."""
+    records = []
+    with listen(records.append):
+        yield records
+
+
+def totals(records, field="html"):
+    """Sum up the time and memory blocks of `records` grouped by `field`.
+
+    Returns:
+        dict: mapping from the values of `field` to pairs (seconds,
+        blocks), the most time-consuming first
+    """
+    sums = {}
+    for r in records:
+        seconds, blocks = sums.get(getattr(r, field), (0.0, 0))
+        sums[getattr(r, field)] = seconds + r.seconds, blocks + r.blocks
+    return dict(sorted(sums.items(), key=lambda item: -item[1][0]))
+
+
+def timed(stage, html, function, *args):
+    """Return ``function(*args)``, reporting its cost to the listeners."""
+    blocks = sys.getallocatedblocks()
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    r = Record(html, stage, seconds, sys.getallocatedblocks() - blocks)
+    for listener in list(_listeners):
+        listener(r)
+    return result
+
+
+def untimed(stage, html, function, *args):
+    """Return ``function(*args)``."""
+    return function(*args)
+
+
+def stage_runner():
+    """Return :func:`timed` if there are listeners, :func:`untimed` otherwise."""
+    return timed if _listeners else untimed
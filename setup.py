@@ -5,11 +5,12 @@ from setuptools import setup
 with open("README.md") as f:
     readme = f.read()
 
-requirements = ["parsimonious>=0.9.0,<0.11", "toolz>=0.9,<0.13"]
+requirements = ["parsimonious>=0.9.0,<0.11"]
 setup_requirements = ["pytest-runner"]
 example_requirements = [
     "dash>=2.0.0,<2.8",
     "dash-bootstrap-components>=1.0.0,<2.0",
+    "toolz>=0.9,<0.13",
 ]
 test_requirements = [
     "pytest>=6.0,<7.3",
@@ -18,6 +19,7 @@ test_requirements = [
     "dash[testing]>=2.0.0,<2.8",
     "dash-bootstrap-components>=1.0.0,<2.0",
     "requests>=2.23,<2.29",
+    "toolz>=0.9,<0.13",
 ]
 dev_requirements = test_requirements
 
@@ -2,8 +2,22 @@
 
 """Tests for `htexpr` package."""
 
+import ast
+import builtins
+import copy
+import functools
+import importlib
+import inspect
 import itertools
+import marshal
+import math
+import os
+import pickle
 import pytest
+import random
+import subprocess
+import sys
+import threading
 import types
 
 import parsimonious
@@ -14,11 +28,14 @@ from htexpr.htexpr import (
     wrap_ast,
     compile,
     HtexprError,
+    Htexpr,
     SimplifyVisitor,
     _flatten,
     _grammar,
 )
-from htexpr import mappings
+import htexpr
+from htexpr import aot, cache, hoisting, mappings, patch, profiling, timing
+from htexpr.scanner import scan
 
 
 def test_grammar():
@@ -230,14 +247,15 @@ def Span(**kwargs):
         ),
     ],
 )
-def test_compile(html, result):
+@pytest.mark.parametrize("parser", ["parsimonious", "scanner"])
+def test_compile(html, result, parser):
     foo = "one"
     bar = 2
 
     def map_tag(tag):
         return None, tag.title()
 
-    assert result == compile(html, map_tag=map_tag).eval(
+    assert result == compile(html, map_tag=map_tag, parser=parser).eval(
         {**globals(), "foo": "one", "bar": 2, "map_tag": map_tag}
     )
 
@@ -360,26 +378,33 @@ def _dfs_ast(node, name=None, depth=0):
         ([("scalar", 1)], "List(elts=[1])"),
         ([("scalar", 1), ("scalar", 2)], "List(elts=[1,2])"),
         ([("list", "expr")], "expr"),
-        ([("list", "expr1"), ("list", "expr2")], "BinOp(left=expr1,op=Add(),right=expr2)"),
+        (
+            [("list", "expr1"), ("list", "expr2")],
+            "List(elts=[Starred(value=expr1),Starred(value=expr2)])",
+        ),
         (
             [("list", "expr1"), ("list", "expr2"), ("list", "expr3")],
-            "BinOp(left=BinOp(left=expr1,op=Add(),right=expr2),op=Add(),right=expr3)",
+            "List(elts=[Starred(value=expr1),Starred(value=expr2),Starred(value=expr3)])",
         ),
-        ([("scalar", "v"), ("list", "expr")], "BinOp(left=List(elts=[v]),op=Add(),right=expr)"),
-        ([("list", "expr"), ("scalar", "v")], "BinOp(left=expr,op=Add(),right=List(elts=[v]))"),
+        ([("scalar", "v"), ("list", "expr")], "List(elts=[v,Starred(value=expr)])"),
+        ([("list", "expr"), ("scalar", "v")], "List(elts=[Starred(value=expr),v])"),
         (
             [("scalar", "v"), ("list", "expr1"), ("list", "expr2")],
-            "BinOp(left=List(elts=[v]),op=Add(),right=BinOp(left=expr1,op=Add(),right=expr2))",
+            "List(elts=[v,Starred(value=expr1),Starred(value=expr2)])",
         ),
         (
             [("list", "expr1"), ("scalar", "v"), ("list", "expr2")],
-            "BinOp(left=BinOp(left=expr1,op=Add(),right=List(elts=[v])),op=Add(),right=expr2)",
+            "List(elts=[Starred(value=expr1),v,Starred(value=expr2)])",
         ),
         (
             [("list", "expr1"), ("list", "expr2"), ("scalar", "v")],
-            "BinOp(left=BinOp(left=expr1,op=Add(),right=expr2),op=Add(),right=List(elts=[v]))",
+            "List(elts=[Starred(value=expr1),Starred(value=expr2),v])",
+        ),
+        ([("list", "abc"), ("list", "de")], "List(elts=[Starred(value=abc),Starred(value=de)])"),
+        (
+            [("scalar", "v"), ("list", ast.List(elts=["a", "b"])), ("scalar", "w")],
+            "List(elts=[v,a,b,w])",
         ),
-        ([("list", "abc"), ("list", "de")], "BinOp(left=abc,op=Add(),right=de)"),
     ],
 )
 def test_flatten(input, output):
@@ -387,3 +412,1151 @@ def test_flatten(input, output):
     print(result)
     print(_dfs_ast(result))
     assert _dfs_ast(result) == output
+
+
+def test_disk_cache(tmp_path, monkeypatch):
+    def map_tag(tag):
+        return None, tag.title()
+
+    html = "<div>[(<span>{i}</span>) for i in range(3)]</div>"
+    expected = Htexpr(html, map_tag=map_tag).eval({"Div": Div, "Span": Span})
+
+    Htexpr(html, map_tag=map_tag, cache_dir=tmp_path)
+    files = list(tmp_path.iterdir())
+    assert len(files) == 1
+
+    def fail(html):
+        raise AssertionError("parsed despite cache")
+
+    # the parsers are imported from their modules when they are used
+    monkeypatch.setattr("htexpr.grammar.parse", fail)
+    monkeypatch.setattr("htexpr.scanner.scan", fail)
+    with pytest.raises(AssertionError, match="parsed despite cache"):
+        Htexpr(html, map_tag=map_tag)
+    cached = Htexpr(html, map_tag=map_tag, cache_dir=tmp_path)
+    assert cached.eval({"Div": Div, "Span": Span}) == expected
+
+    # a different mapping is a different key, and corrupt files are recompiled
+    monkeypatch.undo()
+    Htexpr(html, map_tag=map_tag, map_attribute={"id": "ident"}, cache_dir=tmp_path)
+    assert len(list(tmp_path.iterdir())) == 2
+    files[0].write_bytes(b"garbage")
+    assert Htexpr(html, map_tag=map_tag, cache_dir=tmp_path).eval({"Div": Div, "Span": Span}) == (
+        expected
+    )
+
+
+TAG_REGISTRY = {"div": ("html", "Div")}
+
+
+def _registry_tag(tag):
+    return TAG_REGISTRY.get(tag)
+
+
+def test_disk_cache_rechecks_tags(tmp_path, monkeypatch):
+    # the key cannot cover the globals that a mapping reads
+    assert Htexpr("<div/>", map_tag=_registry_tag, cache_dir=tmp_path).names == ("html",)
+    monkeypatch.setitem(TAG_REGISTRY, "div", ("dbc", "Div"))
+    assert Htexpr("<div/>", map_tag=_registry_tag, cache_dir=tmp_path).names == ("dbc",)
+    assert len(list(tmp_path.iterdir())) == 1
+    monkeypatch.undo()
+    assert Htexpr("<div/>", map_tag=_registry_tag, cache_dir=tmp_path).names == ("html",)
+
+
+def test_disk_cache_recursive_mapping(tmp_path):
+    def factory(aliases):
+        def lookup(tag, depth=0):
+            if tag in aliases and depth < 10:
+                return lookup(aliases[tag], depth + 1)
+            return "html", tag.title()
+
+        return lookup
+
+    map_tag = factory({"box": "div"})
+    assert "back(" in cache.fingerprint(map_tag)
+    assert cache.fingerprint(map_tag) == cache.fingerprint(factory({"box": "div"}))
+    assert cache.fingerprint(map_tag) != cache.fingerprint(factory({"box": "span"}))
+    html = types.SimpleNamespace(Div=Div)
+    for _ in range(2):
+        template = Htexpr("<box/>", map_tag=map_tag, cache_dir=tmp_path)
+        assert template.eval({"html": html}) == {"tag": "Div"}
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_cache_key():
+    html = "<div />"
+    assert cache.key(html, map_tag=mappings.default) == cache.key(
+        html, map_tag=(mappings.html("html"), mappings.dcc("dcc"), mappings.datatable("dash_table"))
+    )
+    assert cache.key(html, map_tag=mappings.default) != cache.key(
+        html, map_tag=mappings.dbc_and_default
+    )
+    assert cache.key(html, map_attribute={"a": "b", "c": "d"}) == cache.key(
+        html, map_attribute={"c": "d", "a": "b"}
+    )
+    assert cache.key(html, map_attribute={"a": "b"}) != cache.key(html, map_attribute={"a": "c"})
+    assert cache.key(html) != cache.key("<span />")
+
+
+def _both_parsers(html):
+    outcomes = []
+    for parser in (lambda html: simplify(parse(html)), scan):
+        try:
+            outcomes.append(parser(html))
+        except HtexprError:
+            outcomes.append(HtexprError)
+    return outcomes
+
+
+@pytest.mark.parametrize(
+    "html",
+    [
+        '<h1 id="foo" class={bar}>heading {foo}<div id="1" class="2"/></h1>',
+        "<div>{(<span>one {(<h1>two</h1>) or 1/0} three</span>)}</div>",
+        "<div a1={{'a': 1, 'b': 2}} a2={'a': 1, 'b': 2} a3=[1, 2] />",
+        """<div>{x:y}{'''a'''} {\"\"\"b\"\"\"}[ (<li />) for i in {1: (2)} ]</div>""",
+        "<div>{ x }  <span />\n  </div>",
+        "\n <div>{ ( <span /> ) } (<b>x</b>)</div> ",
+        "< div ><p>[ (<a></a>) ]</p></ div >",
+        "<div>{(<a></b> + 1)}</div>",
+        "<div>{(<a></b>)}</div>",
+        "<div id={(<a></b>)} />",
+        '<div id={"a\\"b"} />',
+        "<div>{f(<a/>)}</div>",
+        "<div>{'unterminated}</div>",
+        "<div>{(}</div>",
+        "<div",
+        "<div></div>x",
+        "",
+    ],
+)
+def test_scanner_examples(html):
+    peg, scanned = _both_parsers(html)
+    assert peg == scanned
+
+
+def _random_element(rng, depth):
+    tag = rng.choice(["div", "span", "b", "Di.v-1"])
+    attrs = "".join(
+        rng.choice([' id="x"', " c='y'", " d={a}", ' e={"k": v}', " f=[1, 2]", " g={(<i/>)}"])
+        for _ in range(rng.randint(0, 2))
+    )
+    if depth > 3 or rng.random() < 0.3:
+        return f"<{tag}{attrs}{rng.choice(['/>', ' />'])}"
+    content = "".join(_random_content(rng, depth + 1) for _ in range(rng.randint(0, 3)))
+    return f"<{tag}{attrs}>{content}</{tag if rng.random() < 0.9 else 'zz'}>"
+
+
+def _random_python(rng, depth):
+    choices = [" x ", "f(y)", '"s}"', "'q'", '"""t"""', ":", " < ", "[i for i in j]", "(a, (b))"]
+    if depth < 4:
+        choices += [
+            f"({_random_element(rng, depth + 1)})",
+            f"( {_random_element(rng, depth + 1)} )",
+        ]
+    return "".join(rng.choice(choices) for _ in range(rng.randint(0, 4)))
+
+
+def _random_content(rng, depth):
+    kind = rng.random()
+    if kind < 0.3:
+        return rng.choice(["text ", " more\n", "  "])
+    elif kind < 0.5:
+        return "{" + _random_python(rng, depth) + "}"
+    elif kind < 0.65:
+        return "[" + _random_python(rng, depth) + "]"
+    return _random_element(rng, depth)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_scanner_random(seed):
+    rng = random.Random(seed)
+    noise = ["<", ">", "</", "/>", "{", "}", "[", "]", "(", ")", '"', "'", ":", "=", " ", "\\"]
+    for _ in range(50):
+        html = _random_element(rng, 0)
+        for _ in range(rng.randint(0, 2)):
+            i = rng.randrange(len(html) + 1)
+            html = html[:i] + rng.choice(noise) + html[i + rng.randint(0, 1) :]
+        peg, scanned = _both_parsers(html)
+        assert peg == scanned, html
+
+
+def test_unknown_parser():
+    with pytest.raises(HtexprError):
+        Htexpr("<div />", parser="regex")
+
+
+def test_as_function():
+    def map_tag(tag):
+        return None, tag.title()
+
+    template = compile(
+        "<div id={i}>[(<span>{i * j}</span>) for j in range(n)]</div>", map_tag=map_tag
+    )
+    row = template.as_function("i", "n")
+    assert row.__code__.co_varnames[: row.__code__.co_argcount] == ("i", "n")
+    assert row(2, 3) == {
+        "tag": "Div",
+        "id": 2,
+        "children": [
+            {"tag": "Span", "children": [0]},
+            {"tag": "Span", "children": [2]},
+            {"tag": "Span", "children": [4]},
+        ],
+    }
+    assert row.__globals__ is globals()
+
+    compiled = compile(template.html, map_tag=map_tag, params=("i", "n"))
+    assert compiled.params == ("i", "n")
+    assert compiled.as_function()(1, 1) == row(1, 1)
+    assert compiled.eval({"Div": Div, "Span": Span})(1, 1) == row(1, 1)
+    assert compile("<div />", map_tag=map_tag).as_function()() == {"tag": "Div"}
+
+    with pytest.raises(NameError):
+        template.as_function("i", "n", globals={})(1, 1)
+    with pytest.raises(HtexprError):
+        template.as_function("not valid")
+    with pytest.raises(HtexprError):
+        template.as_function("lambda")
+
+
+def test_map():
+    def map_tag(tag):
+        return None, tag.title()
+
+    template = compile(
+        "<div id={i}>[(<span>{i * j}</span>) for j in range(n)]</div>", map_tag=map_tag
+    )
+    n = 2  # locals are not visible
+    with pytest.raises(NameError):
+        template.map(range(3))
+    expected = [template.as_function("i", "n", globals=globals())(i, 2) for i in range(3)]
+    assert template.map(range(3), globals={**globals(), "n": 2}) == expected
+    assert template.map(iter([0, 1, 2]), globals={**globals(), "n": 2}) == expected
+    pairs = [(i, 2) for i in range(3)]
+    assert template.starmap(pairs, ("i", "n"), globals=globals()) == expected
+    assert template.starmap([], ("i", "n")) == []
+
+    batch = compile(template.html, map_tag=map_tag, params=("i", "n"), batch="starmap")
+    function = batch.eval({"Div": Div, "Span": Span})
+    assert function(pairs) == expected
+    assert function.__code__.co_argcount == 1
+    assert compile(template.html, map_tag=map_tag, params=("x",), batch="map").names == (
+        "Div",
+        "Span",
+        "i",
+        "n",
+        "range",
+    )
+
+    with pytest.raises(HtexprError, match="batch='map' needs one parameter"):
+        compile("<div />", params=("i", "n"), batch="map")
+    with pytest.raises(HtexprError, match="batch='starmap' needs params"):
+        compile("<div />", batch="starmap")
+    with pytest.raises(HtexprError, match="unknown batch mode"):
+        compile("<div />", params=("i",), batch="zip")
+    with pytest.raises(HtexprError):
+        template.map([1], name="not valid")
+
+
+@pytest.mark.parametrize(
+    "html,names",
+    [
+        ("<div />", ("html",)),
+        ("<div id={a.b}>{c}</div>", ("a", "c", "html")),
+        ("<ul>[(<li>{i}{j}</li>) for i in items if i for j in i]</ul>", ("html", "items")),
+        ("<ul>[(<li>{i}</li>) for i in range(i)]</ul>", ("html", "i", "range")),
+        ("<div>{(lambda x, *y, z=z: x + y + w)(1)}</div>", ("html", "w", "z")),
+        ("<div>{{k: v for k in keys}}</div>", ("html", "keys", "v")),
+        ("<div>{[y := 1, y]}</div>", ("html",)),
+        ("<div>{(<span>{deep}</span>)}</div>", ("deep", "html")),
+    ],
+)
+def test_free_names(html, names):
+    assert compile(html).names == names
+
+
+def test_run_resolves_only_free_names():
+    calls = []
+    html = types.SimpleNamespace(Div=lambda **kwargs: kwargs)
+    template = compile("<div>{record(1)}{missing}</div>")
+
+    def record(x):
+        calls.append(x)
+
+    with pytest.raises(NameError, match="missing"):
+        template.run()
+    assert calls == []
+
+    assert template.run(missing=2) == {"children": [None, 2]}
+    assert calls == [1]
+
+
+def test_resolved_components(tmp_path):
+    html = types.ModuleType("html")
+    html.Div = Div
+    html.Span = Span
+    modules = types.ModuleType("modules")
+    modules.html = html
+    source = "<div>[(<span>{i}</span>) for i in range(n)]</div>"
+    expected = {"tag": "Div", "children": [{"tag": "Span", "children": [0]}]}
+
+    template = compile(source, modules=modules)
+    assert "html" not in template.names
+    assert sorted(template.components.values(), key=id) == sorted([Div, Span], key=id)
+    assert template.eval({"n": 1}) == expected
+    assert template.run(n=1, html=None) == expected
+    assert template.as_function("n")(1) == expected
+
+    cached = Htexpr(source, modules={"html": html}, cache_dir=tmp_path)
+    assert Htexpr(source, modules={"html": html}, cache_dir=tmp_path).eval({"n": 1}) == expected
+    assert cached.eval({"n": 1}) == expected
+
+    def map_tag(tag):
+        return None, tag.title()
+
+    bare = Htexpr(source, map_tag=map_tag, modules={"Div": Div, "Span": Span})
+    assert bare.eval({"n": 1}) == expected
+    with pytest.raises(HtexprError):
+        Htexpr(source, map_tag=map_tag, modules={"Div": Div})
+
+
+@pytest.mark.parametrize("tuple_", [mappings.default, mappings.dbc_and_default])
+def test_tag_index(tuple_):
+    index = mappings.index(tuple_)
+    assert isinstance(index, mappings.TagIndex)
+    assert mappings.index(tuple_) is index
+    assert mappings.index(index) is index
+    tags = mappings._html_tags | mappings._dcc_tags | mappings._dbc_tags | {"DataTable"}
+    spellings = {s for tag in tags for s in (tag, tag.lower(), tag.upper(), tag.swapcase())}
+    for tag in sorted(spellings) + ["no-such-element", "xyzzy"]:
+        assert index(tag) == mappings._find(tag, tuple_)
+        assert index(tag) == mappings._find(tag, tuple_)  # cached
+    with pytest.raises(HtexprError):
+        mappings._lookup("no-such-element", index)
+
+
+def test_tag_index_mixed():
+    calls = []
+
+    def bar(tag):
+        calls.append(tag)
+        if "bar" in tag:
+            return "bar", tag
+
+    index = mappings.TagIndex(({"foo": ("foo", "xyzzy")}, bar, mappings.html("H")))
+    assert index("foo") == ("foo", "xyzzy")
+    assert index("baric") == ("bar", "baric")
+    assert index("DIV") == ("H", "Div")
+    assert index("unknown") is None
+    calls.clear()
+    assert [index(tag) for tag in ("baric", "DIV", "unknown")] == [
+        ("bar", "baric"),
+        ("H", "Div"),
+        None,
+    ]
+    assert calls == []
+    assert mappings.index(index) is index
+    assert mappings.index({"foo": ("foo", "xyzzy")}) == {"foo": ("foo", "xyzzy")}
+    assert mappings.index((bar, mappings.html("H"))) == (bar, mappings.html("H"))
+    assert mappings.index(bar) is bar
+
+
+def test_map_tag_registry():
+    registry = {}
+
+    def map_tag(tag):
+        return registry.get(tag)
+
+    with pytest.raises(HtexprError):
+        compile("<Widget/>", map_tag=map_tag)
+    registry["Widget"] = ("html", "Div")
+    html = types.SimpleNamespace(Div=Div)
+    assert compile("<Widget/>", map_tag=map_tag).eval({"html": html}) == {"tag": "Div"}
+
+
+def test_lru_cache():
+    lru = cache.LRUCache(maxsize=2, maxbytes=10)
+    lru.put("a", 1, 3)
+    lru.put("b", 2, 3)
+    assert lru.get("a") == 1
+    lru.put("c", 3, 3)
+    assert "b" not in lru and "a" in lru
+    lru.put("d", 4, 11)
+    assert "d" not in lru
+    lru.put("e", 5, 8)
+    assert len(lru) == 1 and lru.get("e") == 5
+    assert lru.get("b") is None
+    assert lru.info() == cache.CacheInfo(2, 1, 3, 2, 1, 10, 8)
+    lru.configure(maxbytes=5)
+    assert len(lru) == 0
+    lru.clear()
+    assert lru.info() == cache.CacheInfo(0, 0, 0, 2, 0, 5, 0)
+
+
+def test_memoize(monkeypatch):
+    calls = []
+
+    def Li(**kwargs):
+        calls.append(kwargs)
+        return {**kwargs, "tag": "Li"}
+
+    html = types.ModuleType("html")
+    html.Ul, html.Li = Div, Li
+    source = "<ul>[(<li>{i}</li>) for i in items]</ul>"
+    shared = compile(source)
+    template = shared.memoize(maxsize=2, ttl=10)
+    # the template shared through compile_cache is not memoized
+    assert template is not shared and compile(source) is shared and shared.memo is None
+    assert template.code is shared.code
+    first = template.eval({"html": html, "items": [1, 2]})
+    again = template.eval({"html": html, "items": [1, 2]})
+    assert first == again and len(calls) == 2
+    # copies are returned, so changing one does not change the others
+    assert again is not first and again["children"][0] is not first["children"][0]
+    again["children"].clear()
+    assert template.run(items=[1, 2]) == first and len(calls) == 2
+    template.eval({"html": html, "items": [1.0, 2]})
+    template.eval({"html": html, "items": (1, 2)})
+    assert len(calls) == 6
+    info = template.memo.info()
+    assert (info.hits, info.misses, info.evictions, info.currsize) == (2, 3, 1, 2)
+    assert info.currbytes > 0
+
+    now = [0.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    template = shared.memoize(copy=False, ttl=10)
+    assert shared.memoize(copy=False).memo is not template.memo
+    first = template.eval({"html": html, "items": [3]})
+    assert template.eval({"html": html, "items": [3]}) is first
+    now[0] = 10.0
+    assert template.eval({"html": html, "items": [3]}) is not first
+    assert template.memo.info().evictions == 1
+
+    # unhashable values are not memoized
+    template = template.memoize(maxbytes=1)
+    template.eval({"html": html, "items": [3]})
+    assert template.memo.info().currsize == 0
+    template.eval({"html": types.SimpleNamespace(Ul=Div, Li=Li), "items": [3]})
+    assert template.memo.info().misses == 1
+    count = len(calls)
+    shared.eval({"html": html, "items": [3]})
+    shared.eval({"html": html, "items": [3]})
+    assert len(calls) == count + 2
+    with pytest.raises(HtexprError, match="params"):
+        Htexpr("<b/>", params=("x",)).memoize()
+
+
+def test_sizeof():
+    assert cache.sizeof("abc") == sys.getsizeof("abc")
+    shared = ["x" * 100]
+    tree = {"a": shared, "b": shared, "c": types.SimpleNamespace(d=shared, m=sys)}
+    assert cache.sizeof(tree) < cache.sizeof(shared) + 2000
+    assert cache.sizeof(tree) > cache.sizeof(shared)
+
+
+def test_normalize():
+    assert cache.normalize({"a": [1, {2}]}) == cache.normalize({"a": [1, {2}]})
+    assert hash(cache.normalize({"a": [1], "b": None}))
+    assert cache.normalize({"a": 1}) != cache.normalize((("a", 1),))
+    with pytest.raises(TypeError):
+        cache.normalize(types.SimpleNamespace())
+
+
+def test_compile_cache():
+    htexpr.compile_cache.clear()
+    template = "<div foo={1}>x</div>"
+    first = compile(template, map_attribute={"foo": "bar"})
+    second = compile(template, map_attribute={"foo": "bar"})
+    third = compile(template, map_attribute={"foo": "baz"})
+    assert first is second and first is not third
+    html = types.SimpleNamespace(Div=Div)
+    assert third.eval({"html": html}) == {"baz": 1, "children": ["x"], "tag": "Div"}
+    info = compile.cache_info()
+    assert info == (1, 2, 128, 2)
+    assert info._fields == ("hits", "misses", "maxsize", "currsize")
+    assert htexpr.compile_cache.info().currbytes > 0
+    assert htexpr.warm([template], map_attribute={"foo": "bar"}) == [first]
+    # unhashable options that cannot be normalized are compiled uncached
+    modules = types.SimpleNamespace(html=html)
+    f = compile("<div>{x}</div>", modules=modules).as_function("x")
+    assert f(1) == {"children": [1], "tag": "Div"}
+    assert compile.cache_info().currsize == 2
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_compile_many(workers):
+    htexpr.compile_cache.clear()
+    sources = [f"<div id='{i}'>{{x}}<span>a</span></div>" for i in range(10)]
+    sources.append(sources[0])
+    cached = compile(sources[5], map_attribute={"id": "key"})
+    templates = htexpr.compile_many(sources, workers=workers, map_attribute={"id": "key"})
+    assert templates[5] is cached and templates[0] is templates[10]
+    assert [compile(html, map_attribute={"id": "key"}) for html in sources] == templates
+    assert htexpr.compile_cache.info().currsize == 10
+    html = types.SimpleNamespace(Div=Div, Span=Span)
+    assert templates[3].eval({"html": html, "x": 1}) == {
+        "key": "3",
+        "tag": "Div",
+        "children": [1, {"tag": "Span", "children": ["a"]}],
+    }
+    modules = types.SimpleNamespace(html=html)
+    functions = htexpr.compile_many(sources, workers=workers, modules=modules, params=["x"])
+    assert functions[3].eval()(2)["children"][0] == 2
+    broken = sources[:3] + ["<div>", "<p>{(}</p>"] + sources[3:]
+    with pytest.raises(HtexprError, match="cannot compile template 3 [(]and 1 more[)]") as info:
+        htexpr.compile_many(broken, workers=workers, parser="scanner")
+    assert list(info.value.errors) == [3, 4]
+    assert all(isinstance(e, HtexprError) for e in info.value.errors.values())
+    # components are resolved after the templates have been compiled
+    htexpr.compile_cache.clear()
+    missing = types.SimpleNamespace(html=types.SimpleNamespace(Div=Div))
+    broken = [f"<div id='{i}'>{{x}}</div>" for i in range(8)] + ["<div><span/></div>"]
+    with pytest.raises(HtexprError, match="cannot compile template 8: cannot resolve") as info:
+        htexpr.compile_many(broken, workers=workers, modules=missing)
+    assert list(info.value.errors) == [8]
+
+
+RENDER_CONSTANT = 10
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_render_many(workers):
+    row = compile("<tr><td>{i}</td><td>{math.sqrt(j) + RENDER_CONSTANT}</td></tr>", backend="html")
+    bindings = ({"i": i, "j": i * i} for i in range(20))
+    rows = row.render_many(bindings, workers=workers, chunksize=3, threshold=5)
+    assert rows == [f"<tr><td>{i}</td><td>{i + 10.0}</td></tr>" for i in range(20)]
+    assert row.render_many([], workers=workers) == []
+    # differing names, each of which shadows the globals
+    mixed = [{"i": 1, "j": 4}, {"i": 2, "j": 9, "RENDER_CONSTANT": 0}, {"i": 3, "j": 16}]
+    assert row.render_many(mixed, workers=workers, threshold=2) == [
+        "<tr><td>1</td><td>12.0</td></tr>",
+        "<tr><td>2</td><td>3.0</td></tr>",
+        "<tr><td>3</td><td>14.0</td></tr>",
+    ]
+    cell = compile("<td class={c}>{i * scale}</td>", params=("i",), backend="json")
+    cells = cell.render_many(
+        [{"i": i} for i in range(10)],
+        workers=workers,
+        threshold=2,
+        globals={"c": "x", "scale": 2},
+    )
+    assert [c["props"]["children"] for c in cells] == [[i] for i in range(0, 20, 2)]
+    with pytest.raises(ZeroDivisionError):
+        compile("<td>{1 / i}</td>", backend="html").render_many(
+            [{"i": 1}, {"i": 0}], workers=workers, threshold=1
+        )
+
+
+def test_render_many_shutdown():
+    from htexpr.htexpr import _executor, _executors
+
+    htexpr.shutdown()
+    pools = []
+    threads = [threading.Thread(target=lambda: pools.append(_executor(2))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(_executors) == 1 and all(pool is pools[0] for pool in pools)
+    row = compile("<td>{i}</td>", backend="html")
+    bindings = [{"i": i} for i in range(4)]
+    assert row.render_many(bindings, workers=2, threshold=1) == [f"<td>{i}</td>" for i in range(4)]
+    htexpr.shutdown()
+    assert not _executors
+    with pytest.raises(RuntimeError):
+        pools[0].submit(int)
+    assert row.render_many(bindings, workers=2, threshold=1) == [f"<td>{i}</td>" for i in range(4)]
+    assert _executors[os.getpid(), 2] is not pools[0]
+
+
+def test_render_many_fallback():
+    # local components cannot be pickled, so they are evaluated in this process
+    html = types.SimpleNamespace(Div=Div)
+    items = [{"i": i} for i in range(4)]
+    divs = compile("<div>{i}</div>").render_many(
+        items, workers=2, threshold=1, globals={"html": html}
+    )
+    assert divs == [{"tag": "Div", "children": [i]} for i in range(4)]
+    # so are bindings that cannot be pickled, even after the first chunk
+    items[-1] = {"i": threading.Lock()}
+    locked = compile("<td>{type(i).__name__}</td>", backend="html").render_many(
+        items, workers=2, chunksize=1, threshold=1
+    )
+    assert locked == ["<td>int</td>"] * 3 + [f"<td>{type(threading.Lock()).__name__}</td>"]
+
+
+AOT_SOURCE = """
+import htexpr
+from htexpr import compile as hc
+from htexpr import mappings
+
+first = htexpr.compile("<div>{x}</div>", map_attribute={"class": "klass"})
+second = hc("<div class={x}/>", params=["x"])
+dynamic = htexpr.compile("<div/>", map_attribute=mappings.default_attributes)
+"""
+
+
+def test_aot_transform():
+    tree, count = aot.transform(AOT_SOURCE)
+    assert count == 2
+    calls = [node for node in ast.walk(tree) if isinstance(node, ast.Call)]
+    assert sum(isinstance(c.func, ast.Attribute) and c.func.attr == "load" for c in calls) == 2
+    namespace = {}
+    exec(builtins.compile(tree, "<aot>", "exec"), namespace)
+    html = types.SimpleNamespace(Div=Div)
+    assert namespace["first"].names == ("html", "x")
+    assert namespace["first"].eval({"html": html, "x": 1}) == {"children": [1], "tag": "Div"}
+    assert namespace["first"] is compile("<div>{x}</div>", map_attribute={"class": "klass"})
+    assert namespace["second"].as_function(globals={"html": html})(2) == {
+        "className": 2,
+        "tag": "Div",
+    }
+    assert namespace["dynamic"].html == "<div/>"
+
+
+def test_aot_load_version_mismatch():
+    data = marshal.dumps((0, "0.0", {}))
+    assert aot.load(data, "<div/>").names == ("html",)
+    with pytest.raises(TypeError):
+        aot.dumps("<div/>", modules={})
+
+
+def test_aot_build_and_import(tmp_path, monkeypatch):
+    module = tmp_path / "aot_example.py"
+    module.write_text(AOT_SOURCE)
+    assert aot.main(["-q", str(tmp_path)]) == 0
+    pyc = importlib.util.cache_from_source(str(module))
+    assert b"htexpr.aot" in open(pyc, "rb").read()
+
+    loaded = []
+
+    def load(data, html, **options):
+        loaded.append(html)
+        return aot_load(data, html, **options)
+
+    aot_load = aot.load
+    monkeypatch.setattr(aot, "load", load)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, "aot_example", raising=False)
+    imported = importlib.import_module("aot_example")
+    assert imported.first.html == "<div>{x}</div>"
+    assert loaded == ["<div>{x}</div>", "<div class={x}/>"]
+
+    module.write_text(AOT_SOURCE + "\nthird = htexpr.compile('<span/>')\n")
+    os.unlink(pyc)
+    monkeypatch.delitem(sys.modules, "aot_example")
+    aot.install("aot_example")
+    try:
+        imported = importlib.import_module("aot_example")
+    finally:
+        aot.uninstall()
+    assert isinstance(imported.__loader__, aot.Loader)
+    assert imported.third.html == "<span/>"
+    assert loaded[2:] == ["<div>{x}</div>", "<div class={x}/>", "<span/>"]
+
+
+def test_lazy_imports():
+    code = (
+        "import sys, htexpr, htexpr.aot; "
+        "print(sorted({m.split('.')[0] for m in sys.modules} & "
+        "{'parsimonious', 'regex', 'toolz', 'hashlib', 'tempfile', 'argparse', 'html'}))"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    assert result.stdout.strip() == "[]", result.stderr
+    assert htexpr.htexpr._grammar is htexpr.grammar._grammar
+    with pytest.raises(AttributeError):
+        htexpr.htexpr.no_such_name
+
+
+def test_curry():
+    assert mappings.html("html") == mappings.html("html")
+    assert mappings.html("html")("div") == mappings.html("html", "div") == ("html", "Div")
+    assert mappings.html(module="html")("div") == ("html", "Div")
+    assert mappings.html("html", tag="div") == ("html", "Div")
+    assert mappings.html(tag="div")(module="html") == ("html", "Div")
+    assert mappings.html(module="html") == mappings.html(module="html")
+    with pytest.raises(TypeError):
+        mappings.html("html", "div", "extra")
+
+    @mappings.curry
+    def f(module, tag, upper=False, *, suffix=""):
+        return module, (tag.upper() if upper else tag) + suffix
+
+    assert f("m")("div") == ("m", "div")
+    assert f("m")("div", True) == ("m", "DIV")
+    assert f("m", upper=True)("div") == ("m", "DIV")
+    assert f(tag="div", suffix="!")("m") == ("m", "div!")
+    assert mappings._lookup("div", f("m")) == ("m", "div")
+
+    @mappings.curry
+    def g(module, *, tag):
+        return module, tag
+
+    assert isinstance(g("m"), functools.partial)
+    assert g("m")(tag="div") == ("m", "div")
+    assert pickle.loads(pickle.dumps(mappings.default)) == mappings.default
+
+
+def test_timing(tmp_path):
+    source = "<div>[(<span>{i}</span>) for i in range(n)]</div>"
+    with timing.record() as records:
+        Htexpr(source)
+        Htexpr(source, parser="scanner", cache_dir=tmp_path)
+    assert not timing._listeners
+    stages = ["to_ast", "wrap_ast", "fix_missing_locations", "compile", "free_names"]
+    assert [r.stage for r in records] == ["parse", "simplify", *stages, "load", "scan", *stages]
+    assert all(r.html == source and r.seconds >= 0 for r in records)
+    assert list(timing.totals(records)) == [source]
+    by_stage = timing.totals(records, "stage")
+    assert by_stage["compile"][0] == sum(r.seconds for r in records if r.stage == "compile")
+    assert list(by_stage.values()) == sorted(by_stage.values(), key=lambda v: -v[0])
+
+    seen = []
+    with timing.listen(seen.append):
+        Htexpr(source, cache_dir=tmp_path)
+    assert [r.stage for r in seen] == ["load"]
+    assert timing.stage_runner() is timing.untimed
+
+
+@pytest.mark.parametrize("parser", ["parsimonious", "scanner"])
+def test_profile(parser):
+    source = "<div id={x}>\n  <ul>[(<li>{i}</li>) for i in range(n)]</ul>\n  <span>x</span>\n</div>"
+    profiling.profiles.pop(source, None)
+    template = Htexpr(source, parser=parser, profile=True)
+    assert template.names == ("html", "n", "range", "x")
+    html = types.SimpleNamespace(Div=Div, Span=Span, Ul=Div, Li=Span)
+    expected = Htexpr(source).eval({"html": html, "n": 3, "x": 1})
+    assert template.eval({"html": html, "n": 3, "x": 1}) == expected
+    ul, li, span = (source.index(tag) for tag in ("<ul>", "<li>", "<span>"))
+    assert {key: calls for key, (calls, _) in template.profile.stats.items()} == {
+        0: 1,
+        (0, "id"): 1,
+        ul: 1,
+        (ul, 0): 1,
+        li: 3,
+        (li, 0): 3,
+        span: 1,
+    }
+    # templates from the same source share the profile
+    template.as_function("n", globals={"html": html, "x": 1})(2)
+    assert template.profile.stats[li][0] == 5
+    entries = template.profile.entries()
+    assert entries[0].key == 0 and (entries[0].line, entries[0].column) == (1, 1)
+    assert entries == sorted(entries, key=lambda entry: -entry.seconds)
+    assert "children[0]" in template.profile.report()
+    template.profile.clear()
+    assert not template.profile.stats
+    assert Htexpr(source).profile is None
+
+
+def test_nested_regions():
+    source = (
+        "<div a={(<i/>)}>"
+        + "<p>{(<b>{(<i/>) if x else (<u>[(<s/>) for s in y]</u>)}</b>)}</p>" * 300
+        + "{f((<i/>), (<b/>))}</div>"
+    )
+    visitor = SimplifyVisitor()
+    tree = visitor.visit(parse(source))
+    assert tree == scan(source)
+    regions = [child[1] for child in tree["content"] if isinstance(child, tuple)]
+    assert [text for text, subtree in regions[-1]] == ["f(", "(<i/>)", ", ", "(<b/>)", ")"]
+    # only the element nested in the attribute value is left unclaimed
+    assert [start for start, _, _ in visitor.nested] == [source.index("(<i/>)")]
+
+
+def _nested_template(depth):
+    inner = "<span id={x}>[(<b>{i}</b>) for i in range(2)]</span>"
+    return "".join(f'<div class="d{i}">' for i in range(depth)) + inner + "</div>" * depth
+
+
+def _depth(value):
+    depth = 0
+    while isinstance(value, dict) and value.get("tag") == "Div":
+        value = value["children"][0]
+        depth += 1
+    return depth, value
+
+
+@pytest.mark.skipif(
+    sys.version_info >= (3, 12), reason="the compiler limits the depth of syntax trees"
+)
+def test_deep_template():
+    depth = 3000
+    template = Htexpr(_nested_template(depth), parser="scanner")
+    html = types.SimpleNamespace(Div=Div, Span=Span, B=H1)
+    assert _depth(template.eval({"html": html, "x": 1})) == (
+        depth,
+        {
+            "id": 1,
+            "tag": "Span",
+            "children": [{"tag": "H1", "children": [0]}, {"tag": "H1", "children": [1]}],
+        },
+    )
+
+
+def test_deep_template_threads():
+    # compiling deep templates concurrently leaves the limits as they were
+    limit = sys.getrecursionlimit()
+    size = threading.stack_size()
+    errors = []
+
+    def target():
+        try:
+            Htexpr(_nested_template(600), parser="scanner")
+        except RecursionError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=target) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sys.getrecursionlimit() == limit and threading.stack_size() == size
+    assert sys.version_info >= (3, 12) or not errors
+
+
+def test_wide_template():
+    width = 10000
+    source = "<div>" + "<p>{i}<b>x</b></p>" * width + "</div>"
+    template = Htexpr(source, parser="scanner")
+    html = types.SimpleNamespace(Div=Div, P=Span, B=H1)
+    assert len(template.eval({"html": html, "i": 1})["children"]) == width
+
+
+def test_passes_without_recursion():
+    source = _nested_template(100)
+    tree = parse(source)
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(len(inspect.stack()) + 60)
+    try:
+        simplified = simplify(tree)
+        body = to_ast(simplified)
+        code = htexpr.htexpr.fix_missing_locations(wrap_ast(body))
+        names = htexpr.htexpr.free_names(code)
+    finally:
+        sys.setrecursionlimit(limit)
+    assert simplified == scan(source)
+    assert names == ("html", "range", "x")
+    html = types.SimpleNamespace(Div=Div, Span=Span, B=H1)
+    value = eval(builtins.compile(code, "<test>", "eval"), {"html": html, "x": 1})
+    assert _depth(value)[0] == 100
+
+
+def test_hoist():
+    source = (
+        '<table><thead><tr><th rowspan="2">A</th><th>B</th></tr></thead>'
+        "<tbody>[(<tr><td>{i}</td><td>x</td></tr>) for i in range(n)]</tbody></table>"
+    )
+    calls = []
+
+    def counted(component):
+        def call(**kwargs):
+            calls.append(component.__name__)
+            return component(**kwargs)
+
+        return call
+
+    html = types.SimpleNamespace(
+        **{tag: counted(Div) for tag in ("Table", "Thead", "Tbody", "Tr", "Th", "Td")}
+    )
+    template = Htexpr(source, hoist=True)
+    assert template.names == ("html", "n", "range")
+    expected = Htexpr(source).eval({"html": html, "n": 2})
+    del calls[:]
+    first = template.eval({"html": html, "n": 2})
+    assert first == expected
+    # the static cell is only built in the first iteration
+    assert len(calls) == 11
+    del calls[:]
+    second = template.eval({"html": html, "n": 2})
+    assert second == expected
+    # the thead and the static cells are not built again
+    assert calls == ["Div"] * 6
+    # the copies are independent of the constants
+    second["children"][0]["children"].append("modified")
+    assert template.eval({"html": html, "n": 2}) == expected
+    assert len(template.constants.values) == 2
+    # different components rebuild the constants
+    other = types.SimpleNamespace(**{k: Span for k in vars(html)})
+    assert template.eval({"html": other, "n": 1}) == Htexpr(source).eval({"html": other, "n": 1})
+    assert Htexpr(source).constants is None
+
+
+def test_hoist_options(tmp_path):
+    html = types.SimpleNamespace(Div=Div, Span=Span)
+    source = "<div><span>a</span>{x}</div>"
+    expected = {"tag": "Div", "children": [{"tag": "Span", "children": ["a"]}, 1]}
+    for template in (
+        Htexpr(source, hoist=True, modules={"html": html}),
+        Htexpr(source, hoist=True, cache_dir=tmp_path),
+        Htexpr(source, hoist=True, cache_dir=tmp_path),
+        Htexpr(source, hoist=True, profile=True),
+        aot.load(aot.dumps(source, hoist=True), source, hoist=True),
+    ):
+        assert template.eval({"html": html, "x": 1}) == expected
+    assert Htexpr(source, hoist=True, params=("x",)).eval({"html": html})(1) == expected
+    # a fully static template is a single constant
+    template = Htexpr("<span>a</span>", hoist=True)
+    assert template.eval({"html": html}) == {"tag": "Span", "children": ["a"]}
+    assert list(template.constants.values) == [0]
+
+
+def test_clone():
+    class Component:
+        def __init__(self, children=None, **props):
+            self.children = children
+            self.props = props
+
+    value = Component([Component(["a"], style={"color": "red"}), "b", (1, 2)], id="x")
+    copy = hoisting.clone(value)
+    assert copy is not value and type(copy) is Component
+    assert copy.children is not value.children and copy.children[0] is not value.children[0]
+    assert copy.children[0].props == {"style": {"color": "red"}}
+    assert copy.children[0].props["style"] is not value.children[0].props["style"]
+    assert copy.children[2] is value.children[2]
+    assert hoisting.clone("a") == "a" and hoisting.clone(Component) is Component
+    deep = []
+    for _ in range(10000):
+        deep = [deep]
+    copy = hoisting.clone(deep)
+    for _ in range(10000):
+        assert copy is not deep and len(copy) == 1
+        copy, deep = copy[0], deep[0]
+
+
+@pytest.mark.parametrize("parser", ["parsimonious", "scanner"])
+def test_collapse_whitespace(parser):
+    source = """<div>
+      <h1>Unicode   table</h1>
+      Some text
+        continued {x}   and <span>bold</span> text
+      <pre>  a
+       b </pre>
+      {x} {(<Textarea>{x}  y\n  {x}</Textarea>)}
+    </div>"""
+    html = types.SimpleNamespace(Div=Div, Span=Span, H1=H1, Pre=Div, Textarea=Div)
+    template = Htexpr(source, parser=parser, whitespace="collapse")
+    assert template.eval({"html": html, "x": 1}) == {
+        "tag": "Div",
+        "children": [
+            {"tag": "H1", "children": ["Unicode table"]},
+            "Some text continued ",
+            1,
+            " and ",
+            {"tag": "Span", "children": ["bold"]},
+            "text ",
+            {"tag": "Div", "children": ["a\n       b"]},
+            1,
+            {"tag": "Div", "children": [1, "  y\n  ", 1]},
+        ],
+    }
+    preserved = Htexpr(source, parser=parser).eval({"html": html, "x": 1})
+    assert preserved["children"][1] == "Some text\n        continued "
+    with pytest.raises(HtexprError, match="unknown whitespace mode"):
+        Htexpr(source, whitespace="strip")
+
+
+@pytest.mark.parametrize("parser", ["parsimonious", "scanner"])
+def test_inject_keys(parser):
+    source = """<ul>
+      <li>first</li>
+      [(<li id={row.id}>{row.name}</li>) if row.name else (<li />)
+       for row in rows]
+      [(<li>{a}</li>) for a, b in pairs for c in "x"]
+      [(<li key="fixed">{z}</li>) for z in [1]]
+      {[(<li>{n}</li>) for n in [2]]}
+    </ul>"""
+    rows = [types.SimpleNamespace(id="a", name="A"), types.SimpleNamespace(id="b", name="")]
+    bindings = {"rows": rows, "pairs": [(1, 2)]}
+
+    def keys(template):
+        html = types.SimpleNamespace(Ul=Div, Li=Span)
+        ul = template.eval({"html": html, **bindings})
+        children = ul["children"][:-1] + ul["children"][-1]
+        return [child.get("key") for child in children if isinstance(child, dict)]
+
+    assert keys(Htexpr(source, parser=parser)) == [None, None, None, None, "fixed", None]
+    by_target = keys(Htexpr(source, parser=parser, keys=True))
+    assert by_target[:4] == [None, str(rows[0]), str(rows[1]), "((1, 2), 'x')"]
+    assert by_target[4:] == ["fixed", None]
+    by_id = keys(Htexpr(source, parser=parser, keys="id"))
+    assert by_id[:3] == [None, "a", str(rows[1])]
+    literal = Htexpr(
+        "<ul>[(<li id='x'>{i}</li>) for i in range(2)]</ul>", keys="id", backend="json"
+    )
+    assert [li["props"]["key"] for li in literal.eval()["props"]["children"]] == ["x", "x"]
+    with pytest.raises(HtexprError, match="html backend"):
+        Htexpr(source, keys=True, backend="html")
+
+
+@pytest.mark.parametrize("parser", ["parsimonious", "scanner"])
+def test_json_backend(parser):
+    source = (
+        '<div class="x" data-y={y}><p>hi {y}</p><Graph id="g"/>'
+        "[(<li>{i}</li>) for i in range(2)]<br/></div>"
+    )
+    template = Htexpr(source, parser=parser, backend="json")
+    assert template.names == ("range", "y")
+    assert template.eval({"y": 1}) == {
+        "type": "Div",
+        "namespace": "dash_html_components",
+        "props": {
+            "children": [
+                {
+                    "type": "P",
+                    "namespace": "dash_html_components",
+                    "props": {"children": ["hi ", 1]},
+                },
+                {"type": "Graph", "namespace": "dash_core_components", "props": {"id": "g"}},
+                {"type": "Li", "namespace": "dash_html_components", "props": {"children": [0]}},
+                {"type": "Li", "namespace": "dash_html_components", "props": {"children": [1]}},
+                {"type": "Br", "namespace": "dash_html_components", "props": {}},
+            ],
+            "className": "x",
+            "data-y": 1,
+        },
+    }
+    assert Htexpr("<Card>x</Card>", map_tag={"Card": ("dbc", "Card")}, backend="json").eval() == {
+        "type": "Card",
+        "namespace": "dash_bootstrap_components",
+        "props": {"children": ["x"]},
+    }
+    assert Htexpr("<b/>", map_tag=mappings.html("dash_html_components"), backend="json").eval() == {
+        "type": "B",
+        "namespace": "dash_html_components",
+        "props": {},
+    }
+    with pytest.raises(HtexprError, match="unknown backend"):
+        Htexpr(source, backend="xml")
+    with pytest.raises(HtexprError, match="modules cannot be resolved"):
+        Htexpr(source, backend="json", modules={})
+
+
+@pytest.mark.parametrize("parser", ["parsimonious", "scanner"])
+def test_html_backend(parser):
+    source = """<div class="a&b" id={x} hidden={True} title={None}
+                     style={ {"fontSize": "12px", "color": "red"} }>
+      <h1>Title &amp; <i>more</i></h1>
+      <p className="c" rowSpan="2">{y}</p>
+      <ul>[(<li>{i}</li>) for i in range(n)]</ul>
+      <img src="a.png"/><br></br>
+      {inner}
+    </div>"""
+    template = Htexpr(source, parser=parser, backend="html")
+    assert template.names == ("inner", "n", "range", "x", "y")
+    inner = Htexpr("<b>{z}</b>", backend="html").eval({"z": ["<z>", 1, None, False]})
+    assert inner == "<b>&lt;z&gt;1</b>" and isinstance(inner, htexpr.markup.Markup)
+    assert template.eval({"x": 1, "y": "<script>", "n": 2, "inner": inner}) == (
+        '<div class="a&amp;b" id="1" hidden style="font-size: 12px; color: red">'
+        "<h1>Title &amp;amp; <i>more</i></h1>"
+        '<p class="c" rowspan="2">&lt;script&gt;</p>'
+        "<ul><li>0</li><li>1</li></ul>"
+        '<img src="a.png"><br>'
+        "<b>&lt;z&gt;1</b></div>"
+    )
+    with pytest.raises(HtexprError, match="void element <br> cannot have children"):
+        Htexpr("<br>x</br>", backend="html")
+
+
+def test_html_backend_options():
+    source = "<p>a{x}<b>c</b></p>"
+    for options in (dict(hoist=True), dict(profile=True), dict(whitespace="collapse")):
+        assert Htexpr(source, backend="html", **options).eval({"x": "&"}) == "<p>a&amp;<b>c</b></p>"
+    assert Htexpr(source, backend="html", params=("x",)).eval()(1) == "<p>a1<b>c</b></p>"
+    payload = aot.dumps(source, backend="html")
+    assert aot.load(payload, source, backend="html").eval({"x": 2}) == "<p>a2<b>c</b></p>"
+    # large children are not inlined into their parents
+    wide = "<div>" + "<p>{x}<b>c</b></p>" * 100 + "</div>"
+    template = Htexpr(f"<section>{wide}{wide}</section>", backend="html")
+    div = "<div>" + "<p>1<b>c</b></p>" * 100 + "</div>"
+    assert template.eval({"x": 1}) == f"<section>{div}{div}</section>"
+
+
+PATCH_SOURCE = """
+<table>
+  <tr class={header}><th>name</th><th>value</th></tr>
+  [(<tr key={name}><td>{name}</td><td style={style}>{value}</td></tr>) for name, value in rows]
+</table>"""
+
+
+def _rendered(rows, header="h", style={"color": "red"}):
+    template = compile(PATCH_SOURCE, backend="json")
+    return template.eval({"rows": rows, "header": header, "style": style})
+
+
+def _patched(old, new, match="key"):
+    operations = patch.diff(old, new, match)
+    return operations, patch.apply(operations, copy.deepcopy(old))
+
+
+def test_diff():
+    rows = [(f"r{i}", i) for i in range(10)]
+    old = _rendered(rows)
+    assert patch.diff(old, _rendered(rows)) == []
+    changed = rows[:3] + [("r3", 30)] + rows[4:]
+    operations, result = _patched(old, _rendered(changed))
+    assert result == _rendered(changed)
+    assert operations == [
+        ("assign", ("props", "children", 4, "props", "children", 1, "props", "children", 0), 30)
+    ]
+    # keyed rows are inserted, deleted and moved without touching the others
+    for new in (
+        rows[:5] + [("new", 0)] + rows[5:],
+        rows[1:],
+        rows[:2] + rows[3:8] + [rows[2]] + rows[8:],
+        list(reversed(rows)),
+        [],
+        [("a", 1), ("b", 2)],
+    ):
+        operations, result = _patched(old, _rendered(new))
+        assert result == _rendered(new)
+    operations, _ = _patched(old, _rendered(rows[:5] + [("new", 0)] + rows[5:]))
+    assert [op.action for op in operations] == ["insert"]
+    operations, _ = _patched(old, _rendered(rows[:2] + rows[3:8] + [rows[2]] + rows[8:]))
+    assert [op.action for op in operations] == ["delete", "insert"]
+    # matched by position, an insertion changes every row after it
+    new = _rendered([("new", 0)] + rows)
+    operations, result = _patched(old, new, match="position")
+    assert result == new and len(operations) == 30
+    # props, types and the root
+    operations, result = _patched(old, _rendered(rows, header=None, style={"color": "blue"}))
+    assert result == _rendered(rows, header=None, style={"color": "blue"})
+    assert len(operations) == 11
+    bare = copy.deepcopy(old)
+    del bare["props"]["children"][0]["props"]["className"]
+    assert _patched(old, bare)[0] == [
+        ("delete", ("props", "children", 0, "props", "className"), None)
+    ]
+    assert _patched(bare, old)[1] == old
+    span = {"type": "Span", "namespace": "dash_html_components", "props": {}}
+    assert patch.diff(old, span) == [("assign", (), span)]
+    with pytest.raises(HtexprError, match="root"):
+        patch.apply(patch.diff(old, span), old)
+
+
+def test_patcher(monkeypatch):
+    class Patch:
+        def __init__(self, location=(), operations=None):
+            self.location = location
+            self.operations = [] if operations is None else operations
+
+        def __getitem__(self, key):
+            return Patch(self.location + (key,), self.operations)
+
+        def __setitem__(self, key, value):
+            self.operations.append(("assign", self.location + (key,), value))
+
+    monkeypatch.setitem(sys.modules, "dash", types.SimpleNamespace(Patch=Patch))
+    patcher = patch.Patcher(compile("<div>{x}<p>{y}</p></div>", backend="json"), maxsize=2)
+    first = patcher.eval("a", {"x": 1, "y": 2})
+    assert first["props"]["children"][0] == 1
+    assert patcher.eval("a", {"x": 1, "y": 2}).operations == []
+    assert patcher.eval("a", {"x": 3, "y": 2}).operations == [
+        ("assign", ("props", "children", 0), 3)
+    ]
+    assert patch.patch(first, [1]) == [1]
+    patcher.eval("b", {"x": 1, "y": 2})
+    patcher.eval("c", {"x": 1, "y": 2})
+    assert patcher.trees.get("a") is None
+    assert isinstance(patcher.eval("a", {"x": 1, "y": 2}), dict)